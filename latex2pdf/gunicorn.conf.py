@@ -0,0 +1,119 @@
+"""
+Gunicorn configurations, used by ``gunicorn -c gunicorn.conf.py``.
+
+Workers and threads are sized from the number of CPUs available to the
+container, and can be overridden by the environment variables below.
+
+- L2P_GUNICORN_BIND: Default to "0.0.0.0:8011".
+- L2P_GUNICORN_WORKERS: Default to CPUs + 1. Compiles (latexmk and
+  xelatex, run in subprocesses of the workers) are CPU bound, and each
+  worker runs at most L2P_MAX_CONCURRENT_COMPILES (a Django setting,
+  default to 1) compiles at once, so compiles use about all the CPUs
+  without oversubscribing them. Raise the workers together with a lower
+  compile limit only if the workers mostly serve pdfs.
+- L2P_GUNICORN_THREADS: Default to 4. Threads per worker, which serve
+  uploads, downloads and other I/O bound requests concurrently, also
+  while a compile of the worker is running.
+- L2P_GUNICORN_MAX_REQUESTS: Default to 1000. A worker is restarted after
+  this number of requests (plus a random jitter of up to
+  L2P_GUNICORN_MAX_REQUESTS_JITTER, default to 10% of it, so that workers
+  don't restart all at once), to release memory retained by PyMuPDF.
+  0 to disable.
+- L2P_GUNICORN_MAX_WORKER_RSS_MB: Default to 0 (no limit). A worker is
+  also restarted after a request when its peak RSS exceeds this size.
+- L2P_GUNICORN_TIMEOUT: Default to 300. Seconds after which a silent worker
+  is killed, which must be longer than the longest compile.
+- L2P_GUNICORN_GRACEFUL_TIMEOUT: Default to 30.
+- L2P_GUNICORN_KEEPALIVE: Default to 5. Seconds to keep connections from
+  nginx alive.
+"""
+
+import multiprocessing
+import os
+
+
+def get_env_int(name, default):
+    value = os.environ.get(name, "").strip()
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError("%s must be an int, got %r" % (name, value))
+
+
+def get_cgroup_cpu_limit():
+    """
+    The cpu limit of the container, from the cgroup (v2 or v1) cpu quota,
+    or None if there's no limit.
+    """
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return None
+
+    if quota in ("max", "-1"):
+        return None
+    try:
+        return max(1, int(int(quota) / int(period) + 0.5))
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def get_cpu_count():
+    try:
+        cpu_count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpu_count = multiprocessing.cpu_count()
+
+    cgroup_limit = get_cgroup_cpu_limit()
+    if cgroup_limit is not None:
+        cpu_count = min(cpu_count, cgroup_limit)
+    return cpu_count
+
+
+cpu_count = get_cpu_count()
+
+bind = os.environ.get("L2P_GUNICORN_BIND", "0.0.0.0:8011")
+
+worker_class = "gthread"
+workers = get_env_int("L2P_GUNICORN_WORKERS", cpu_count + 1)
+threads = get_env_int("L2P_GUNICORN_THREADS", 4)
+
+max_requests = get_env_int("L2P_GUNICORN_MAX_REQUESTS", 1000)
+max_requests_jitter = get_env_int(
+    "L2P_GUNICORN_MAX_REQUESTS_JITTER", max_requests // 10)
+max_worker_rss_mb = get_env_int("L2P_GUNICORN_MAX_WORKER_RSS_MB", 0)
+
+timeout = get_env_int("L2P_GUNICORN_TIMEOUT", 300)
+graceful_timeout = get_env_int("L2P_GUNICORN_GRACEFUL_TIMEOUT", 30)
+keepalive = get_env_int("L2P_GUNICORN_KEEPALIVE", 5)
+
+# Import the app once in the master, see latex2pdf/wsgi.py
+preload_app = True
+
+# The heartbeat files of workers, which must not block on a slow disk
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+
+def post_request(worker, req, environ, resp):
+    if not max_worker_rss_mb:
+        return
+
+    import resource
+
+    # In kilobytes on Linux
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    if peak_rss_mb > max_worker_rss_mb:
+        worker.log.info(
+            "Restarting worker (pid: %s) with a peak RSS of %d MB",
+            worker.pid, peak_rss_mb)
+        worker.alive = False
@@ -23,18 +23,31 @@ THE SOFTWARE.
 """
 
 import sys
+import time
 
 from django.core.exceptions import ImproperlyConfigured
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import F, Q
+from django.utils.dateparse import parse_datetime
+from django.utils.timezone import is_naive, make_aware
 
 from rest_framework.parsers import JSONParser, MultiPartParser, ParseError
 from rest_framework import generics, permissions, status, viewsets
 from rest_framework.response import Response
-from rest_framework.renderers import JSONRenderer, MultiPartRenderer
-
+from rest_framework.exceptions import NotFound
+from rest_framework.renderers import (
+    BaseRenderer, JSONRenderer, MultiPartRenderer)
+from rest_framework.pagination import CursorPagination
+from rest_framework.views import APIView
+
+from latex.metrics import (
+    CACHE_HITS, CACHE_MISSES, CACHE_NEGATIVE_HITS, CACHE_FILLS,
+    CACHE_OVERSIZE_SKIPS, CACHE_LOOKUP_SECONDS, get_metrics_view_name,
+    is_metrics_enabled, render_metrics)
 from latex.models import LatexProject, LatexCollection, LatexPdf
 from latex.permissions import IsPrivateOrReadOnly
+from latex.repository import get_repository
+from latex.routers import pin_to_primary
 from latex.serializers import (
     LatexProjectSerializer, LatexCollectionSerializer, LatexPdfSerializer)
 from latex.converter import (
@@ -61,6 +74,7 @@ class L2PCollectionViewSet(viewsets.ModelViewSet):
         return LatexCollection.objects.filter(Q(project__creator=self.request.user) | Q(project__is_private=False))
 
     def create(self, request, *args, **kwargs):
+        pin_to_primary()
         if 'file' not in request.data:
             raise ParseError("Empty content")
         file = request.data["file"]
@@ -84,70 +98,208 @@ class L2PCollectionRenderer(JSONRenderer):
         return super().render(data, accepted_media_type, renderer_context)
 
 
+# The pseudo field of the cached (sorted) list of the pks of the creators of
+# the projects with collections of a zip file hash, which is deleted when
+# such collections are created or deleted, see latex/receivers.py.
+CREATOR_IDS_CACHE_FIELD = "creator_ids"
+
 
 def get_field_cache_key(zip_file_hash, field_name):
     return "%s:%s" % (zip_file_hash, field_name)
 
 
-def get_cached_attribute_by_tex_key(zip_file_hash, attr, request):
+def get_cache_key_field(cache_key):
+    return cache_key.rsplit(":", 1)[-1]
+
+
+def get_pdf_cache_items(pdf_instances, view="unknown"):
+    """
+    Return a dict of cache items (with keys built by
+    :func:`get_field_cache_key`) of `pdf_instances`, which can be put into
+    the cache by ``set_many``. This is used when no request is available
+    (e.g., on model save and when warming the cache), so we can only cache
+    pdf relative paths.
+    """
+    if not getattr(settings, "L2P_API_PDF_RETURNS_RELATIVE_PATH", True):
+        # We only cache when pdf relative path are requested in api
+        # because we can't access the request thus no way to know
+        # the url and can't build the pdf url.
+        return {}
+
+    max_bytes = getattr(settings, "L2P_CACHE_MAX_BYTES", 0)
+
+    items = {}
+    for instance in pdf_instances:
+        data = LatexPdfSerializer(instance).to_representation(instance)
+        attr_value = data["pdf"]
+        if attr_value is None:
+            continue
+        if len(str(attr_value)) > max_bytes:
+            CACHE_OVERSIZE_SKIPS.inc(field="pdf", view=view)
+            continue
+        items[get_field_cache_key(
+            instance.collection.zip_file_hash, "pdf")] = attr_value
+
+    return items
+
+
+def get_cached_attributes_by_tex_keys(zip_file_hashes, attrs, request,
+                                      creator_id=None):
+    """
+    Bulk version of :func:`get_cached_attribute_by_tex_key`.
+
+    Hits are resolved with a single ``get_many`` on the cache, and all the
+    misses are resolved with a single ``__in`` query (plus one more query
+    for compile errors if some keys are still unresolved), then the cache
+    is back-filled with ``set_many``.
+
+    If `creator_id` is not None, only the keys of projects created by that
+    user are looked up (the others are treated as not found). Since the
+    cache is keyed by zip file hash only, the creators of the projects of
+    each hash are also cached (see ``CREATOR_IDS_CACHE_FIELD``) and
+    fetched by the same ``get_many``, so that a fully cached request doesn't
+    query the database. Creators not cached yet cost one more query.
+
+    :return: a dict mapping each of the `zip_file_hashes` to a result dict,
+     which is empty if no such object was found.
+    """
     try:
         import django.core.cache as cache
 
         def_cache = cache.caches["default"]
-        cache_key = get_field_cache_key(zip_file_hash, attr)
     except ImproperlyConfigured:
-        cache_key = None
+        def_cache = None
+
+    view = get_metrics_view_name(request)
+    start = time.monotonic()
+
+    # remove duplicates while preserving order
+    zip_file_hashes = list(dict.fromkeys(zip_file_hashes))
+
+    fields = attrs + ["compile_error"]
+    if creator_id is not None:
+        fields.append(CREATOR_IDS_CACHE_FIELD)
+
+    cached = {}
+    if def_cache is not None:
+        cached = def_cache.get_many([
+            get_field_cache_key(zip_file_hash, field)
+            for zip_file_hash in zip_file_hashes
+            for field in fields])
+
+    to_cache = {}
+
+    lookup_hashes = zip_file_hashes
+    if creator_id is not None:
+        creator_ids = {}
+        for zip_file_hash in zip_file_hashes:
+            hash_creator_ids = cached.get(
+                get_field_cache_key(zip_file_hash, CREATOR_IDS_CACHE_FIELD))
+            if hash_creator_ids is not None:
+                creator_ids[zip_file_hash] = hash_creator_ids
+
+        unknown_hashes = [h for h in zip_file_hashes if h not in creator_ids]
+        if unknown_hashes:
+            fetched = get_repository().get_creator_ids_by_hashes(
+                unknown_hashes)
+            for zip_file_hash in unknown_hashes:
+                hash_creator_ids = sorted(fetched.get(zip_file_hash, ()))
+                creator_ids[zip_file_hash] = hash_creator_ids
+                to_cache[get_field_cache_key(
+                    zip_file_hash, CREATOR_IDS_CACHE_FIELD)] = hash_creator_ids
+
+        lookup_hashes = [
+            h for h in zip_file_hashes if creator_id in creator_ids[h]]
+
+    results = {}
+    misses = lookup_hashes
+
+    if def_cache is not None and lookup_hashes:
+        for zip_file_hash in lookup_hashes:
+            attr_values = [
+                cached.get(get_field_cache_key(zip_file_hash, attr))
+                for attr in attrs]
+            if all(value is not None for value in attr_values):
+                results[zip_file_hash] = dict(zip(attrs, attr_values))
+                for attr in attrs:
+                    CACHE_HITS.inc(field=attr, view=view)
+                continue
+
+            cached_compile_error = cached.get(
+                get_field_cache_key(zip_file_hash, "compile_error"))
+            if cached_compile_error is not None:
+                results[zip_file_hash] = {"compile_error": cached_compile_error}
+                for attr in attrs:
+                    CACHE_NEGATIVE_HITS.inc(field=attr, view=view)
+                continue
+
+            for attr, value in zip(attrs, attr_values):
+                if value is None:
+                    CACHE_MISSES.inc(field=attr, view=view)
+                else:
+                    CACHE_HITS.inc(field=attr, view=view)
 
-    result_dict = {}
+        misses = [h for h in lookup_hashes if h not in results]
 
-    if cache_key is not None:
-        # def_cache.delete(cache_key)
-        ret_value = def_cache.get(cache_key)
+    max_bytes = getattr(settings, "L2P_CACHE_MAX_BYTES", 0)
+    outcome = "miss" if misses else "hit"
 
-        if ret_value is not None:
-            # print("Got value in cache!")
-            result_dict[attr] = ret_value
-            return result_dict
+    if misses:
+        serializer = LatexPdfSerializer(
+            fields=",".join(attrs), context={"request": request})
 
-        compile_error_cache_key = get_field_cache_key(zip_file_hash, "compile_error")
-        cached_compile_error = def_cache.get(compile_error_cache_key)
-        if cached_compile_error is not None:
-            return {"compile_error": cached_compile_error}
+        rows = {}
+        for row in get_repository().get_pdf_values_by_hashes(
+                misses, serializer.get_value_sources(), creator_id):
+            rows.setdefault(row["zip_file_hash"], row)
 
-    # print("Getting value from db")
+        for zip_file_hash, row in rows.items():
+            data = serializer.values_to_representation(row)
 
-    # Check db if it exists
-    objs = LatexPdf.objects.filter(project__zip_file_hash=zip_file_hash)
-    if not objs.count():
-        return None if request.method == "POST" else {}
+            result_dict = {}
+            for attr in attrs:
+                ret_value = data.get(attr, None)
+                if ret_value is None:
+                    continue
 
-    obj = objs[0]
+                result_dict[attr] = ret_value
 
-    serializer = LatexPdfSerializer(obj, fields=attr, context={"request": request})
+                # Ignore attribute value with size (byte) over
+                # L2P_CACHE_MAX_BYTES
+                if len(str(ret_value)) <= max_bytes:
+                    to_cache[get_field_cache_key(zip_file_hash, attr)] = ret_value
+                else:
+                    CACHE_OVERSIZE_SKIPS.inc(field=attr, view=view)
 
-    data = serializer.to_representation(obj)
+            results[zip_file_hash] = result_dict
 
-    compile_error = data.pop("compile_error", None)
-    if compile_error is not None:
-        result_dict["compile_error"] = compile_error
+        misses = [h for h in misses if h not in results]
 
-        if cache_key is not None:
-            compile_error_cache_key = get_field_cache_key(zip_file_hash, "compile_error")
-            def_cache.add(compile_error_cache_key, obj.compile_error, None)
-        return result_dict
+    if misses:
+        for zip_file_hash, compile_error in (
+                get_repository().get_compile_errors(misses, creator_id)):
+            results[zip_file_hash] = {"compile_error": compile_error}
+            to_cache[get_field_cache_key(
+                zip_file_hash, "compile_error")] = compile_error
 
-    ret_value = data.get(attr, None)
-    if ret_value is None:
-        return None if request.method == "POST" else {}
+    if def_cache is not None and to_cache:
+        def_cache.set_many(to_cache, None)
+        for cache_key in to_cache:
+            CACHE_FILLS.inc(field=get_cache_key_field(cache_key), view=view)
+
+    CACHE_LOOKUP_SECONDS.observe(
+        time.monotonic() - start, view=view, outcome=outcome)
 
-    assert isinstance(ret_value, str)
+    return dict((h, results.get(h, {})) for h in zip_file_hashes)
 
-    # Ignore attribute value with size (byte) over L2P_CACHE_MAX_BYTES
-    if (cache_key is not None
-            and len(ret_value) <= getattr(settings, "L2P_CACHE_MAX_BYTES", 0)):
-        def_cache.add(cache_key, ret_value, None)
 
-    result_dict[attr] = ret_value
+def get_cached_attribute_by_tex_key(zip_file_hash, attr, request):
+    result_dict = get_cached_attributes_by_tex_keys(
+        [zip_file_hash], [attr], request)[zip_file_hash]
+
+    if not result_dict:
+        return None if request.method == "POST" else {}
+
     return result_dict
 
 
@@ -164,6 +316,7 @@ def get_cached_results_from_field_and_tex_key(tex_key, field_str, request):
 
 class CreateMixin:
     def create(self, request, *args, **kwargs):
+        pin_to_primary()
         try:
             req_params = MultiPartParser().parse(request)
             compiler = req_params.pop("compiler")
@@ -290,13 +443,177 @@ class LatexImageDetail(
         return super().get(request, *args, **kwargs)
 
 
+class LatexPdfCursorPagination(CursorPagination):
+    """
+    Pages are fetched by position on the (indexed) creation time rather than
+    by offset, so fetching a page takes the same time wherever it is, and
+    pages are stable when new pdfs are created.
+    """
+    ordering = "-creation_time"
+    page_size_query_param = "page_size"
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        self.page_size = getattr(settings, "L2P_API_LIST_PAGE_SIZE", 100)
+        return super().get_page_size(request)
+
+
+def parse_datetime_param(request, name):
+    value = request.GET.get(name)
+    if not value:
+        return None
+
+    try:
+        result = parse_datetime(value)
+    except ValueError:
+        result = None
+
+    if result is None:
+        raise ParseError("'%s' is not a valid datetime: %s" % (name, value))
+
+    if is_naive(result):
+        result = make_aware(result)
+    return result
+
+
 class LatexPdfList(
         CreateMixin, FieldsSerializerMixin, generics.ListCreateAPIView):
+    """
+    List the pdfs, newest first, with cursor pagination. The list can be
+    filtered by ``project`` (identifier), ``collection`` (zip file hash),
+    ``created_after``, ``created_before`` (ISO 8601 datetimes) and
+    ``has_error`` (whether the collection failed to compile).
+    """
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = LatexPdfSerializer
     renderer_classes = (L2PCollectionRenderer,)
+    pagination_class = LatexPdfCursorPagination
 
     def get_queryset(self):
         if not self.request.user.is_superuser:
-            return LatexPdf.objects.filter(project__creator=self.request.user)
-        return LatexPdf.objects.all()
+            queryset = LatexPdf.objects.filter(
+                project__creator=self.request.user)
+        else:
+            queryset = LatexPdf.objects.all()
+        return queryset
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        params = self.request.GET
+
+        project = params.get("project")
+        if project:
+            queryset = queryset.filter(project__identifier=project)
+
+        collection = params.get("collection")
+        if collection:
+            queryset = queryset.filter(collection__zip_file_hash=collection)
+
+        created_after = parse_datetime_param(self.request, "created_after")
+        if created_after is not None:
+            queryset = queryset.filter(creation_time__gt=created_after)
+
+        created_before = parse_datetime_param(self.request, "created_before")
+        if created_before is not None:
+            queryset = queryset.filter(creation_time__lt=created_before)
+
+        has_error = params.get("has_error")
+        if has_error:
+            if has_error.lower() not in ("true", "false", "1", "0"):
+                raise ParseError("'has_error' must be true or false")
+            queryset = queryset.filter(
+                collection__compile_error__isnull=(
+                    has_error.lower() in ("false", "0")))
+
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        # Rendered from values() rather than model instances, which also
+        # means only the columns of the requested fields are loaded, e.g.,
+        # the mediabox json is never loaded.
+        serializer = self.get_serializer()
+        queryset = self.filter_queryset(self.get_queryset()).values(
+            "creation_time", *serializer.get_value_sources(),
+            zip_file_hash=F("collection__zip_file_hash"))
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                [serializer.values_to_representation(row) for row in page])
+
+        return Response(
+            [serializer.values_to_representation(row) for row in queryset])
+
+
+class LatexPdfBulkDetail(generics.GenericAPIView):
+    """
+    Look up fields of multiple pdfs by tex_key (i.e., zip file hash) in one
+    request, either via ``GET ?tex_keys=key1,key2&fields=pdf``, or via
+    ``POST`` with json data ``{"tex_keys": [...], "fields": "pdf"}``.
+    Like the list, non-superusers only see the pdfs of their own projects.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    parser_classes = (JSONParser,)
+
+    def get(self, request, *args, **kwargs):
+        tex_keys = ",".join(request.GET.getlist("tex_keys")).split(",")
+        return self.get_bulk_response(
+            request, tex_keys, request.GET.get("fields"))
+
+    def post(self, request, *args, **kwargs):
+        tex_keys = request.data.get("tex_keys", [])
+        if (not isinstance(tex_keys, list)
+                or not all(isinstance(key, str) for key in tex_keys)):
+            raise ParseError("'tex_keys' must be a list of strings")
+        fields = request.data.get("fields")
+        if fields is not None and not isinstance(fields, str):
+            raise ParseError("'fields' must be a string")
+        return self.get_bulk_response(request, tex_keys, fields)
+
+    def get_bulk_response(self, request, tex_keys, field_str):
+        # Checked before empty keys are dropped, which also costs time
+        max_keys = getattr(settings, "L2P_API_BULK_MAX_KEYS", 200)
+        if len(tex_keys) > max_keys:
+            raise ParseError(
+                "At most %d tex_keys are allowed in one request" % max_keys)
+
+        tex_keys = [key for key in tex_keys if key]
+        if not tex_keys:
+            raise ParseError("No tex_keys specified")
+
+        fields = (field_str or "pdf").split(",")
+
+        creator_id = None
+        if not request.user.is_superuser:
+            creator_id = request.user.pk
+
+        return Response(
+            get_cached_attributes_by_tex_keys(
+                tex_keys, fields, request, creator_id=creator_id),
+            status=status.HTTP_200_OK)
+
+
+class PlainTextRenderer(BaseRenderer):
+    media_type = "text/plain"
+    format = "txt"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return data
+
+
+class MetricsView(APIView):
+    """
+    Expose the metrics in Prometheus text format, of the current process, or
+    of all the processes with ``L2P_METRICS_MULTIPROC_DIR``.
+    Only staff users are allowed, i.e., scrapers should authenticate with
+    the token of a staff user.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    renderer_classes = (PlainTextRenderer,)
+
+    def get(self, request, *args, **kwargs):
+        if not is_metrics_enabled():
+            raise NotFound()
+        return Response(render_metrics(), content_type=(
+            "text/plain; version=0.0.4; charset=utf-8"))
@@ -23,17 +23,92 @@ THE SOFTWARE.
 """
 
 
+import hashlib
+
 from crispy_forms.layout import Submit, Button
 from django import forms
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm as AuthForm
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils.translation import ugettext as _
+from rest_framework.authentication import TokenAuthentication
 from rest_framework.authtoken.models import Token
 
-from latex.utils import StyledFormMixin
+from latex.utils import StyledFormMixin, is_process_local_cache
+
+
+# {{{ cached token authentication
+
+def get_token_cache_key(key):
+    # Don't expose the raw token in cache keys
+    return "l2p_token:%s" % hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_token_cache():
+    try:
+        import django.core.cache as cache
+    except ImproperlyConfigured:
+        return None
+    return cache.caches["default"]
+
+
+def get_token_cache_timeout(def_cache):
+    """
+    ``L2P_TOKEN_CACHE_TIMEOUT``, which defaults to 0 (disabled) if
+    `def_cache` is not shared by the processes, in which the invalidation
+    of tokens would only happen in the process making the change.
+    """
+    timeout = getattr(settings, "L2P_TOKEN_CACHE_TIMEOUT", None)
+    if timeout is None:
+        timeout = 0 if is_process_local_cache(def_cache) else 60
+    return timeout
+
+
+def invalidate_cached_tokens(keys):
+    def_cache = get_token_cache()
+    if def_cache is None:
+        return
+    def_cache.delete_many([get_token_cache_key(key) for key in keys])
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    A :class:`TokenAuthentication` which caches the pk of the users of valid
+    tokens for ``L2P_TOKEN_CACHE_TIMEOUT`` seconds (see
+    :func:`get_token_cache_timeout`), so that requests only need a lookup of
+    the user by primary key instead of the token lookup.
+    Only the pk is cached, not the token or the user (including its password
+    hash), and the user is always loaded fresh. Cached tokens are
+    invalidated when they are deleted (e.g., rotated) or when their users are
+    changed (e.g., deactivated) or deleted, see :mod:`latex.receivers`.
+    """
+
+    def authenticate_credentials(self, key):
+        def_cache = get_token_cache()
+        if def_cache is None or not get_token_cache_timeout(def_cache):
+            return super().authenticate_credentials(key)
+
+        cache_key = get_token_cache_key(key)
+        user_pk = def_cache.get(cache_key)
+        if user_pk is not None:
+            user = get_user_model()._default_manager.filter(
+                pk=user_pk, is_active=True).first()
+            if user is not None:
+                return user, Token(key=key, user=user)
+
+            # Missed invalidation, let the token lookup raise the error
+            def_cache.delete(cache_key)
+
+        # Invalid tokens and inactive users are not cached
+        user, token = super().authenticate_credentials(key)
+        def_cache.set(cache_key, user.pk, get_token_cache_timeout(def_cache))
+        return user, token
+
+# }}}
 
 
 class AuthenticationForm(StyledFormMixin, AuthForm):
@@ -74,10 +149,7 @@ def user_profile(request):
     user_form = None
 
     user = request.user
-    tokens = Token.objects.filter(user=user)
-    token = None
-    if tokens.count():
-        token = tokens[0]
+    token = Token.objects.filter(user=user).first()
 
     if request.method == "POST":
         if "submit" in request.POST:
@@ -101,3 +173,4 @@ def user_profile(request):
         "form_description": _("User Profile"),
         })
 
+# vim: foldmethod=marker
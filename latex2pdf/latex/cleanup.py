@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import atexit
+import logging
+import os
+import posixpath
+import threading
+from collections import OrderedDict, namedtuple
+from queue import Queue, Empty
+
+from django.conf import settings
+
+from latex.metrics import CACHE_EVICTIONS
+
+from typing import Any, Iterable, Iterator, List, Optional, Text  # noqa
+
+logger = logging.getLogger(__name__)
+
+# The max number of keys per request of S3 DeleteObjects
+S3_DELETE_OBJECTS_MAX_KEYS = 1000
+
+DEFAULT_CLEANUP_BATCH_SIZE = 1000
+
+# How long the worker waits for more items before processing a batch
+BATCH_COLLECT_TIMEOUT = 0.05
+
+
+CleanupItem = namedtuple("CleanupItem", "storage, name, cache, cache_key")
+
+
+def delete_storage_files(storage, names):
+    # type: (Any, List[Text]) -> None
+    """
+    Delete files named `names` from `storage`, using the batch delete API
+    of the storage if there's one, which is much faster than deleting
+    files one by one for remote storages.
+    """
+    if not names:
+        return
+
+    delete_many = getattr(storage, "delete_many", None)
+    if delete_many is not None:
+        delete_many(names)
+        return
+
+    s3_connection = getattr(storage, "s3_connection", None)
+    if s3_connection is not None:
+        # django-s3-storage
+        for i in range(0, len(names), S3_DELETE_OBJECTS_MAX_KEYS):
+            s3_connection.delete_objects(
+                Bucket=storage.settings.AWS_S3_BUCKET_NAME,
+                Delete={
+                    "Objects": [
+                        {"Key": storage._get_key_name(name)}
+                        for name in names[i:i + S3_DELETE_OBJECTS_MAX_KEYS]],
+                    "Quiet": True})
+        return
+
+    for name in names:
+        storage.delete(name)
+
+
+StorageFile = namedtuple("StorageFile", "name, size, modified_time")
+
+
+def iter_storage_files(storage, path):
+    # type: (Any, Text) -> Iterator[StorageFile]
+    """
+    Iterate over the files under `path` of `storage`, sorted by name (in code
+    point order), holding at most the listing of one directory (or one page
+    of S3 listing) in memory. Storages may provide their own listing by an
+    ``iter_files(path)`` method.
+    """
+    iter_files = getattr(storage, "iter_files", None)
+    if iter_files is not None:
+        return iter_files(path)
+    if getattr(storage, "s3_connection", None) is not None:
+        return iter_s3_storage_files(storage, path)
+    return iter_listdir_storage_files(storage, path)
+
+
+def iter_listdir_storage_files(storage, path):
+    # type: (Any, Text) -> Iterator[StorageFile]
+    try:
+        dirs, files = storage.listdir(path)
+    except FileNotFoundError:
+        # Deleted after being listed
+        return
+
+    # Sorting directories with a trailing slash makes the names of all the
+    # files yielded sorted, e.g., "a.pdf" < "a/b.pdf" < "a0.pdf".
+    entries = sorted(
+        [(dir_name + "/", True) for dir_name in dirs]
+        + [(file_name, False) for file_name in files])
+
+    for entry, is_dir in entries:
+        name = posixpath.join(path, entry.rstrip("/"))
+        if is_dir:
+            yield from iter_listdir_storage_files(storage, name)
+            continue
+
+        try:
+            size = storage.size(name)
+            modified_time = storage.get_modified_time(name)
+        except FileNotFoundError:
+            # Deleted after being listed
+            continue
+        yield StorageFile(name, size, modified_time)
+
+
+def iter_s3_storage_files(storage, path):
+    # type: (Any, Text) -> Iterator[StorageFile]
+    # django-s3-storage. Keys are listed in UTF-8 binary order, which is
+    # the code point order.
+    key_prefix = storage.settings.AWS_S3_KEY_PREFIX
+    key_prefix = posixpath.normpath(key_prefix) + "/" if key_prefix else ""
+
+    paginator = storage.s3_connection.get_paginator("list_objects_v2")
+    pages = paginator.paginate(
+        Bucket=storage.settings.AWS_S3_BUCKET_NAME,
+        Prefix=storage._get_key_name(path) + "/")
+
+    for page in pages:
+        for entry in page.get("Contents", ()):
+            yield StorageFile(
+                entry["Key"][len(key_prefix):], entry["Size"],
+                entry["LastModified"])
+
+
+def process_cleanup_items(items):
+    # type: (Iterable[CleanupItem]) -> None
+    # Storages and caches are not necessarily hashable
+    names_by_storage = OrderedDict()  # type: OrderedDict
+    keys_by_cache = OrderedDict()  # type: OrderedDict
+
+    for item in items:
+        if item.name:
+            __, names = names_by_storage.setdefault(
+                id(item.storage), (item.storage, []))
+            names.append(item.name)
+        if item.cache is not None:
+            __, keys = keys_by_cache.setdefault(
+                id(item.cache), (item.cache, []))
+            if item.cache_key not in keys:
+                keys.append(item.cache_key)
+
+    for storage, names in names_by_storage.values():
+        try:
+            delete_storage_files(storage, names)
+        except Exception:
+            # Files left are removed by "manage.py reconcile_storage"
+            logger.exception(
+                "Failed to delete %d files from storage", len(names))
+
+    for cache, keys in keys_by_cache.values():
+        try:
+            cache.delete_many(keys)
+        except Exception:
+            logger.exception("Failed to delete %d cache keys", len(keys))
+            continue
+        for __ in keys:
+            CACHE_EVICTIONS.inc(field="pdf", view="pdf_delete")
+
+
+class CleanupQueue(object):
+    """
+    A per-process queue of storage files and cache keys to be deleted. Items
+    are processed in batches by a daemon worker thread, which is started on
+    the first :meth:`put` (and restarted in forked processes).
+    """
+
+    def __init__(self, batch_size=None):
+        # type: (Optional[int]) -> None
+        self.batch_size = batch_size
+        self.queue = Queue()  # type: Queue
+        self._lock = threading.Lock()
+        self._thread = None  # type: Optional[threading.Thread]
+        self._pid = None  # type: Optional[int]
+
+    def get_batch_size(self):
+        # type: () -> int
+        if self.batch_size is not None:
+            return self.batch_size
+        return getattr(
+            settings, "L2P_STORAGE_CLEANUP_BATCH_SIZE",
+            DEFAULT_CLEANUP_BATCH_SIZE)
+
+    def put(self, storage, name, cache=None, cache_key=None):
+        # type: (Any, Text, Any, Optional[Text]) -> None
+        self.ensure_worker()
+        self.queue.put(CleanupItem(storage, name, cache, cache_key))
+
+    def ensure_worker(self):
+        # type: () -> None
+        with self._lock:
+            if (self._thread is not None
+                    and self._pid == os.getpid()
+                    and self._thread.is_alive()):
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self.run, name="l2p-storage-cleanup", daemon=True)
+            self._thread.start()
+
+    def get_batch(self, block=True):
+        # type: (bool) -> List[CleanupItem]
+        batch = []  # type: List[CleanupItem]
+        try:
+            batch.append(self.queue.get(block=block))
+        except Empty:
+            return batch
+
+        batch_size = self.get_batch_size()
+        while len(batch) < batch_size:
+            try:
+                batch.append(self.queue.get(
+                    block=block, timeout=BATCH_COLLECT_TIMEOUT))
+            except Empty:
+                break
+        return batch
+
+    def process_batch(self, batch):
+        # type: (List[CleanupItem]) -> None
+        try:
+            process_cleanup_items(batch)
+        finally:
+            for __ in batch:
+                self.queue.task_done()
+
+    def run(self):
+        # type: () -> None
+        while True:
+            self.process_batch(self.get_batch())
+
+    def flush(self):
+        # type: () -> None
+        """
+        Process the pending items in the calling thread.
+        """
+        while True:
+            batch = self.get_batch(block=False)
+            if not batch:
+                return
+            self.process_batch(batch)
+
+    def join(self):
+        # type: () -> None
+        """
+        Block until all the items put so far are processed.
+        """
+        self.queue.join()
+
+
+_cleanup_queue = CleanupQueue()
+
+
+def get_cleanup_queue():
+    # type: () -> CleanupQueue
+    return _cleanup_queue
+
+
+# Don't lose pending items on graceful shutdown, when the daemon worker
+# is killed.
+atexit.register(_cleanup_queue.flush)
@@ -24,12 +24,16 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import logging
 import os
 import re
+import shutil
 import pathlib
 from datetime import datetime
 from django.utils.translation import ugettext as _
 
+from django.core.management.base import CommandError
+
 from latex.utils import (
     string_concat,
     popen_wrapper,
@@ -38,7 +42,9 @@ from latex.utils import (
 
 debug = False
 
-from typing import Text, Optional, Any, List, Dict, TYPE_CHECKING  # noqa
+logger = logging.getLogger(__name__)
+
+from typing import Text, Optional, Any, List, Dict, Tuple, TYPE_CHECKING  # noqa
 if TYPE_CHECKING:
     from django.core.checks.messages import CheckMessage  # noqa
 
@@ -166,4 +172,100 @@ def unzipped_folder_to_pdf_converter(working_dir, compiler=None, **kwargs):
     return dict((pdf, os.path.join(working_dir, pdf)) for pdf in pdfs)
 
 
+def optimize_pdf(pdf_path):
+    # type: (Text) -> bool
+    """
+    Rewrite the pdf in place with PyMuPDF, with unused and duplicate objects
+    removed, streams compressed and objects packed into object streams,
+    which doesn't change how the pdf looks.
+
+    :return: True if the pdf was rewritten, i.e., the result is smaller,
+     else False, in which case the pdf is left untouched, including when
+     PyMuPDF failed (which is logged), since the pdf is still usable.
+    """
+    optimized_path = "%s.optimized" % pdf_path
+    save_kwargs = {"garbage": 4, "deflate": True}
+
+    try:
+        import fitz
+
+        doc = fitz.open(pdf_path)
+        try:
+            try:
+                doc.save(optimized_path, use_objstms=1, **save_kwargs)
+            except TypeError:
+                # object streams are not supported by old PyMuPDF versions
+                doc.save(optimized_path, **save_kwargs)
+        finally:
+            doc.close()
+
+        is_smaller = (
+            os.path.getsize(optimized_path) < os.path.getsize(pdf_path))
+    except Exception:
+        logger.exception("Failed to optimize %s", pdf_path)
+        is_smaller = False
+
+    if not is_smaller:
+        if os.path.isfile(optimized_path):
+            os.remove(optimized_path)
+        return False
+
+    os.replace(optimized_path, pdf_path)
+    return True
+
+
+def post_process_pdf(pdf_path, optimize=True, linearize=True):
+    # type: (Text, bool, bool) -> Tuple[int, int]
+    """
+    Post-process a compiled pdf in place, by optionally optimizing (see
+    :func:`optimize_pdf`) and then linearizing (see :func:`linearize_pdf`)
+    it. Linearization must be the last step, because rewriting the pdf
+    destroys it.
+
+    :return: a tuple of the size (in bytes) of the pdf before and after
+     post-processing.
+    """
+    original_size = os.path.getsize(pdf_path)
+
+    if optimize:
+        optimize_pdf(pdf_path)
+
+    if linearize:
+        linearize_pdf(pdf_path)
+
+    return original_size, os.path.getsize(pdf_path)
+
+
+def linearize_pdf(pdf_path):
+    # type: (Text) -> bool
+    """
+    Linearize (i.e., optimize for fast web view) the pdf in place with qpdf,
+    so that pdf.js can render the first page after fetching only a small
+    part of the file via range requests.
+
+    :return: True if linearized, False if qpdf is not available or failed,
+     in which case the pdf is left untouched.
+    """
+    qpdf = shutil.which("qpdf")
+    if qpdf is None:
+        return False
+
+    linearized_path = "%s.linearized" % pdf_path
+
+    try:
+        _output, _error, status = popen_wrapper(
+            [qpdf, "--linearize", pdf_path, linearized_path])
+    except CommandError:
+        status = None
+
+    # qpdf exits with 3 if it succeeded with warnings
+    if status not in (0, 3) or not os.path.isfile(linearized_path):
+        if os.path.isfile(linearized_path):
+            os.remove(linearized_path)
+        return False
+
+    os.replace(linearized_path, pdf_path)
+    return True
+
+
 # vim: foldmethod=marker
@@ -0,0 +1,139 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+from collections import namedtuple
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from latex.models import LatexCollection, LatexPdf
+
+HotQuery = namedtuple("HotQuery", "description, model, filters, ordering")
+
+# Filters are keyed by column names, so that they can be used both as
+# Django lookups and as mongo filters. The values don't matter for the plan.
+HOT_QUERIES = [
+    HotQuery(
+        "collection of a project by zip file hash",
+        LatexCollection, {"project_id": 1, "zip_file_hash": ""}, ()),
+    HotQuery(
+        "collections of a project, newest first",
+        LatexCollection, {"project_id": 1}, ("-creation_time",)),
+    HotQuery(
+        "collection by zip file hash (api lookup)",
+        LatexCollection, {"zip_file_hash": ""}, ()),
+    HotQuery(
+        "pdfs of a collection in a project",
+        LatexPdf, {"project_id": 1, "collection_id": 1}, ()),
+]
+
+
+def find_mongo_stages(plan):
+    # type: (dict) -> list
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(find_mongo_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(find_mongo_stages(value))
+    return stages
+
+
+def explain_mongo(connection, query):
+    # type: (...) -> tuple
+    connection.ensure_connection()
+
+    # For djongo, the underlying connection is a pymongo Database
+    collection = connection.connection[query.model._meta.db_table]
+
+    cursor = collection.find(query.filters)
+    if query.ordering:
+        cursor = cursor.sort([
+            (field.lstrip("-"), -1 if field.startswith("-") else 1)
+            for field in query.ordering])
+
+    plan = cursor.explain()
+    winning_plan = plan.get("queryPlanner", {}).get("winningPlan", plan)
+    stages = find_mongo_stages(winning_plan)
+    return "COLLSCAN" in stages, " <- ".join(stages)
+
+
+def explain_sql(connection, query):
+    # type: (...) -> tuple
+    plan = (query.model.objects.using(connection.alias)
+            .filter(**query.filters).order_by(*query.ordering).explain())
+
+    if connection.vendor == "sqlite":
+        # e.g., "SCAN latex_latexpdf" vs "SCAN latex_latexpdf USING INDEX ..."
+        # or "SEARCH latex_latexpdf USING INDEX ..."
+        is_scan = any(
+            "SCAN" in line and "USING" not in line
+            for line in plan.splitlines())
+    else:
+        is_scan = "Seq Scan" in plan or "type: ALL" in plan
+
+    return is_scan, plan
+
+
+class Command(BaseCommand):
+    help = (
+        "Explain the hot lookup queries against the database and flag "
+        "the ones which are served by full collection/table scans.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS,
+            help="The database to audit.")
+        parser.add_argument(
+            "--fail-on-scan", action="store_true",
+            help="Exit with an error if any of the queries scans.")
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+
+        if connection.settings_dict["ENGINE"] == "djongo":
+            explain = explain_mongo
+        else:
+            explain = explain_sql
+
+        scans = []
+        for query in HOT_QUERIES:
+            is_scan, plan = explain(connection, query)
+            if is_scan:
+                scans.append(query.description)
+
+            if options["verbosity"] >= 1:
+                self.stdout.write("%s: %s" % (
+                    "SCAN" if is_scan else "OK", query.description))
+            if options["verbosity"] >= 2:
+                self.stdout.write("    %s" % plan.replace("\n", "\n    "))
+
+        if scans and options["fail_on_scan"]:
+            raise CommandError(
+                "%d hot queries are served by scans: %s"
+                % (len(scans), ", ".join(scans)))
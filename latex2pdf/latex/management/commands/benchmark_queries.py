@@ -0,0 +1,132 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from latex.models import LatexProject, LatexCollection, LatexPdf
+
+
+def get_hot_queries(using, collection, zip_file_hashes):
+    """
+    The hot path reads (see also the audit_indexes command) on database
+    `using`, as ``(description, callable)`` tuples, looking up
+    `collection`, which is one of the newest collections with pdfs.
+    """
+    return [
+        ("project with latest collection", lambda: (
+            LatexProject.objects.using(using)
+            .select_related("latest_collection")
+            .get(pk=collection.project_id))),
+        ("collection by project and hash", lambda: (
+            LatexCollection.objects.using(using)
+            .filter(project_id=collection.project_id,
+                    zip_file_hash=collection.zip_file_hash).first())),
+        ("pdfs of a collection", lambda: list(
+            LatexPdf.objects.using(using)
+            .filter(collection_id=collection.pk))),
+        ("pdf values by %d hashes" % len(zip_file_hashes), lambda: list(
+            LatexPdf.objects.using(using)
+            .filter(collection__zip_file_hash__in=zip_file_hashes)
+            .values("collection__zip_file_hash", "id", "pdf"))),
+    ]
+
+
+def get_percentile(sorted_values, percent):
+    index = min(len(sorted_values) - 1,
+                int(round(percent / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the latency of the hot path queries on one or more "
+        "databases, e.g., to compare the backend profiles (L2P_DB_BACKEND) "
+        "with the same data loaded.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", action="append", dest="databases",
+            help="A database alias to benchmark, can be repeated. "
+                 "Defaults to 'default'.")
+        parser.add_argument(
+            "--iterations", type=int, default=100,
+            help="Number of times each query is run.")
+        parser.add_argument(
+            "--n-hashes", type=int, default=20,
+            help="Number of hashes in the bulk lookup query.")
+
+    def handle(self, *args, **options):
+        for name in ("iterations", "n_hashes"):
+            if options[name] <= 0:
+                raise CommandError(
+                    "--%s must be a positive int" % name.replace("_", "-"))
+
+        databases = options["databases"] or ["default"]
+        for using in databases:
+            if using not in connections:
+                raise CommandError("Unknown database: %s" % using)
+
+        self.stdout.write("%-20s %-36s %10s %10s %10s" % (
+            "database", "query", "p50 (ms)", "p95 (ms)", "mean (ms)"))
+
+        for using in databases:
+            self.benchmark(using, options["iterations"], options["n_hashes"])
+
+    def benchmark(self, using, iterations, n_hashes):
+        database = "%s (%s)" % (using, connections[using].vendor)
+
+        collection = (
+            LatexCollection.objects.using(using)
+            .filter(compile_error__isnull=True)
+            .order_by("-creation_time", "-id").first())
+        if collection is None:
+            self.stdout.write(
+                "%-20s no collections to look up, skipped" % database)
+            return
+
+        zip_file_hashes = list(
+            LatexCollection.objects.using(using)
+            .order_by("-creation_time", "-id")
+            .values_list("zip_file_hash", flat=True)[:n_hashes])
+
+        for description, query in get_hot_queries(
+                using, collection, zip_file_hashes):
+            # Warm up the connection and the caches of the server
+            query()
+
+            durations = []
+            for i in range(iterations):
+                start = time.perf_counter()
+                query()
+                durations.append((time.perf_counter() - start) * 1000)
+
+            durations.sort()
+            self.stdout.write("%-20s %-36s %10.3f %10.3f %10.3f" % (
+                database, description,
+                get_percentile(durations, 50), get_percentile(durations, 95),
+                sum(durations) / len(durations)))
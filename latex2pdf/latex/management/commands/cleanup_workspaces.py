@@ -0,0 +1,50 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+from django.core.management.base import BaseCommand
+
+from latex.workspace import get_workspace_manager
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the compile workspaces left by crashed processes. This is "
+        "run before the server is started, rather than when the app is "
+        "loaded, so that loading the app has no side effects.")
+
+    # The checks are run by the server anyway
+    requires_system_checks = False
+
+    def handle(self, *args, **options):
+        manager = get_workspace_manager()
+        n_stale = manager.cleanup_stale_workspaces()
+
+        # Don't exit before the background deletions are done
+        manager.deleter.join()
+
+        if options["verbosity"] >= 1:
+            self.stdout.write(
+                "Deleted %d stale workspace(s) in %s."
+                % (n_stale, ", ".join(manager.roots)))
@@ -0,0 +1,77 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+
+def get_unapplied_migrations(database=DEFAULT_DB_ALIAS):
+    """
+    :return: a list of ``(app_label, name)`` of the migrations to apply.
+    """
+    executor = MigrationExecutor(connections[database])
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    return [(migration.app_label, migration.name) for migration, __ in plan]
+
+
+class Command(BaseCommand):
+    help = (
+        "Run 'migrate' only if there are unapplied migrations, which is much "
+        "faster than 'migrate' on startup when the database is up to date. "
+        "Migrations are shipped with the code, and are never made at "
+        "startup.")
+
+    # The checks are run by the server anyway
+    requires_system_checks = False
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS,
+            help="The database to migrate.")
+        parser.add_argument(
+            "--check", action="store_true",
+            help="Exit with a non-zero status if there are unapplied "
+                 "migrations, instead of applying them.")
+
+    def handle(self, *args, **options):
+        unapplied = get_unapplied_migrations(options["database"])
+
+        if not unapplied:
+            # The cache is not warmed either (L2P_WARM_CACHE_ON_MIGRATE is
+            # only honored by "migrate"), so that restarts are not delayed.
+            if options["verbosity"] >= 1:
+                self.stdout.write("No migrations to apply.")
+            return
+
+        if options["check"]:
+            raise CommandError(
+                "%d unapplied migrations: %s" % (
+                    len(unapplied),
+                    ", ".join("%s.%s" % migration for migration in unapplied)))
+
+        call_command(
+            "migrate", database=options["database"], interactive=False,
+            verbosity=options["verbosity"], stdout=self.stdout)
@@ -0,0 +1,133 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.transaction import atomic
+
+from latex.cleanup import get_cleanup_queue
+from latex.models import LatexProject, LatexCollection, LatexPdf
+from latex.receivers import bulk_deleting_collections
+from latex.utils import throttled
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete the revisions (collections with their pdfs and files) which "
+        "are out of the retention policy of their projects, see "
+        "L2P_RETENTION_KEEP_REVISIONS and L2P_RETENTION_KEEP_DAYS. Each "
+        "batch is deleted in its own transaction, so the command can be "
+        "interrupted and run again at any time.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--project", action="append", dest="projects",
+            help="Identifier of a project to collect, can be repeated. "
+                 "Defaults to all projects.")
+        parser.add_argument(
+            "--batch-size", type=int, default=100,
+            help="Number of collections deleted per batch.")
+        parser.add_argument(
+            "--rate", type=float, default=0,
+            help="Max number of batches started per second, 0 for no limit.")
+        parser.add_argument(
+            "--limit", type=int, default=0,
+            help="Max number of collections deleted, 0 for no limit.")
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Only report the number of expired collections.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be a positive int")
+        for name in ("rate", "limit"):
+            if options[name] < 0:
+                raise CommandError("--%s must not be negative" % name)
+
+        projects = LatexProject.objects.order_by("pk")
+        if options["projects"]:
+            projects = projects.filter(identifier__in=options["projects"])
+
+        self.limit = options["limit"] or None
+        self.n_collections = 0
+        self.n_pdfs = 0
+        project_pks = set()
+
+        interval = 1 / options["rate"] if options["rate"] else 0
+        batches = self.iter_expired_batches(projects, options["batch_size"])
+
+        for project, collection_ids in throttled(batches, interval):
+            project_pks.add(project.pk)
+
+            if options["dry_run"]:
+                self.n_collections += len(collection_ids)
+                continue
+
+            self.delete_batch(project, collection_ids)
+
+        # Wait for the files of the deleted pdfs to be removed from the
+        # storage before exiting.
+        get_cleanup_queue().join()
+
+        if options["verbosity"] >= 1:
+            if options["dry_run"]:
+                self.stdout.write(
+                    "%d collections of %d projects would be deleted."
+                    % (self.n_collections, len(project_pks)))
+            else:
+                self.stdout.write(
+                    "Deleted %d collections (%d pdfs) of %d projects."
+                    % (self.n_collections, self.n_pdfs, len(project_pks)))
+
+    def iter_expired_batches(self, projects, batch_size):
+        # Projects are loaded one at a time, and their expired collections
+        # are computed just before being deleted, so that nothing stale is
+        # deleted when the command runs for long.
+        for project_pk in projects.values_list("pk", flat=True):
+            if self.limit is not None and self.n_collections >= self.limit:
+                return
+
+            project = LatexProject.objects.filter(pk=project_pk).first()
+            if project is None:
+                continue
+
+            expired_ids = list(
+                project.get_expired_collections()
+                .order_by("creation_time", "id")
+                .values_list("pk", flat=True))
+
+            if self.limit is not None:
+                expired_ids = expired_ids[:self.limit - self.n_collections]
+
+            for i in range(0, len(expired_ids), batch_size):
+                yield project, expired_ids[i:i + batch_size]
+
+    def delete_batch(self, project, collection_ids):
+        with atomic():
+            with bulk_deleting_collections(project):
+                __, n_deleted = LatexCollection.objects.filter(
+                    project=project, pk__in=collection_ids).delete()
+
+        self.n_collections += n_deleted.get(LatexCollection._meta.label, 0)
+        self.n_pdfs += n_deleted.get(LatexPdf._meta.label, 0)
@@ -0,0 +1,280 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.db.transaction import atomic
+from django.utils.timezone import now
+
+from latex.cleanup import (
+    delete_storage_files, get_cleanup_queue, iter_storage_files)
+from latex.models import (
+    LatexProject, LatexCollection, LatexPdf, PDF_STORAGE_ROOT)
+from latex.receivers import bulk_deleting_collections
+
+
+def ensure_sorted(names_iter, source):
+    """
+    Pass through `names_iter`, raising :exc:`CommandError` if the names are
+    not sorted, since the merge join would then report false orphans.
+    """
+    last_name = None
+    for item in names_iter:
+        name = item[0]
+        if last_name is not None and name < last_name:
+            raise CommandError(
+                "%s is not listed in order: %r after %r"
+                % (source, name, last_name))
+        last_name = name
+        yield item
+
+
+def iter_pdf_rows(batch_size):
+    """
+    Iterate over ``(name, pk, collection_id, project_id)`` of pdfs with a
+    file, sorted by name, with keyset pagination of `batch_size` rows.
+    """
+    queryset = LatexPdf.objects.exclude(pdf="").exclude(pdf__isnull=True)
+
+    name_field = "pdf"
+    db = router.db_for_read(LatexPdf)
+    if connections[db].vendor == "postgresql":
+        # Sort in code point order rather than by the locale of the
+        # database, to match the storage listing.
+        name_field = "pdf_c"
+        queryset = queryset.annotate(
+            pdf_c=RawSQL('"%s"."pdf" COLLATE "C"' % LatexPdf._meta.db_table, ()))
+
+    queryset = queryset.order_by(name_field, "pk").values_list(
+        name_field, "pk", "collection_id", "project_id")
+
+    last = None
+    while True:
+        batch = queryset
+        if last is not None:
+            batch = batch.filter(
+                Q(**{"%s__gt" % name_field: last[0]})
+                | Q(**{name_field: last[0], "pk__gt": last[1]}))
+
+        rows = list(batch[:batch_size])
+        yield from rows
+
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+
+
+def merge_join(storage_files, pdf_rows):
+    """
+    Merge join sorted storage files and sorted pdf rows by name, yielding
+    ``(name, storage_file, rows)``, where `storage_file` is None if the file
+    doesn't exist and `rows` is empty if no pdf refers to the file.
+    """
+    storage_file = next(storage_files, None)
+    row = next(pdf_rows, None)
+
+    while storage_file is not None or row is not None:
+        if row is None or (
+                storage_file is not None and storage_file.name < row[0]):
+            yield storage_file.name, storage_file, []
+            storage_file = next(storage_files, None)
+            continue
+
+        name = row[0]
+        rows = []
+        while row is not None and row[0] == name:
+            rows.append(row)
+            row = next(pdf_rows, None)
+
+        if storage_file is not None and storage_file.name == name:
+            yield name, storage_file, rows
+            storage_file = next(storage_files, None)
+        else:
+            yield name, None, rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Walk the pdf files in the storage and the LatexPdf table in sorted "
+        "batches, and report (or delete with --delete) orphaned files which "
+        "no pdf refers to, pdfs whose files are missing, and collections "
+        "which were neither compiled nor have an error. With --delete, the "
+        "collections of pdfs with missing files are deleted, so that they "
+        "are compiled again on the next request.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--delete", action="store_true",
+            help="Delete the orphaned files and the inconsistent collections.")
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Number of rows fetched, or files deleted, per batch.")
+        parser.add_argument(
+            "--min-age", type=int, default=3600,
+            help="Files and collections newer than this number of seconds "
+                 "are ignored, since they might belong to a running compile.")
+        parser.add_argument(
+            "--usage", action="store_true",
+            help="Report the storage usage per project and per user.")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be a positive int")
+        if options["min_age"] < 0:
+            raise CommandError("--min-age must not be negative")
+
+        self.delete = options["delete"]
+        self.batch_size = options["batch_size"]
+        self.verbosity = options["verbosity"]
+        min_time = now() - timedelta(seconds=options["min_age"])
+
+        storage = LatexPdf._meta.get_field("pdf").storage
+        storage_files = ensure_sorted(
+            iter_storage_files(storage, PDF_STORAGE_ROOT), "Storage")
+        pdf_rows = ensure_sorted(
+            iter_pdf_rows(self.batch_size), "Database")
+
+        n_files = 0
+        n_orphans = 0
+        orphan_bytes = 0
+        orphan_names = []
+        missing_collection_ids = defaultdict(set)
+        n_missing = 0
+        usage = defaultdict(lambda: [0, 0])
+
+        for name, storage_file, rows in merge_join(storage_files, pdf_rows):
+            if storage_file is not None:
+                n_files += 1
+
+            if not rows:
+                if storage_file.modified_time > min_time:
+                    continue
+                n_orphans += 1
+                orphan_bytes += storage_file.size
+                self.log("Orphaned file: %s" % name)
+                if self.delete:
+                    orphan_names.append(name)
+                    if len(orphan_names) >= self.batch_size:
+                        delete_storage_files(storage, orphan_names)
+                        orphan_names = []
+                continue
+
+            if storage_file is None:
+                for __, pk, collection_id, project_id in rows:
+                    n_missing += 1
+                    self.log("Missing file: %s (pdf %d)" % (name, pk))
+                    missing_collection_ids[project_id].add(collection_id)
+                continue
+
+            # A file shared by pdfs (overwritten) is counted once
+            project_usage = usage[rows[0][3]]
+            project_usage[0] += 1
+            project_usage[1] += storage_file.size
+
+        if orphan_names:
+            delete_storage_files(storage, orphan_names)
+
+        empty_collection_ids = defaultdict(set)
+        n_empty = 0
+        empty_collections = (
+            LatexCollection.objects
+            .filter(compile_error__isnull=True, entries__isnull=True,
+                    creation_time__lt=min_time)
+            .order_by("pk").values_list("pk", "project_id"))
+        for pk, project_id in empty_collections.iterator():
+            n_empty += 1
+            self.log("Empty collection: %d" % pk)
+            empty_collection_ids[project_id].add(pk)
+
+        n_deleted = 0
+        if self.delete:
+            for collection_ids in (missing_collection_ids, empty_collection_ids):
+                n_deleted += self.delete_collections(collection_ids)
+
+            # Wait for the files of the deleted pdfs to be removed
+            get_cleanup_queue().join()
+
+        if self.verbosity >= 1:
+            self.stdout.write(
+                "Checked %d files: %d orphaned files (%d bytes), %d pdfs with "
+                "missing files, %d empty collections."
+                % (n_files, n_orphans, orphan_bytes, n_missing, n_empty))
+            if self.delete:
+                self.stdout.write(
+                    "Deleted %d orphaned files and %d collections."
+                    % (n_orphans, n_deleted))
+
+        if options["usage"]:
+            self.write_usage(usage)
+
+    def log(self, message):
+        if self.verbosity >= 2:
+            self.stdout.write(message)
+
+    def delete_collections(self, collection_ids_by_project):
+        n_deleted = 0
+        for project in LatexProject.objects.filter(
+                pk__in=list(collection_ids_by_project)):
+            collection_ids = sorted(collection_ids_by_project[project.pk])
+            for i in range(0, len(collection_ids), self.batch_size):
+                with atomic():
+                    with bulk_deleting_collections(project):
+                        __, deleted = LatexCollection.objects.filter(
+                            project=project,
+                            pk__in=collection_ids[i:i + self.batch_size]
+                        ).delete()
+                n_deleted += deleted.get(LatexCollection._meta.label, 0)
+        return n_deleted
+
+    def write_usage(self, usage):
+        projects = (
+            LatexProject.objects.filter(pk__in=list(usage))
+            .values_list("pk", "identifier", "creator__username"))
+
+        user_usage = defaultdict(lambda: [0, 0])
+        project_lines = []
+        for pk, identifier, username in projects:
+            n_files, n_bytes = usage[pk]
+            project_lines.append((n_bytes, n_files, identifier, username))
+            user_usage[username][0] += n_files
+            user_usage[username][1] += n_bytes
+
+        self.stdout.write("Usage per project:")
+        for n_bytes, n_files, identifier, username in sorted(
+                project_lines, reverse=True):
+            self.stdout.write(
+                "  %s (%s): %d files, %d bytes"
+                % (identifier, username, n_files, n_bytes))
+
+        self.stdout.write("Usage per user:")
+        for username, (n_files, n_bytes) in sorted(
+                user_usage.items(), key=lambda item: item[1][1], reverse=True):
+            self.stdout.write(
+                "  %s: %d files, %d bytes" % (username, n_files, n_bytes))
@@ -0,0 +1,127 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from latex.api import (
+    get_field_cache_key, get_cache_key_field, get_pdf_cache_items)
+from latex.metrics import CACHE_FILLS
+from latex.models import LatexCollection
+from latex.utils import throttled
+
+
+class Command(BaseCommand):
+    help = (
+        "Pre-populate the result cache with the most recently created "
+        "collections and their pdfs, e.g., after a deploy or a cache flush.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit", type=int, default=1000,
+            help="Max number of collections to warm, newest first.")
+        parser.add_argument(
+            "--batch-size", type=int, default=100,
+            help="Number of collections fetched and cached per batch.")
+        parser.add_argument(
+            "--concurrency", type=int, default=1,
+            help="Number of batches processed concurrently.")
+        parser.add_argument(
+            "--rate", type=float, default=0,
+            help="Max number of batches started per second, 0 for no limit.")
+
+    def handle(self, *args, **options):
+        for name in ("limit", "batch_size", "concurrency"):
+            if options[name] <= 0:
+                raise CommandError(
+                    "--%s must be a positive int" % name.replace("_", "-"))
+
+        if options["rate"] < 0:
+            raise CommandError("--rate must not be negative")
+
+        try:
+            import django.core.cache as cache
+        except ImproperlyConfigured:
+            raise CommandError("Cache is not configured")
+
+        self.def_cache = cache.caches["default"]
+
+        collection_ids = list(
+            LatexCollection.objects.order_by("-creation_time", "-id")
+            .values_list("id", flat=True)[:options["limit"]])
+
+        batch_size = options["batch_size"]
+        batches = [collection_ids[i:i + batch_size]
+                   for i in range(0, len(collection_ids), batch_size)]
+
+        interval = 1 / options["rate"] if options["rate"] else 0
+
+        if options["concurrency"] == 1:
+            n_items = 0
+            for batch in throttled(batches, interval):
+                n_items += self.warm_batch(batch)
+        else:
+            with ThreadPoolExecutor(
+                    max_workers=options["concurrency"]) as executor:
+                futures = [
+                    executor.submit(self.warm_batch_in_thread, batch)
+                    for batch in throttled(batches, interval)]
+            n_items = sum(future.result() for future in futures)
+
+        if options["verbosity"] >= 1:
+            self.stdout.write(
+                "Warmed %d cache items of %d collections."
+                % (n_items, len(collection_ids)))
+
+    def warm_batch(self, collection_ids):
+        collections = (
+            LatexCollection.objects.filter(id__in=collection_ids)
+            .prefetch_related("entries"))
+
+        items = {}
+        for collection in collections:
+            if collection.compile_error is not None:
+                items[get_field_cache_key(
+                    collection.zip_file_hash, "compile_error")] = (
+                    collection.compile_error)
+                continue
+            items.update(get_pdf_cache_items(
+                collection.entries.all(), view="warm_cache"))
+
+        if items:
+            self.def_cache.set_many(items, None)
+            for cache_key in items:
+                CACHE_FILLS.inc(
+                    field=get_cache_key_field(cache_key), view="warm_cache")
+        return len(items)
+
+    def warm_batch_in_thread(self, collection_ids):
+        try:
+            return self.warm_batch(collection_ids)
+        finally:
+            # Each thread has its own db connection
+            connection.close()
@@ -0,0 +1,408 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from typing import Any, Text, List, Tuple, Dict, Iterator, Optional  # noqa
+
+logger = logging.getLogger(__name__)
+
+# {{{ metric types
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+REGISTRY = []  # type: List[MetricBase]
+
+
+def is_metrics_enabled():
+    # type: () -> bool
+    return getattr(settings, "L2P_METRICS_ENABLED", True)
+
+
+class MetricBase(object):
+    """
+    A minimal, thread safe metric which is exposed in Prometheus text
+    format. Noticing that values are kept in the memory of the current
+    process, so each (gunicorn) worker process only reports its own values,
+    unless they are aggregated via ``L2P_METRICS_MULTIPROC_DIR``, see
+    :class:`SnapshotWriter`.
+    """
+    type_name = None  # type: Text
+
+    def __init__(self, name, documentation, labelnames=()):
+        # type: (Text, Text, Tuple[Text, ...]) -> None
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}  # type: Dict[Tuple[Text, ...], Any]
+        REGISTRY.append(self)
+
+    def get_label_values(self, labels):
+        # type: (Dict[Text, Any]) -> Tuple[Text, ...]
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def format_labels(self, label_values, **extra):
+        # type: (Tuple[Text, ...], **Text) -> Text
+        pairs = list(zip(self.labelnames, label_values)) + list(extra.items())
+        if not pairs:
+            return ""
+        return "{%s}" % ",".join(
+            '%s="%s"' % (name, value.replace("\\", "\\\\").replace('"', '\\"'))
+            for name, value in pairs)
+
+    def reset(self):
+        # type: () -> None
+        with self._lock:
+            self._values.clear()
+
+    def get_values(self):
+        # type: () -> Dict[Tuple[Text, ...], Any]
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, values=None):
+        # type: (Optional[Dict[Tuple[Text, ...], Any]]) -> List[Text]
+        if values is None:
+            values = self.get_values()
+        lines = [
+            "# HELP %s %s" % (self.name, self.documentation),
+            "# TYPE %s %s" % (self.name, self.type_name)]
+        for label_values, value in sorted(values.items()):
+            lines.extend(self.render_value(label_values, value))
+        return lines
+
+    def render_value(self, label_values, value):
+        # type: (Tuple[Text, ...], Any) -> List[Text]
+        raise NotImplementedError()
+
+    def merge_values(self, value, other):
+        # type: (Any, Any) -> Any
+        """
+        The value aggregating `value` and `other` of two processes.
+        """
+        raise NotImplementedError()
+
+
+class Counter(MetricBase):
+    type_name = "counter"
+
+    def inc(self, amount=1, **labels):
+        # type: (int, **Any) -> None
+        if not is_metrics_enabled():
+            return
+        key = self.get_label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        SNAPSHOT_WRITER.mark_changed()
+
+    def get(self, **labels):
+        # type: (**Any) -> int
+        return self._values.get(self.get_label_values(labels), 0)
+
+    def render_value(self, label_values, value):
+        return ["%s%s %s" % (self.name, self.format_labels(label_values), value)]
+
+    def merge_values(self, value, other):
+        return value + other
+
+
+class Histogram(MetricBase):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=DEFAULT_BUCKETS):
+        # type: (Text, Text, Tuple[Text, ...], Tuple[float, ...]) -> None
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        # type: (float, **Any) -> None
+        if not is_metrics_enabled():
+            return
+        key = self.get_label_values(labels)
+        with self._lock:
+            bucket_counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0., 0))
+            for i, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    bucket_counts[i] += 1
+                    break
+            self._values[key] = (bucket_counts, total + value, count + 1)
+        SNAPSHOT_WRITER.mark_changed()
+
+    @contextmanager
+    def time(self, **labels):
+        # type: (**Any) -> Iterator[None]
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def get_count(self, **labels):
+        # type: (**Any) -> int
+        return self._values.get(self.get_label_values(labels), (None, 0, 0))[2]
+
+    def render_value(self, label_values, value):
+        bucket_counts, total, count = value
+        lines = []
+        cumulative = 0
+        for upper_bound, bucket_count in zip(self.buckets, bucket_counts):
+            cumulative += bucket_count
+            lines.append("%s_bucket%s %d" % (
+                self.name, self.format_labels(label_values, le=str(upper_bound)),
+                cumulative))
+        lines.append("%s_bucket%s %d" % (
+            self.name, self.format_labels(label_values, le="+Inf"), count))
+        lines.append("%s_sum%s %s" % (
+            self.name, self.format_labels(label_values), total))
+        lines.append("%s_count%s %d" % (
+            self.name, self.format_labels(label_values), count))
+        return lines
+
+    def get_values(self):
+        # Bucket counts are updated in place
+        with self._lock:
+            return {
+                key: (list(bucket_counts), total, count)
+                for key, (bucket_counts, total, count) in self._values.items()}
+
+    def merge_values(self, value, other):
+        return (
+            [a + b for a, b in zip(value[0], other[0])],
+            value[1] + other[1], value[2] + other[2])
+
+
+def render_metrics():
+    # type: () -> Text
+    """
+    The metrics of the current process, or of all the processes with
+    ``L2P_METRICS_MULTIPROC_DIR``.
+    """
+    if get_multiproc_dir() is None:
+        all_values = {}  # type: Dict[Text, Dict[Tuple[Text, ...], Any]]
+    else:
+        all_values = get_all_process_values()
+
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render(all_values.get(metric.name)))
+    return "\n".join(lines) + "\n"
+
+
+def reset_metrics():
+    # type: () -> None
+    for metric in REGISTRY:
+        metric.reset()
+
+# }}}
+
+
+# {{{ multiprocess mode
+
+def get_multiproc_dir():
+    # type: () -> Optional[Text]
+    return getattr(settings, "L2P_METRICS_MULTIPROC_DIR", None)
+
+
+class SnapshotWriter(object):
+    """
+    With ``L2P_METRICS_MULTIPROC_DIR``, write the values of the metrics of
+    the current process to a file of the process in that directory, every
+    `interval` seconds when they changed and at exit, so that any process
+    can render the aggregated values of all of them.
+
+    The files of exited processes (e.g., restarted gunicorn workers) are
+    kept, so that counters don't go backwards. The directory must be emptied
+    before the server starts (see start-server.sh).
+    """
+
+    def __init__(self, interval=1):
+        # type: (float) -> None
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None  # type: Optional[int]
+        self._file_name = None  # type: Optional[Text]
+        self._changed = False
+
+    def get_file_name(self):
+        # type: () -> Optional[Text]
+        """
+        The file name of the current process, None if it didn't write.
+        """
+        if self._pid != os.getpid():
+            return None
+        return self._file_name
+
+    def mark_changed(self):
+        # type: () -> None
+        if get_multiproc_dir() is None:
+            return
+
+        self._changed = True
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            # The first change in this process, e.g., a forked worker, in
+            # which the thread of the parent doesn't exist. Pids are part of
+            # the name only for debugging, since they are reused.
+            self._pid = os.getpid()
+            self._file_name = "%d-%s.json" % (self._pid, uuid.uuid4().hex)
+            thread = threading.Thread(target=self.run, daemon=True)
+            thread.start()
+
+    def run(self):
+        # type: () -> None
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.interval)
+            if self._changed:
+                try:
+                    self.write()
+                except Exception:
+                    logger.exception("Failed to write the metrics snapshot")
+
+    def write(self):
+        # type: () -> None
+        directory = get_multiproc_dir()
+        file_name = self.get_file_name()
+        if directory is None or file_name is None:
+            return
+
+        self._changed = False
+        snapshot = {
+            metric.name: list(metric.get_values().items())
+            for metric in REGISTRY}
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, file_name)
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f)
+        os.replace(path + ".tmp", path)
+
+
+SNAPSHOT_WRITER = SnapshotWriter()
+
+atexit.register(SNAPSHOT_WRITER.write)
+
+
+def get_all_process_values():
+    # type: () -> Dict[Text, Dict[Tuple[Text, ...], Any]]
+    """
+    The values of the metrics aggregated from the snapshots of the other
+    processes and the current values of the current process.
+    """
+    metrics = {metric.name: metric for metric in REGISTRY}
+    all_values = {name: metric.get_values() for name, metric in metrics.items()}
+
+    directory = get_multiproc_dir()
+    try:
+        file_names = os.listdir(directory)
+    except FileNotFoundError:
+        file_names = []
+
+    own_file_name = SNAPSHOT_WRITER.get_file_name()
+    for file_name in file_names:
+        if not file_name.endswith(".json") or file_name == own_file_name:
+            continue
+        try:
+            with open(os.path.join(directory, file_name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Skipped the metrics snapshot %s", file_name)
+            continue
+
+        for name, items in snapshot.items():
+            metric = metrics.get(name)
+            if metric is None:
+                continue
+            values = all_values[name]
+            for label_values, value in items:
+                key = tuple(label_values)
+                values[key] = (
+                    value if key not in values
+                    else metric.merge_values(values[key], value))
+
+    return all_values
+
+# }}}
+
+
+# {{{ result cache metrics
+
+CACHE_LABELS = ("field", "view")
+
+CACHE_HITS = Counter(
+    "l2p_cache_hits_total",
+    "Number of fields found in the result cache.", CACHE_LABELS)
+CACHE_MISSES = Counter(
+    "l2p_cache_misses_total",
+    "Number of fields not found in the result cache.", CACHE_LABELS)
+CACHE_NEGATIVE_HITS = Counter(
+    "l2p_cache_negative_hits_total",
+    "Number of lookups resolved by a cached compile error.", CACHE_LABELS)
+CACHE_FILLS = Counter(
+    "l2p_cache_fills_total",
+    "Number of items put into the result cache.", CACHE_LABELS)
+CACHE_EVICTIONS = Counter(
+    "l2p_cache_evictions_total",
+    "Number of items deleted from the result cache.", CACHE_LABELS)
+CACHE_OVERSIZE_SKIPS = Counter(
+    "l2p_cache_oversize_skips_total",
+    "Number of items not cached because they exceed L2P_CACHE_MAX_BYTES.",
+    CACHE_LABELS)
+CACHE_LOOKUP_SECONDS = Histogram(
+    "l2p_cache_lookup_duration_seconds",
+    "Time spent looking up results, labelled by whether the database was "
+    "queried (miss) or not (hit).",
+    ("view", "outcome"))
+
+
+def get_metrics_view_name(request):
+    # type: (Any) -> Text
+    resolver_match = getattr(request, "resolver_match", None)
+    if resolver_match is not None and resolver_match.url_name:
+        return resolver_match.url_name
+    return "unknown"
+
+# }}}
+
+# vim: foldmethod=marker
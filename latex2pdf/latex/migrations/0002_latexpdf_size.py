@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 22:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='latexpdf',
+            name='original_size',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Size before post-processing, in bytes'),
+        ),
+        migrations.AddField(
+            model_name='latexpdf',
+            name='size',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Size, in bytes'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_collection_stats(apps, schema_editor):
+    LatexProject = apps.get_model("latex", "LatexProject")  # noqa
+    LatexCollection = apps.get_model("latex", "LatexCollection")  # noqa
+    LatexPdf = apps.get_model("latex", "LatexPdf")  # noqa
+
+    # Sizes were not recorded before
+    for pdf in LatexPdf.objects.filter(size__isnull=True).exclude(pdf=""):
+        try:
+            pdf.size = pdf.pdf.size
+        except OSError:
+            continue
+        pdf.save(update_fields=["size"])
+
+    for project in LatexProject.objects.all():
+        ordered_collections = LatexCollection.objects.filter(
+            project=project).order_by("-creation_time", "-id")
+        LatexProject.objects.filter(pk=project.pk).update(
+            latest_collection=ordered_collections.first(),
+            latest_successful_collection=(
+                ordered_collections.filter(compile_error__isnull=True).first()),
+            n_collections=ordered_collections.count(),
+            total_bytes=LatexPdf.objects.filter(project=project).aggregate(
+                total_bytes=models.Sum("size"))["total_bytes"] or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0002_latexpdf_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='latexproject',
+            name='latest_collection',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='latex.LatexCollection', verbose_name='Latest collection'),
+        ),
+        migrations.AddField(
+            model_name='latexproject',
+            name='latest_successful_collection',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='latex.LatexCollection', verbose_name='Latest successful collection'),
+        ),
+        migrations.AddField(
+            model_name='latexproject',
+            name='n_collections',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Number of collections'),
+        ),
+        migrations.AddField(
+            model_name='latexproject',
+            name='total_bytes',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='Total size of pdfs, in bytes'),
+        ),
+        migrations.RunPython(
+            populate_collection_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0003_latexproject_collection_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='latexcollection',
+            index=models.Index(fields=['project', '-creation_time'], name='latex_coll_project_ctime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='latexcollection',
+            index=models.Index(fields=['zip_file_hash'], name='latex_coll_hash_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='latexpdf',
+            index=models.Index(fields=['project', 'collection'], name='latex_pdf_project_coll_idx'),
+        ),
+    ]
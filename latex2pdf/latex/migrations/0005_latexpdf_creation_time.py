@@ -0,0 +1,40 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:06
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def populate_creation_time(apps, schema_editor):
+    LatexCollection = apps.get_model("latex", "LatexCollection")  # noqa
+    LatexPdf = apps.get_model("latex", "LatexPdf")  # noqa
+
+    # Pdfs were created along with their collections
+    for collection in LatexCollection.objects.only(
+            "id", "creation_time").iterator():
+        LatexPdf.objects.filter(collection=collection).update(
+            creation_time=collection.creation_time)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0004_hot_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='latexpdf',
+            name='creation_time',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Creation time'),
+        ),
+        migrations.RunPython(
+            populate_creation_time, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='latexpdf',
+            index=models.Index(fields=['-creation_time'], name='latex_pdf_ctime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='latexpdf',
+            index=models.Index(fields=['project', '-creation_time'], name='latex_pdf_project_ctime_idx'),
+        ),
+    ]
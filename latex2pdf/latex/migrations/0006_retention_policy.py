@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:16
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0005_latexpdf_creation_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='latexcollection',
+            name='is_pinned',
+            field=models.BooleanField(default=False, help_text='Pinned revisions are never garbage collected.', verbose_name='Pinned'),
+        ),
+        migrations.AddField(
+            model_name='latexproject',
+            name='keep_days',
+            field=models.PositiveIntegerField(blank=True, help_text='If empty, L2P_RETENTION_KEEP_DAYS is used.', null=True, verbose_name='Days to keep revisions for'),
+        ),
+        migrations.AddField(
+            model_name='latexproject',
+            name='keep_revisions',
+            field=models.PositiveIntegerField(blank=True, help_text='If empty, L2P_RETENTION_KEEP_REVISIONS is used.', null=True, validators=[django.core.validators.MinValueValidator(1)], verbose_name='Number of latest revisions to keep'),
+        ),
+    ]
@@ -22,8 +22,12 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import os
+from datetime import timedelta
+
 from django.db import models
-from django.core.validators import validate_slug
+from django.core.validators import MinValueValidator, validate_slug
+from django.urls import reverse
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 from django.conf import settings
@@ -31,8 +35,13 @@ from django.core.files.storage import get_storage_class
 from jsonfield import JSONField
 
 
+# The directory in the storage under which all pdfs are stored
+PDF_STORAGE_ROOT = "l2p_pdf"
+
+
 def pdf_upload_to(instance, filename):
-    return "l2p_pdf/{0}/{1}/{2}/{3}".format(
+    return "{0}/{1}/{2}/{3}/{4}".format(
+        PDF_STORAGE_ROOT,
         instance.project.creator.id,
         instance.project.name, instance.collection.zip_file_hash, filename)
 
@@ -57,17 +66,111 @@ class LatexProject(models.Model):
         on_delete=models.CASCADE)
     is_private = models.BooleanField(default=True)
 
+    # {{{ retention policy, see get_expired_collections
+
+    keep_revisions = models.PositiveIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1)],
+        verbose_name=_("Number of latest revisions to keep"),
+        help_text=_("If empty, L2P_RETENTION_KEEP_REVISIONS is used."))
+    keep_days = models.PositiveIntegerField(
+        null=True, blank=True,
+        verbose_name=_("Days to keep revisions for"),
+        help_text=_("If empty, L2P_RETENTION_KEEP_DAYS is used."))
+
+    # }}}
+
+    # {{{ denormalized collection stats, see update_collection_stats
+
+    latest_collection = models.ForeignKey(
+        "LatexCollection", null=True, blank=True, editable=False,
+        related_name="+", on_delete=models.SET_NULL,
+        verbose_name=_("Latest collection"))
+    latest_successful_collection = models.ForeignKey(
+        "LatexCollection", null=True, blank=True, editable=False,
+        related_name="+", on_delete=models.SET_NULL,
+        verbose_name=_("Latest successful collection"))
+    n_collections = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name=_("Number of collections"))
+    total_bytes = models.BigIntegerField(
+        default=0, editable=False, verbose_name=_("Total size of pdfs, in bytes"))
+
+    # }}}
+
     def get_collections_info(self):
+        last_revision = None
+        if self.latest_collection is not None:
+            last_revision = self.latest_collection.creation_time
+
+        return self.n_collections, last_revision
+
+    def update_collection_stats(self):
+        """
+        Recompute the denormalized collection stats of the project, which
+        is expected to be called in a transaction when collections are
+        created or deleted.
+        """
         ordered_collections = LatexCollection.objects.filter(
-            project=self).order_by("-creation_time")
+            project=self).order_by("-creation_time", "-id")
 
-        count = ordered_collections.count()
-        last_revision = None
+        stats = {
+            "latest_collection": ordered_collections.first(),
+            "latest_successful_collection": (
+                ordered_collections.filter(compile_error__isnull=True).first()),
+            "n_collections": ordered_collections.count(),
+            "total_bytes": LatexPdf.objects.filter(project=self).aggregate(
+                total_bytes=models.Sum("size"))["total_bytes"] or 0,
+        }
 
-        if count:
-            last_revision = ordered_collections[0].creation_time
+        LatexProject.objects.filter(pk=self.pk).update(**stats)
+        for name, value in stats.items():
+            setattr(self, name, value)
 
-        return count, last_revision
+    def get_retention_policy(self):
+        """
+        :return: a tuple ``(keep_revisions, keep_days)`` with the global
+            defaults applied, where None means no limit by that criterion.
+        """
+        keep_revisions = self.keep_revisions
+        if keep_revisions is None:
+            keep_revisions = getattr(
+                settings, "L2P_RETENTION_KEEP_REVISIONS", None)
+
+        keep_days = self.keep_days
+        if keep_days is None:
+            keep_days = getattr(settings, "L2P_RETENTION_KEEP_DAYS", None)
+
+        return keep_revisions, keep_days
+
+    def get_expired_collections(self, now_time=None):
+        """
+        The collections which are out of the retention policy, i.e., not
+        among the latest ``keep_revisions`` revisions, created more than
+        ``keep_days`` days ago, and not pinned. The latest (and the latest
+        successful) collection is never expired. If neither limit is set,
+        nothing expires.
+        """
+        keep_revisions, keep_days = self.get_retention_policy()
+
+        collections = LatexCollection.objects.filter(project=self)
+        if keep_revisions is None and keep_days is None:
+            return collections.none()
+
+        expired = collections.filter(is_pinned=False).exclude(
+            pk__in=[pk for pk in (self.latest_collection_id,
+                                  self.latest_successful_collection_id)
+                    if pk is not None])
+
+        if keep_revisions is not None:
+            expired = expired.exclude(pk__in=list(
+                collections.order_by("-creation_time", "-id")
+                .values_list("pk", flat=True)[:keep_revisions]))
+
+        if keep_days is not None:
+            expired = expired.filter(
+                creation_time__lt=(now_time or now()) - timedelta(
+                    days=keep_days))
+
+        return expired
 
     def __str__(self):
         return _('project: "%s" (name: "%s")') % (self.identifier, self.name)
@@ -86,11 +189,24 @@ class LatexCollection(models.Model):
         null=True, blank=True, verbose_name=_('Compile Error'))
     creation_time = models.DateTimeField(
         blank=False, default=now, verbose_name=_('Creation time'))
+    is_pinned = models.BooleanField(
+        default=False, verbose_name=_('Pinned'),
+        help_text=_("Pinned revisions are never garbage collected."))
 
     class Meta:
         unique_together = (("project", "zip_file_hash"),)
         ordering = ("-creation_time",)
 
+        # See the audit_indexes command for the queries these are for.
+        # Lookups by (project, zip_file_hash) use the unique_together index.
+        indexes = [
+            models.Index(
+                fields=["project", "-creation_time"],
+                name="latex_coll_project_ctime_idx"),
+            models.Index(
+                fields=["zip_file_hash"], name="latex_coll_hash_idx"),
+        ]
+
     def __str__(self):
         return _('project: "%s", zip file hash: "%s", created_at %s') % (
             self.project.identifier, self.zip_file_hash, self.creation_time)
@@ -105,10 +221,37 @@ class LatexPdf(models.Model):
     pdf = models.FileField(
         null=True, blank=True, upload_to=pdf_upload_to, storage=OverwriteStorage())
     mediabox = JSONField(null=True, blank=True, verbose_name=_('Media box size, in points'))
+    size = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name=_('Size, in bytes'))
+    original_size = models.PositiveIntegerField(
+        null=True, blank=True,
+        verbose_name=_('Size before post-processing, in bytes'))
+    creation_time = models.DateTimeField(
+        blank=False, default=now, verbose_name=_('Creation time'))
 
     class Meta:
         verbose_name = _("LaTeXPdf")
         verbose_name_plural = _("LaTeXPdfs")
+        indexes = [
+            models.Index(
+                fields=["project", "collection"],
+                name="latex_pdf_project_coll_idx"),
+            # For the cursor pagination of the list api
+            models.Index(
+                fields=["-creation_time"], name="latex_pdf_ctime_idx"),
+            models.Index(
+                fields=["project", "-creation_time"],
+                name="latex_pdf_project_ctime_idx"),
+        ]
+
+    def get_filename(self):
+        return os.path.basename(self.pdf.name)
+
+    def get_absolute_url(self):
+        return reverse("pdf-download", kwargs={
+            "zip_file_hash": self.collection.zip_file_hash,
+            "pdf_id": self.pk,
+            "filename": self.get_filename()})
 
     def aspect_ratio(self):
         if self.mediabox is None:
@@ -118,4 +261,4 @@ class LatexPdf(models.Model):
 
     def __repr__(self):
         return "<project:%s, filename: %s, creation_time:%s, path:%s>" % (
-            self.project.name, self.name, self.collection.creation_time, self.pdf.url)
+            self.project.name, self.name, self.collection.creation_time, self.pdf.name)
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from collections import namedtuple
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.db import IntegrityError
+from django.db.models import F
+from django.db.transaction import atomic
+
+from latex.api import (
+    get_cache_key_field, get_pdf_cache_items)
+from latex.metrics import CACHE_FILLS
+from latex.models import LatexProject, LatexCollection, LatexPdf
+
+from typing import Iterable, List, Optional, Text  # noqa
+
+
+CompiledPdf = namedtuple(
+    "CompiledPdf", "name, path, mediabox, size, original_size")
+
+
+def store_pdf_files(pdfs, compiled_pdfs):
+    # type: (List[LatexPdf], Iterable[CompiledPdf]) -> List[Text]
+    """
+    Write the compiled pdfs to the storage, without saving the instances.
+
+    :return: a list of the names of the stored files.
+    """
+    stored_names = []
+    try:
+        for pdf, compiled_pdf in zip(pdfs, compiled_pdfs):
+            with open(compiled_pdf.path, "rb") as f:
+                pdf.pdf.save(compiled_pdf.name, File(f), save=False)
+            stored_names.append(pdf.pdf.name)
+    except Exception:
+        delete_stored_files(stored_names)
+        raise
+    return stored_names
+
+
+def delete_stored_files(names):
+    # type: (Iterable[Text]) -> None
+    """
+    Delete the stored files named `names`, except those a saved pdf points
+    to, e.g., after a concurrent compile of the same collection won.
+    """
+    names = set(names)
+    if not names:
+        return
+
+    names -= set(
+        LatexPdf.objects.filter(pdf__in=names).values_list("pdf", flat=True))
+
+    storage = LatexPdf._meta.get_field("pdf").storage
+    for name in names:
+        storage.delete(name)
+
+
+def fill_pdf_cache(pdfs):
+    # type: (List[LatexPdf]) -> None
+    try:
+        import django.core.cache as cache
+    except ImproperlyConfigured:
+        return
+
+    items = get_pdf_cache_items(pdfs, view="compile")
+    if not items:
+        return
+
+    cache.caches["default"].set_many(items, None)
+    for cache_key in items:
+        CACHE_FILLS.inc(field=get_cache_key_field(cache_key), view="compile")
+
+
+def save_compile_result(project, zip_file_hash, compiled_pdfs=(),
+                        compile_error=None):
+    # type: (LatexProject, Text, List[CompiledPdf], Optional[Text]) -> LatexCollection  # noqa
+    """
+    Persist the result of compiling a collection: the collection and all its
+    pdfs are written in a single transaction, with the pdfs inserted by one
+    ``bulk_create``, then the cache is filled in one batch.
+
+    The collection is inserted first, so that a concurrent compile of the
+    same collection fails on the unique (project, zip_file_hash) constraint
+    before writing any files (which have fixed names, and are overwritten),
+    and gets the collection which won. The pdf files are written in the
+    transaction, and are deleted if it fails, so that no orphaned files are
+    left.
+
+    Note that ``bulk_create`` doesn't send ``post_save``, so the cache and
+    the project stats which are maintained by the receivers for single
+    saves are updated here.
+    """
+    collection = LatexCollection(
+        project=project, zip_file_hash=zip_file_hash,
+        compile_error=compile_error)
+
+    pdfs = [
+        LatexPdf(
+            project=project,
+            collection=collection,
+            name=compiled_pdf.name,
+            mediabox=compiled_pdf.mediabox,
+            size=compiled_pdf.size,
+            original_size=compiled_pdf.original_size)
+        for compiled_pdf in compiled_pdfs]
+
+    stored_names = []  # type: List[Text]
+    try:
+        with atomic():
+            try:
+                with atomic():
+                    collection.save()
+            except IntegrityError:
+                # Saved by a concurrent compile
+                existing = LatexCollection.objects.filter(
+                    project=project, zip_file_hash=zip_file_hash).first()
+                if existing is None:
+                    raise
+                return existing
+
+            if pdfs:
+                for pdf in pdfs:
+                    # The collection had no pk when assigned
+                    pdf.collection = collection
+                stored_names = store_pdf_files(pdfs, compiled_pdfs)
+                LatexPdf.objects.bulk_create(pdfs)
+
+                total_bytes = sum(pdf.size or 0 for pdf in pdfs)
+                if total_bytes:
+                    LatexProject.objects.filter(pk=project.pk).update(
+                        total_bytes=F("total_bytes") + total_bytes)
+    except Exception:
+        delete_stored_files(stored_names)
+        raise
+
+    fill_pdf_cache(pdfs)
+
+    return collection
@@ -1,13 +1,25 @@
-from django.db.models.signals import post_save, post_delete
+import threading
+from contextlib import contextmanager
+
+from django.db.models import F
+from django.db.models.signals import (
+    post_save, post_delete, post_migrate, pre_delete)
+from django.db.backends.signals import connection_created
+from django.db import transaction
+from django.db.transaction import atomic
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ImproperlyConfigured
 
 from rest_framework.authtoken.models import Token
 
-from latex.models import LatexPdf
-from latex.serializers import LatexPdfSerializer
-from latex.api import get_field_cache_key
+from latex.auth import invalidate_cached_tokens
+from latex.cleanup import get_cleanup_queue
+from latex.models import LatexProject, LatexCollection, LatexPdf
+from latex.api import (
+    CREATOR_IDS_CACHE_FIELD, get_field_cache_key, get_cache_key_field,
+    get_pdf_cache_items)
+from latex.metrics import CACHE_FILLS
 
 
 @receiver(post_save, sender=get_user_model())
@@ -16,20 +28,84 @@ def create_auth_token(sender, instance=None, created=False, **kwargs):
         Token.objects.create(user=instance)
 
 
+# {{{ cached token invalidation
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    invalidate_cached_tokens([instance.key])
+
+
+@receiver(post_save, sender=get_user_model())
+def invalidate_cached_user_tokens(sender, instance, created=False,
+                                  update_fields=None, **kwargs):
+    # Tokens of deleted users are deleted by cascade, see above.
+    if created or update_fields == frozenset(["last_login"]):
+        # Saved on each login
+        return
+    invalidate_cached_tokens(
+        Token.objects.filter(user=instance).values_list("key", flat=True))
+
+# }}}
+
+
+_deleting_local = threading.local()
+
+
+def get_deleting_collection_hashes():
+    """
+    Hashes of collections being deleted in the current thread, by pk, so that
+    pdfs deleted by cascade don't each fetch their collection.
+    """
+    if not hasattr(_deleting_local, "collection_hashes"):
+        _deleting_local.collection_hashes = {}
+    return _deleting_local.collection_hashes
+
+
+@receiver(pre_delete, sender=LatexCollection)
+def mark_collection_deleting(sender, instance, **kwargs):
+    get_deleting_collection_hashes()[instance.pk] = instance.zip_file_hash
+
+
+@receiver(post_delete, sender=LatexCollection)
+def unmark_collection_deleting(sender, instance, **kwargs):
+    get_deleting_collection_hashes().pop(instance.pk, None)
+
+
 @receiver(post_delete, sender=LatexPdf)
 def pdf_delete(sender, instance, **kwargs):
     """
-    Delete the associated image when the instance is deleted.
+    Delete the associated pdf file and cache when the instance is deleted.
+
+    The deletion is queued to a background worker which deletes files and
+    cache keys in batches, so that deleting a big project (which cascades
+    to all its pdfs) doesn't block the request. Items are queued only after
+    the transaction is committed, so that nothing is deleted if the
+    instance deletion is rolled back.
     """
+    try:
+        import django.core.cache as cache
+    except ImproperlyConfigured:
+        def_cache = None
+        cache_key = None
+    else:
+        def_cache = cache.caches["default"]
+        zip_file_hash = get_deleting_collection_hashes().get(
+            instance.collection_id)
+        if zip_file_hash is None:
+            zip_file_hash = instance.collection.zip_file_hash
+        cache_key = get_field_cache_key(zip_file_hash, "pdf")
+
+    storage = instance.pdf.storage
+    name = instance.pdf.name
 
-    # “false” to instance.image.delete ensures that ImageField
-    # does not save the model
-    # post_delete signal is sent at the end of a model’s delete()
-    # method and a queryset’s delete() method.
-    # This is safer as it does not execute unless the parent object
-    # is successfully deleted.
-    instance.pdf.delete(False)
+    transaction.on_commit(
+        lambda: get_cleanup_queue().put(storage, name, def_cache, cache_key))
 
+
+@receiver(post_save, sender=LatexPdf)
+def create_pdf_cache_on_save(sender, instance, **kwargs):
+    # We will cache pdf relative path
     try:
         import django.core.cache as cache
     except ImproperlyConfigured:
@@ -37,39 +113,131 @@ def pdf_delete(sender, instance, **kwargs):
 
     def_cache = cache.caches["default"]
 
-    for attr in ("pdf", ):
-        def_cache.delete(get_field_cache_key(instance.collection.zip_file_hash, attr))
+    items = get_pdf_cache_items([instance], view="pdf_save")
+    for cache_key, attr_value in items.items():
+        if def_cache.add(cache_key, attr_value, None):
+            CACHE_FILLS.inc(
+                field=get_cache_key_field(cache_key), view="pdf_save")
 
 
-@receiver(post_save, sender=LatexPdf)
-def create_pdf_cache_on_save(sender, instance, **kwargs):
-    # We will cache image and data_url
+@receiver(post_save, sender=LatexCollection)
+@receiver(post_delete, sender=LatexCollection)
+def invalidate_cached_creator_ids(sender, instance, created=True, **kwargs):
+    """
+    Delete the cached creators of the projects with collections of the zip
+    file hash (see :func:`latex.api.get_cached_attributes_by_tex_keys`) when
+    a collection is created or deleted, after the transaction is committed.
+    """
+    if not created:
+        return
+
     try:
         import django.core.cache as cache
     except ImproperlyConfigured:
         return
 
     def_cache = cache.caches["default"]
+    cache_key = get_field_cache_key(
+        instance.zip_file_hash, CREATOR_IDS_CACHE_FIELD)
+    transaction.on_commit(lambda: def_cache.delete(cache_key))
+
+
+# {{{ denormalized project stats
+
+_local = threading.local()
+
+
+def get_deleting_project_ids():
+    """
+    Ids of projects being deleted in the current thread, or whose
+    collections are being bulk deleted (see :func:`bulk_deleting_collections`).
+    Stats of those projects are not updated when their collections and pdfs
+    are deleted.
+    """
+    if not hasattr(_local, "deleting_project_ids"):
+        _local.deleting_project_ids = set()
+    return _local.deleting_project_ids
+
+
+@contextmanager
+def bulk_deleting_collections(project):
+    """
+    A context manager for deleting many collections of `project`, in which
+    the stats of the project are updated once at the end, rather than once
+    for each deleted collection and pdf.
+    """
+    get_deleting_project_ids().add(project.pk)
+    try:
+        yield
+    finally:
+        get_deleting_project_ids().discard(project.pk)
+
+    project.update_collection_stats()
+
+
+@receiver(pre_delete, sender=LatexProject)
+def mark_project_deleting(sender, instance, **kwargs):
+    get_deleting_project_ids().add(instance.pk)
+
+
+@receiver(post_delete, sender=LatexProject)
+def unmark_project_deleting(sender, instance, **kwargs):
+    get_deleting_project_ids().discard(instance.pk)
+
+
+@receiver(post_save, sender=LatexCollection)
+@receiver(post_delete, sender=LatexCollection)
+def update_project_stats_on_collection_change(sender, instance, **kwargs):
+    if instance.project_id in get_deleting_project_ids():
+        return
+
+    with atomic():
+        instance.project.update_collection_stats()
+
+
+@receiver(post_save, sender=LatexPdf)
+def update_project_total_bytes_on_pdf_create(sender, instance, created, **kwargs):
+    if not created or not instance.size:
+        return
+    LatexProject.objects.filter(pk=instance.project_id).update(
+        total_bytes=F("total_bytes") + instance.size)
+
+
+@receiver(post_delete, sender=LatexPdf)
+def update_project_total_bytes_on_pdf_delete(sender, instance, **kwargs):
+    if instance.project_id in get_deleting_project_ids() or not instance.size:
+        return
+    LatexProject.objects.filter(pk=instance.project_id).update(
+        total_bytes=F("total_bytes") - instance.size)
+
+# }}}
+
+
+@receiver(connection_created)
+def set_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
 
     from django.conf import settings
+    pragmas = getattr(settings, "L2P_SQLITE_PRAGMAS", {})
+    if not pragmas:
+        return
 
-    serializer = LatexPdfSerializer(instance)
-    data = serializer.to_representation(instance)
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA %s = %s" % (name, value))
 
-    attr_to_cache = []
 
-    if (data["pdf"]
-            and getattr(settings, "L2P_API_PDF_RETURNS_RELATIVE_PATH", True)):
-        # We only cache when pdf relative path are requested in api
-        # because we can't access the request thus no way to know
-        # the url and can't build the pdf url.
+@receiver(post_migrate)
+def warm_cache_after_migrate(sender, **kwargs):
+    from django.conf import settings
+    if sender.name != "latex":
+        return
+
+    if not getattr(settings, "L2P_WARM_CACHE_ON_MIGRATE", False):
+        return
 
-        attr_to_cache.append("pdf")
+    from django.core.management import call_command
+    call_command("warm_cache", verbosity=kwargs.get("verbosity", 1))
 
-    for attr in attr_to_cache:
-        attr_value = data[attr]
-        if (attr_value is not None
-                and len(str(attr_value)) <= getattr(
-                    settings, "L2P_CACHE_MAX_BYTES", 0)):
-            def_cache.add(
-                get_field_cache_key(instance.collection.zip_file_hash, attr), attr_value, None)
+# vim: foldmethod=marker
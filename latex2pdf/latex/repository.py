@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import threading
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils.timezone import is_naive, make_aware, utc
+
+from latex.models import LatexCollection, LatexPdf, LatexProject
+
+from typing import Any, Dict, List, Optional, Set, Text, Tuple, TYPE_CHECKING  # noqa
+if TYPE_CHECKING:
+    from django.db import models  # noqa
+
+
+class RepositoryBase(object):
+    """
+    Hot read queries, which are issued either via the ORM, or, when
+    ``L2P_HOT_READ_BACKEND = "pymongo"`` on a djongo database, directly via
+    pymongo on a pooled client, which skips djongo's translation of the
+    generated SQL into mongo operations. See :func:`get_repository`.
+    """
+
+    def get_collection(self, project_id, zip_file_hash):
+        # type: (int, Text) -> Optional[LatexCollection]
+        raise NotImplementedError()
+
+    def get_latest_collection(self, project):
+        # type: (LatexProject) -> Optional[LatexCollection]
+        """
+        The latest collection of `project`, i.e., that of its denormalized
+        ``latest_collection`` pointer, with its ``project`` set to it.
+        """
+        raise NotImplementedError()
+
+    def get_pdfs(self, collection):
+        # type: (LatexCollection) -> List[LatexPdf]
+        """
+        The pdfs of `collection`, with their ``collection`` set to it.
+        """
+        raise NotImplementedError()
+
+    def get_creator_ids_by_hashes(self, zip_file_hashes):
+        # type: (List[Text]) -> Dict[Text, Set[int]]
+        """
+        A dict mapping each of `zip_file_hashes` which has collections to the
+        pks of the creators of the projects of those collections.
+        """
+        raise NotImplementedError()
+
+    def get_pdf_values_by_hashes(self, zip_file_hashes, fields,
+                                 creator_id=None):
+        # type: (List[Text], List[Text], Optional[int]) -> List[Dict[Text, Any]]  # noqa
+        """
+        Like ``QuerySet.values(*fields)`` of the pdfs of the collections with
+        `zip_file_hashes`, with an extra ``zip_file_hash`` key in each dict.
+        `fields` are column names. If `creator_id` is not None, only pdfs
+        of projects created by that user are included.
+        """
+        raise NotImplementedError()
+
+    def get_compile_errors(self, zip_file_hashes, creator_id=None):
+        # type: (List[Text], Optional[int]) -> List[Tuple[Text, Text]]
+        """
+        A list of ``(zip_file_hash, compile_error)`` of the collections with
+        `zip_file_hashes` which failed to compile. If `creator_id` is not
+        None, only collections of projects created by that user are included.
+        """
+        raise NotImplementedError()
+
+
+class OrmRepository(RepositoryBase):
+    def get_collection(self, project_id, zip_file_hash):
+        return LatexCollection.objects.filter(
+            project_id=project_id, zip_file_hash=zip_file_hash).first()
+
+    def get_latest_collection(self, project):
+        if project.latest_collection_id is None:
+            return None
+        collection = project.latest_collection
+        collection.project = project
+        return collection
+
+    def get_pdfs(self, collection):
+        return list(collection.entries.all())
+
+    def get_creator_ids_by_hashes(self, zip_file_hashes):
+        creator_ids = {}  # type: Dict[Text, Set[int]]
+        for zip_file_hash, creator_id in (
+                LatexCollection.objects
+                .filter(zip_file_hash__in=zip_file_hashes)
+                .values_list("zip_file_hash", "project__creator_id")):
+            creator_ids.setdefault(zip_file_hash, set()).add(creator_id)
+        return creator_ids
+
+    def get_pdf_values_by_hashes(self, zip_file_hashes, fields,
+                                 creator_id=None):
+        queryset = LatexPdf.objects.filter(
+            collection__zip_file_hash__in=zip_file_hashes)
+        if creator_id is not None:
+            queryset = queryset.filter(project__creator_id=creator_id)
+        rows = queryset.values("collection__zip_file_hash", *fields)
+        for row in rows:
+            row["zip_file_hash"] = row.pop("collection__zip_file_hash")
+        return list(rows)
+
+    def get_compile_errors(self, zip_file_hashes, creator_id=None):
+        queryset = LatexCollection.objects.filter(
+            zip_file_hash__in=zip_file_hashes, compile_error__isnull=False)
+        if creator_id is not None:
+            queryset = queryset.filter(project__creator_id=creator_id)
+        return list(queryset.values_list("zip_file_hash", "compile_error"))
+
+
+# {{{ pymongo
+
+_mongo_client = None
+_mongo_client_lock = threading.Lock()
+
+
+def get_mongo_client():
+    """
+    The pymongo client shared by all threads of the process, which holds
+    a connection pool.
+    """
+    global _mongo_client
+
+    if _mongo_client is None:
+        with _mongo_client_lock:
+            if _mongo_client is None:
+                try:
+                    import pymongo
+                except ImportError:
+                    raise ImproperlyConfigured(
+                        "pymongo is required when L2P_HOT_READ_BACKEND "
+                        "is 'pymongo', or GridFSStorage is used")
+
+                client_kwargs = dict(
+                    settings.DATABASES[DEFAULT_DB_ALIAS].get("CLIENT", {}))
+                _mongo_client = pymongo.MongoClient(connect=False, **client_kwargs)
+
+    return _mongo_client
+
+
+def convert_document_value(field, value, connection):
+    if value is None:
+        return None
+
+    # Datetimes are stored as naive utc datetimes in mongo
+    if (isinstance(value, datetime) and is_naive(value)
+            and settings.USE_TZ):
+        value = make_aware(value, utc)
+
+    if hasattr(field, "from_db_value"):
+        value = field.from_db_value(value, None, connection)
+
+    return value
+
+
+def model_from_document(model, document, using=DEFAULT_DB_ALIAS):
+    # type: (type, Dict[Text, Any], Text) -> models.Model
+    """
+    Build an instance of `model` from a mongo `document`, as if it were
+    loaded via the ORM.
+    """
+    connection = connections[using]
+    fields = model._meta.concrete_fields
+    values = [
+        convert_document_value(field, document.get(field.attname), connection)
+        for field in fields]
+    return model.from_db(using, [field.attname for field in fields], values)
+
+
+def values_from_document(model, document, fields, using=DEFAULT_DB_ALIAS):
+    # type: (type, Dict[Text, Any], List[Text], Text) -> Dict[Text, Any]
+    connection = connections[using]
+    return dict(
+        (name, convert_document_value(
+            model._meta.get_field(name), document.get(name), connection))
+        for name in fields)
+
+
+class PymongoRepository(RepositoryBase):
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        self.using = using
+        self.db = get_mongo_client()[settings.DATABASES[using]["NAME"]]
+
+    def get_mongo_collection(self, model):
+        return self.db[model._meta.db_table]
+
+    def get_collection(self, project_id, zip_file_hash):
+        document = self.get_mongo_collection(LatexCollection).find_one(
+            {"project_id": project_id, "zip_file_hash": zip_file_hash})
+        if document is None:
+            return None
+        return model_from_document(LatexCollection, document, self.using)
+
+    def get_latest_collection(self, project):
+        if project.latest_collection_id is None:
+            return None
+        document = self.get_mongo_collection(LatexCollection).find_one(
+            {"id": project.latest_collection_id})
+        if document is None:
+            return None
+        collection = model_from_document(
+            LatexCollection, document, self.using)
+        collection.project = project
+        return collection
+
+    def get_pdfs(self, collection):
+        pdfs = []
+        for document in self.get_mongo_collection(LatexPdf).find(
+                {"collection_id": collection.pk}):
+            pdf = model_from_document(LatexPdf, document, self.using)
+            pdf.collection = collection
+            pdfs.append(pdf)
+        return pdfs
+
+    def get_project_ids(self, creator_id):
+        # type: (int) -> List[int]
+        return [
+            document["id"]
+            for document in self.get_mongo_collection(LatexProject).find(
+                {"creator_id": creator_id}, {"_id": False, "id": True})]
+
+    def get_collection_query(self, zip_file_hashes, creator_id=None):
+        # type: (List[Text], Optional[int]) -> Dict[Text, Any]
+        query = {"zip_file_hash": {"$in": list(zip_file_hashes)}}
+        if creator_id is not None:
+            query["project_id"] = {"$in": self.get_project_ids(creator_id)}
+        return query
+
+    def get_creator_ids_by_hashes(self, zip_file_hashes):
+        project_hashes = {}  # type: Dict[int, Set[Text]]
+        for document in self.get_mongo_collection(LatexCollection).find(
+                self.get_collection_query(zip_file_hashes),
+                {"_id": False, "project_id": True, "zip_file_hash": True}):
+            project_hashes.setdefault(
+                document["project_id"], set()).add(document["zip_file_hash"])
+        if not project_hashes:
+            return {}
+
+        creator_ids = {}  # type: Dict[Text, Set[int]]
+        for document in self.get_mongo_collection(LatexProject).find(
+                {"id": {"$in": list(project_hashes)}},
+                {"_id": False, "id": True, "creator_id": True}):
+            for zip_file_hash in project_hashes[document["id"]]:
+                creator_ids.setdefault(zip_file_hash, set()).add(
+                    document["creator_id"])
+        return creator_ids
+
+    def get_pdf_values_by_hashes(self, zip_file_hashes, fields,
+                                 creator_id=None):
+        collection_hashes = dict(
+            (document["id"], document["zip_file_hash"])
+            for document in self.get_mongo_collection(LatexCollection).find(
+                self.get_collection_query(zip_file_hashes, creator_id),
+                {"_id": False, "id": True, "zip_file_hash": True}))
+        if not collection_hashes:
+            return []
+
+        projection = dict((name, True) for name in fields)
+        projection.update({"_id": False, "collection_id": True})
+
+        rows = []
+        for document in self.get_mongo_collection(LatexPdf).find(
+                {"collection_id": {"$in": list(collection_hashes)}},
+                projection):
+            row = values_from_document(LatexPdf, document, fields, self.using)
+            row["zip_file_hash"] = collection_hashes[document["collection_id"]]
+            rows.append(row)
+        return rows
+
+    def get_compile_errors(self, zip_file_hashes, creator_id=None):
+        query = self.get_collection_query(zip_file_hashes, creator_id)
+        query["compile_error"] = {"$ne": None}
+        return [
+            (document["zip_file_hash"], document["compile_error"])
+            for document in self.get_mongo_collection(LatexCollection).find(
+                query,
+                {"_id": False, "zip_file_hash": True, "compile_error": True})]
+
+# }}}
+
+
+HOT_READ_BACKENDS = {
+    "orm": OrmRepository,
+    "pymongo": PymongoRepository,
+}
+
+_repositories = {}  # type: Dict[Text, RepositoryBase]
+
+
+def get_repository():
+    # type: () -> RepositoryBase
+    backend = getattr(settings, "L2P_HOT_READ_BACKEND", "orm")
+    if backend not in HOT_READ_BACKENDS:
+        raise ImproperlyConfigured(
+            "L2P_HOT_READ_BACKEND must be one of %s, got '%s'"
+            % (", ".join(sorted(HOT_READ_BACKENDS)), backend))
+
+    if backend == "pymongo" and (
+            settings.DATABASES[DEFAULT_DB_ALIAS]["ENGINE"] != "djongo"):
+        raise ImproperlyConfigured(
+            "L2P_HOT_READ_BACKEND 'pymongo' requires the djongo engine")
+
+    if backend not in _repositories:
+        _repositories[backend] = HOT_READ_BACKENDS[backend]()
+    return _repositories[backend]
+
+# vim: foldmethod=marker
@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import random
+import threading
+from functools import wraps
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.functional import empty
+
+from latex.utils import is_process_local_cache
+
+from typing import Any, Callable, List, Optional, Text, TYPE_CHECKING  # noqa
+if TYPE_CHECKING:
+    from django.http import HttpRequest  # noqa
+
+_local = threading.local()
+
+
+def get_replica_aliases():
+    # type: () -> List[Text]
+    return getattr(settings, "L2P_DB_REPLICAS", [])
+
+
+# {{{ pinning to the primary
+
+def pin_to_primary():
+    """
+    Send all the reads of the current request (or thread) to the primary.
+    This is done implicitly after any write.
+    """
+    _local.pinned = True
+
+
+def is_pinned_to_primary():
+    # type: () -> bool
+    if getattr(_local, "pinned", False):
+        return True
+
+    request = getattr(_local, "request", None)
+    if request is None:
+        return False
+
+    if not hasattr(_local, "user_pinned"):
+        user = get_resolved_user(request)
+        if user is None:
+            # Not known yet, don't resolve it here, which needs reads
+            return False
+        _local.user_pinned = (
+            user.is_authenticated and is_user_pinned_to_primary(user.pk))
+
+    return _local.user_pinned
+
+
+def use_primary_db(view_func):
+    # type: (Callable) -> Callable
+    """
+    A decorator for views (e.g., those compiling) whose reads must see the
+    latest writes.
+    """
+    @wraps(view_func)
+    def wrapper(*args, **kwargs):
+        pin_to_primary()
+        return view_func(*args, **kwargs)
+    return wrapper
+
+
+def get_resolved_user(request):
+    # type: (HttpRequest) -> Optional[Any]
+    user = request.__dict__.get("user")
+    if user is None:
+        return None
+
+    # The lazy user set by AuthenticationMiddleware, or the user set by
+    # rest_framework after authentication
+    wrapped = getattr(user, "_wrapped", None)
+    if wrapped is empty:
+        return None
+    return user if wrapped is None else wrapped
+
+
+def get_user_pin_cache_key(user_id):
+    return "l2p_pin_primary:%s" % user_id
+
+
+def get_pin_cache():
+    """
+    The cache in which users are pinned to the primary, which must be shared
+    by all the processes, or the following requests of a user handled by
+    another process would read stale data from the replicas.
+    """
+    try:
+        import django.core.cache as cache
+    except ImproperlyConfigured:
+        def_cache = None
+    else:
+        def_cache = cache.caches["default"]
+
+    if def_cache is None or is_process_local_cache(def_cache):
+        raise ImproperlyConfigured(
+            "settings.L2P_DB_REPLICAS requires CACHES['default'] to be a "
+            "cache shared by all the processes (e.g., memcached or redis)")
+    return def_cache
+
+
+def pin_user_to_primary(user_id):
+    """
+    Send the reads of the following requests of the user to the primary for
+    ``L2P_DB_REPLICA_PIN_SECONDS``, i.e., until the replicas have likely
+    caught up with the user's writes.
+    """
+    get_pin_cache().set(
+        get_user_pin_cache_key(user_id), True,
+        getattr(settings, "L2P_DB_REPLICA_PIN_SECONDS", 10))
+
+
+def is_user_pinned_to_primary(user_id):
+    return bool(get_pin_cache().get(get_user_pin_cache_key(user_id)))
+
+# }}}
+
+
+class ReplicaRouter(object):
+    """
+    Send reads to one of the replicas (``L2P_DB_REPLICAS``, aliases of
+    ``DATABASES``) and writes to the primary (``DATABASES["default"]``).
+
+    Reads are sent to the primary instead for the rest of a request after it
+    wrote, and for the following requests of the same user for a while
+    after the user wrote to the latex app (e.g., compiled), see
+    :class:`ReplicaPinningMiddleware`. The latter needs a shared cache, see
+    :func:`get_pin_cache`.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = get_replica_aliases()
+        if not replicas or is_pinned_to_primary():
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        if model._meta.app_label == "latex":
+            _local.wrote_app_data = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set([DEFAULT_DB_ALIAS] + get_replica_aliases())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are replicated from the primary
+        if db in get_replica_aliases():
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware(object):
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _local.request = request
+        _local.pinned = False
+        _local.wrote_app_data = False
+        try:
+            response = self.get_response(request)
+
+            if _local.wrote_app_data and get_replica_aliases():
+                user = get_resolved_user(request)
+                if user is not None and user.is_authenticated:
+                    pin_user_to_primary(user.pk)
+        finally:
+            _local.__dict__.clear()
+
+        return response
+
+# vim: foldmethod=marker
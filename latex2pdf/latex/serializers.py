@@ -1,6 +1,12 @@
+import os
+from collections import OrderedDict
+
 from rest_framework import serializers
 from latex.models import LatexProject, LatexCollection, LatexPdf
 from django.conf import settings
+from django.urls import reverse
+
+from typing import Any, Dict, List, Text, Tuple  # noqa
 
 
 class LatexProjectSerializer(serializers.ModelSerializer):
@@ -21,36 +27,156 @@ class DynamicFieldsModelSerializer(serializers.ModelSerializer):
     controls which fields should be displayed.
 
     https://www.django-rest-framework.org/api-guide/serializers/#example
+
+    Instead of building all the fields and then dropping the unwanted ones
+    on each instantiation, a subclass with only the wanted fields is created
+    (once for each subset of fields) and instantiated.
     """
 
-    def __init__(self, *args, **kwargs):
-        # Don't pass the 'fields' arg up to the superclass
-        fields = kwargs.pop('fields', None)
+    # {(cls, field_names): subclass}, bounded by the subsets of the fields
+    _field_subset_classes = {}  # type: Dict[Tuple[type, Tuple[Text, ...]], type]
+    _all_field_names = {}  # type: Dict[type, Tuple[Text, ...]]
+
+    def __new__(cls, *args, **kwargs):
+        fields = kwargs.pop("fields", None)
+        if fields is not None:
+            cls = cls.get_field_subset_class(fields)
+        return super().__new__(cls, *args, **kwargs)
 
-        # Instantiate the superclass normally
+    def __init__(self, *args, **kwargs):
+        # Already handled in __new__
+        kwargs.pop("fields", None)
         super().__init__(*args, **kwargs)
 
-        if fields is not None:
-            # Drop any fields that are not specified in the `fields` argument
-            # but we will always include "compile_error"
-            allowed = set(fields.split(","))
-            existing = set(self.fields)
-            for field_name in existing - allowed:
-                self.fields.pop(field_name)
+    @classmethod
+    def get_field_subset_class(cls, fields):
+        # type: (Text) -> type
+        if cls not in cls._all_field_names:
+            cls._all_field_names[cls] = tuple(cls().fields)
+
+        allowed = set(fields.split(","))
+        field_names = tuple(
+            name for name in cls._all_field_names[cls] if name in allowed)
+
+        key = (cls, field_names)
+        subclass = cls._field_subset_classes.get(key)
+        if subclass is None:
+            meta = type("Meta", (cls.Meta,), {"fields": field_names})
+            subclass = type(cls.__name__, (cls,), {
+                "Meta": meta, "__module__": cls.__module__})
+
+            # Subclasses are always built with all their fields
+            cls._all_field_names[subclass] = field_names
+            cls._field_subset_classes[key] = subclass
+
+        return subclass
+
+    # {{{ read only rendering from values()
+
+    def get_value_sources(self):
+        # type: () -> List[Text]
+        """
+        The model fields to be passed to ``QuerySet.values()`` to get the rows
+        for :meth:`values_to_representation`. Only fields which map to model
+        columns are supported.
+        """
+        return [field.source for field in self._readable_fields]
+
+    def value_to_representation(self, field, value):
+        if value is None:
+            return None
+
+        if isinstance(field, serializers.FileField):
+            # FileField.to_representation would need a FieldFile
+            if not value:
+                return None
+            url = self.Meta.model._meta.get_field(field.source).storage.url(value)
+            request = self.context.get("request", None)
+            if request is not None:
+                return request.build_absolute_uri(url)
+            return url
+
+        return field.to_representation(value)
+
+    def values_to_representation(self, row):
+        # type: (Dict[Text, Any]) -> Dict[Text, Any]
+        """
+        Like :meth:`to_representation`, but for a dict `row` returned by
+        ``QuerySet.values(*self.get_value_sources())``, so that no model
+        instances need to be created when rendering large read only results.
+        """
+        ret = OrderedDict()
+        for field in self._readable_fields:
+            ret[field.field_name] = self.value_to_representation(
+                field, row[field.source])
+        return ret
+
+    # }}}
 
 
 class LatexPdfSerializer(DynamicFieldsModelSerializer):
+    """
+    The ``pdf`` field is either the relative path in the storage (if
+    ``L2P_API_PDF_RETURNS_RELATIVE_PATH``), or the url of the pdf served
+    (with permission checks) by :func:`latex.views.serve_pdf`, rather than
+    the storage url, which is not served for local storages.
+    """
 
     class Meta:
         model = LatexPdf
         fields = ("id", "pdf")
+        # The url of the storage is never returned (and not all storages
+        # have urls), see to_representation
+        extra_kwargs = {"pdf": {"use_url": False}}
+
+    def returns_pdf_url(self):
+        return (
+            "pdf" in [field.field_name for field in self._readable_fields]
+            and not getattr(
+                settings, "L2P_API_PDF_RETURNS_RELATIVE_PATH", True))
+
+    def get_pdf_url(self, url):
+        request = self.context.get("request", None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        if not getattr(settings, "L2P_API_PDF_RETURNS_RELATIVE_PATH", True):
-            print(representation)
+        if representation.get("pdf") is None:
             return representation
 
-        if "pdf" in representation and representation["pdf"] is not None:
+        if getattr(settings, "L2P_API_PDF_RETURNS_RELATIVE_PATH", True):
             representation['pdf'] = str(instance.pdf)
+        else:
+            representation['pdf'] = self.get_pdf_url(
+                instance.get_absolute_url())
         return representation
+
+    def get_value_sources(self):
+        sources = super().get_value_sources()
+        if self.returns_pdf_url() and "id" not in sources:
+            # needed to build the url
+            sources.append("id")
+        return sources
+
+    def value_to_representation(self, field, value):
+        if field.field_name == "pdf" and value:
+            # The url, if requested, is built in values_to_representation
+            return value
+        return super().value_to_representation(field, value)
+
+    def values_to_representation(self, row):
+        """
+        If the pdf url is rendered, `row` must also have a ``zip_file_hash``
+        key, i.e., the zip file hash of the collection of the pdf.
+        """
+        ret = super().values_to_representation(row)
+        if self.returns_pdf_url() and ret.get("pdf") is not None:
+            ret["pdf"] = self.get_pdf_url(reverse("pdf-download", kwargs={
+                "zip_file_hash": row["zip_file_hash"],
+                "pdf_id": row["id"],
+                "filename": os.path.basename(row["pdf"])}))
+        return ret
+
+# vim: foldmethod=marker
@@ -0,0 +1,534 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import fcntl
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.deconstruct import deconstructible
+from django.utils.module_loading import import_string
+from django.utils.timezone import is_naive, make_aware, utc
+
+from typing import Any, Iterator, List, Optional, Text, Tuple  # noqa
+
+DEFAULT_TIERED_STORAGE_REMOTE = "django_s3_storage.storage.S3Storage"
+DEFAULT_TIERED_STORAGE_LOCAL_MAX_BYTES = 1024 ** 3
+
+LRU_LOCK_FILE_NAME = ".l2p-lru.lock"
+LRU_TOTAL_FILE_NAME = ".l2p-lru.total"
+PARTIAL_FILE_SUFFIX = ".part"
+
+# Evict down to this fraction of the max size, so that the directory is not
+# walked again on each of the following copies.
+LRU_EVICTION_TARGET = 0.9
+
+DEFAULT_GRIDFS_BUCKET_NAME = "l2p_pdf"
+DEFAULT_GRIDFS_CHUNK_SIZE = 255 * 1024
+
+
+class LocalLRUIndex(object):
+    """
+    A size-bounded least recently used index of the files copied to a local
+    directory, shared by all the processes using the directory: the total
+    size of the files is kept in a file in the directory, which is updated
+    under an exclusive lock. When the total exceeds `max_bytes`, the
+    directory is walked again, and the least recently used files (by access
+    time, which is set explicitly on use) are deleted until the total is at
+    most :data:`LRU_EVICTION_TARGET` of `max_bytes`.
+    """
+
+    def __init__(self, storage, max_bytes):
+        # type: (FileSystemStorage, int) -> None
+        self.storage = storage
+        self.max_bytes = max_bytes
+
+    def get_path(self, name):
+        # type: (Text) -> Text
+        return os.path.join(self.storage.location, name)
+
+    @contextmanager
+    def locked(self):
+        # type: () -> Iterator[None]
+        """
+        Hold the lock of the directory, which excludes other threads as
+        well as other processes.
+        """
+        os.makedirs(self.storage.location, exist_ok=True)
+        with open(self.get_path(LRU_LOCK_FILE_NAME), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def scan(self):
+        # type: () -> List[Tuple[float, Text, int]]
+        """
+        :return: a list of ``(atime, name, size)`` of the files in the
+         directory, least recently used first.
+        """
+        entries = []
+        for root, __, files in os.walk(self.storage.location):
+            for file_name in files:
+                if (file_name in (LRU_LOCK_FILE_NAME, LRU_TOTAL_FILE_NAME)
+                        or file_name.endswith(PARTIAL_FILE_SUFFIX)):
+                    continue
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                name = os.path.relpath(path, self.storage.location)
+                entries.append((stat.st_atime, name.replace(os.sep, "/"),
+                                stat.st_size))
+        return sorted(entries)
+
+    def _read_total(self):
+        # type: () -> int
+        try:
+            with open(self.get_path(LRU_TOTAL_FILE_NAME)) as f:
+                return int(f.read())
+        except (FileNotFoundError, ValueError):
+            total = sum(size for __, __, size in self.scan())
+            self._write_total(total)
+            return total
+
+    def _write_total(self, total):
+        # type: (int) -> None
+        with open(self.get_path(LRU_TOTAL_FILE_NAME), "w") as f:
+            f.write(str(max(total, 0)))
+
+    def _get_size(self, name):
+        # type: (Text) -> int
+        try:
+            return os.stat(self.get_path(name)).st_size
+        except FileNotFoundError:
+            return 0
+
+    @property
+    def total_bytes(self):
+        # type: () -> int
+        with self.locked():
+            return self._read_total()
+
+    def touch(self, name):
+        # type: (Text) -> None
+        path = self.get_path(name)
+        try:
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except FileNotFoundError:
+            pass
+
+    def add(self, name, tmp_path):
+        # type: (Text, Text) -> None
+        """
+        Move the complete file at `tmp_path` (in the directory) to `name`,
+        and evict other files if needed.
+        """
+        with self.locked():
+            total = self._read_total() - self._get_size(name)
+            os.replace(tmp_path, self.get_path(name))
+            self.touch(name)
+            total += self._get_size(name)
+
+            if total > self.max_bytes:
+                total = self._evict(keep=name)
+            self._write_total(total)
+
+    def remove(self, name):
+        # type: (Text) -> None
+        with self.locked():
+            size = self._get_size(name)
+            self.storage.delete(name)
+            self._write_total(self._read_total() - size)
+
+    def _evict(self, keep=None):
+        # type: (Optional[Text]) -> int
+        """
+        Must be called with the lock held.
+
+        :return: the total size after eviction.
+        """
+        entries = self.scan()
+        total = sum(size for __, __, size in entries)
+        target = int(self.max_bytes * LRU_EVICTION_TARGET)
+        for __, name, size in entries:
+            if total <= target:
+                break
+            if name == keep:
+                continue
+            # Open files are still readable after being unlinked
+            self.storage.delete(name)
+            total -= size
+        return total
+
+
+@deconstructible
+class TieredStorage(Storage):
+    """
+    A storage which writes through to a remote storage (S3 by default, see
+    L2P_TIERED_STORAGE_REMOTE), and keeps local copies of the recently used
+    files, at most L2P_TIERED_STORAGE_LOCAL_MAX_BYTES bytes in total under
+    L2P_TIERED_STORAGE_LOCAL_ROOT. Reads are served from the local copies
+    when possible.
+    """
+
+    def __init__(self, remote=None, local_location=None, max_bytes=None):
+        # type: (Any, Optional[Text], Optional[int]) -> None
+        self._remote = remote
+        self._local_location = local_location
+        self._max_bytes = max_bytes
+        self._local_index = None  # type: Optional[LocalLRUIndex]
+        self._lock = threading.Lock()
+
+    @property
+    def remote(self):
+        # Created lazily, like the default storage, so that the settings are
+        # only needed when the storage is used.
+        if self._remote is None:
+            remote_class = import_string(getattr(
+                settings, "L2P_TIERED_STORAGE_REMOTE",
+                DEFAULT_TIERED_STORAGE_REMOTE))
+            self._remote = remote_class()
+        return self._remote
+
+    @property
+    def local_index(self):
+        # type: () -> LocalLRUIndex
+        with self._lock:
+            if self._local_index is None:
+                location = self._local_location
+                if location is None:
+                    location = getattr(
+                        settings, "L2P_TIERED_STORAGE_LOCAL_ROOT",
+                        os.path.join(settings.MEDIA_ROOT, "l2p_local_cache"))
+                max_bytes = self._max_bytes
+                if max_bytes is None:
+                    max_bytes = getattr(
+                        settings, "L2P_TIERED_STORAGE_LOCAL_MAX_BYTES",
+                        DEFAULT_TIERED_STORAGE_LOCAL_MAX_BYTES)
+                self._local_index = LocalLRUIndex(
+                    FileSystemStorage(location=location), max_bytes)
+            return self._local_index
+
+    @property
+    def local(self):
+        # type: () -> FileSystemStorage
+        return self.local_index.storage
+
+    def store_local_copy(self, name, content):
+        # type: (Text, Any) -> None
+        """
+        Copy `content` to the local tier, atomically, so that concurrent
+        readers never see partial files.
+        """
+        path = self.local.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(
+            dir=directory, suffix=PARTIAL_FILE_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if hasattr(content, "chunks"):
+                    for chunk in content.chunks():
+                        f.write(chunk)
+                else:
+                    shutil.copyfileobj(content, f)
+            self.local_index.add(name, tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open_local_copy(self, name, mode):
+        # type: (Text, Text) -> Any
+        try:
+            f = self.local.open(name, mode)
+        except FileNotFoundError:
+            return None
+        self.local_index.touch(name)
+        return f
+
+    def _open(self, name, mode="rb"):
+        f = self.open_local_copy(name, mode)
+        if f is not None:
+            return f
+
+        remote_file = self.remote.open(name, "rb")
+        if remote_file.size > self.local_index.max_bytes:
+            # Never fits, stream it from the remote storage
+            return remote_file
+
+        with remote_file:
+            self.store_local_copy(name, remote_file)
+
+        f = self.open_local_copy(name, mode)
+        if f is None:
+            # Evicted by another process just now
+            return self.remote.open(name, mode)
+        return f
+
+    def _save(self, name, content):
+        name = self.remote.save(name, content)
+
+        if content.size is not None and content.size <= self.local_index.max_bytes:
+            content.seek(0)
+            self.store_local_copy(name, content)
+        return name
+
+    def delete(self, name):
+        self.remote.delete(name)
+        self.local_index.remove(name)
+
+    def delete_many(self, names):
+        # type: (List[Text]) -> None
+        from latex.cleanup import delete_storage_files
+        delete_storage_files(self.remote, names)
+        for name in names:
+            self.local_index.remove(name)
+
+    def iter_files(self, path):
+        # type: (Text) -> Iterator
+        # The remote storage is authoritative
+        from latex.cleanup import iter_storage_files
+        return iter_storage_files(self.remote, path)
+
+    def exists(self, name):
+        # The remote storage is authoritative, a local copy may be left
+        # after the remote file is deleted by others
+        return self.remote.exists(name)
+
+    def get_available_name(self, name, max_length=None):
+        return self.remote.get_available_name(name, max_length=max_length)
+
+    def listdir(self, path):
+        return self.remote.listdir(path)
+
+    def size(self, name):
+        try:
+            return self.local.size(name)
+        except FileNotFoundError:
+            return self.remote.size(name)
+
+    def url(self, name):
+        return self.remote.url(name)
+
+    def get_accessed_time(self, name):
+        return self.remote.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.remote.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.remote.get_modified_time(name)
+
+
+class GridFSFile(File):
+    """
+    A read only file streamed from GridFS chunk by chunk, which supports
+    ``seek`` (for range requests).
+    """
+
+    def __init__(self, grid_out, name):
+        super().__init__(grid_out, name)
+        self.size = grid_out.length
+
+    def open(self, mode=None):
+        self.seek(0)
+        return self
+
+    @property
+    def closed(self):
+        return self.file is None or getattr(self.file, "closed", False)
+
+
+@deconstructible
+class GridFSStorage(Storage):
+    """
+    A storage which keeps files in a GridFS bucket (L2P_GRIDFS_BUCKET_NAME)
+    of the MongoDB database (L2P_GRIDFS_DATABASE, default to the one of the
+    default database), through the pooled client of the process, so that
+    any node can serve any file without a shared file system.
+
+    GridFS keeps revisions of a file name, and the latest one is read.
+    Files have no url, so they are always streamed by the pdf download view,
+    even if L2P_PDF_REDIRECT_TO_STORAGE_URL is set.
+    """
+
+    def __init__(self, database=None, bucket_name=None, chunk_size=None,
+                 client=None):
+        self._database = database
+        self._bucket_name = bucket_name
+        self._chunk_size = chunk_size
+        self._client = client
+        self._bucket = None
+
+    @property
+    def bucket_name(self):
+        # type: () -> Text
+        return self._bucket_name or getattr(
+            settings, "L2P_GRIDFS_BUCKET_NAME", DEFAULT_GRIDFS_BUCKET_NAME)
+
+    @property
+    def db(self):
+        client = self._client
+        if client is None:
+            from latex.repository import get_mongo_client
+            client = get_mongo_client()
+        database = self._database or getattr(
+            settings, "L2P_GRIDFS_DATABASE",
+            settings.DATABASES[DEFAULT_DB_ALIAS]["NAME"])
+        return client[database]
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            import gridfs
+            self._bucket = gridfs.GridFSBucket(
+                self.db, bucket_name=self.bucket_name,
+                chunk_size_bytes=self._chunk_size or getattr(
+                    settings, "L2P_GRIDFS_CHUNK_SIZE",
+                    DEFAULT_GRIDFS_CHUNK_SIZE))
+        return self._bucket
+
+    @property
+    def files(self):
+        return self.db["%s.files" % self.bucket_name]
+
+    @property
+    def chunks(self):
+        return self.db["%s.chunks" % self.bucket_name]
+
+    def get_file_document(self, name):
+        # The (filename, uploadDate) index is created by GridFSBucket
+        return self.files.find_one(
+            {"filename": name}, sort=[("uploadDate", -1)])
+
+    def _open(self, name, mode="rb"):
+        if "w" in mode or "a" in mode or "+" in mode:
+            raise ValueError("GridFS files can only be opened for reading")
+
+        import gridfs
+        try:
+            grid_out = self.bucket.open_download_stream_by_name(name)
+        except gridfs.NoFile:
+            raise FileNotFoundError(name)
+        return GridFSFile(grid_out, name)
+
+    def _save(self, name, content):
+        content.seek(0)
+        # Read and written chunk by chunk
+        self.bucket.upload_from_stream(name, content)
+        return name
+
+    def delete(self, name):
+        self.delete_many([name])
+
+    def delete_many(self, names):
+        # type: (List[Text]) -> None
+        file_ids = [
+            document["_id"] for document in self.files.find(
+                {"filename": {"$in": list(names)}}, projection=["_id"])]
+        if not file_ids:
+            return
+
+        # Deleting the file documents first makes partially deleted files
+        # invisible.
+        self.files.delete_many({"_id": {"$in": file_ids}})
+        self.chunks.delete_many({"files_id": {"$in": file_ids}})
+
+    def exists(self, name):
+        return self.files.find_one(
+            {"filename": name}, projection=["_id"]) is not None
+
+    def iter_files(self, path):
+        # type: (Text) -> Iterator
+        from latex.cleanup import StorageFile
+
+        prefix = path.rstrip("/") + "/"
+        cursor = self.files.find(
+            {"filename": {"$regex": "^" + re.escape(prefix)}},
+            projection=["filename", "length", "uploadDate"],
+            sort=[("filename", 1), ("uploadDate", -1)])
+
+        last_name = None
+        for document in cursor:
+            if document["filename"] == last_name:
+                # An older revision
+                continue
+            last_name = document["filename"]
+            yield StorageFile(
+                last_name, document["length"],
+                self.convert_datetime(document["uploadDate"]))
+
+    def listdir(self, path):
+        prefix = path.rstrip("/") + "/" if path else ""
+        names = self.files.distinct(
+            "filename", {"filename": {"$regex": "^" + re.escape(prefix)}})
+
+        dirs, files = set(), set()
+        for name in names:
+            head, sep, __ = name[len(prefix):].partition("/")
+            (dirs if sep else files).add(head)
+        return sorted(dirs), sorted(files)
+
+    def size(self, name):
+        document = self.get_file_document(name)
+        if document is None:
+            raise FileNotFoundError(name)
+        return document["length"]
+
+    def url(self, name):
+        # Nothing serves GridFS files by name. They are streamed (after the
+        # permission checks) by the pdf download view, see
+        # LatexPdf.get_absolute_url.
+        raise NotImplementedError(
+            "GridFS files have no url, they are served by the pdf download "
+            "view")
+
+    def convert_datetime(self, value):
+        # Stored as naive utc datetimes
+        if settings.USE_TZ and is_naive(value):
+            return make_aware(value, utc)
+        return value
+
+    def get_modified_time(self, name):
+        document = self.get_file_document(name)
+        if document is None:
+            raise FileNotFoundError(name)
+        return self.convert_datetime(document["uploadDate"])
+
+    get_created_time = get_modified_time
@@ -25,6 +25,7 @@ THE SOFTWARE.
 """
 
 import os
+import time
 from subprocess import Popen, PIPE
 
 from codemirror import CodeMirrorTextarea, CodeMirrorJavascript
@@ -55,6 +56,22 @@ ALLOWED_COMPILER_FORMAT_COMBINATION = (
 # }}}
 
 
+def throttled(iterable, interval):
+    # type: (Any, float) -> Any
+    """
+    Yield the items of `iterable`, starting at most one every `interval`
+    seconds (e.g., batches of a management command), so as to rate limit
+    the load on the database and the cache.
+    """
+    next_start = time.monotonic()
+    for item in iterable:
+        now = time.monotonic()
+        if now < next_start:
+            time.sleep(next_start - now)
+        next_start = max(now, next_start) + interval
+        yield item
+
+
 def string_concat(*strings):
     # type: (Any) -> Text
     return format_lazy("{}" * len(strings), *strings)
@@ -141,6 +158,18 @@ def get_all_indirect_subclasses(cls):
     return list(set(all_subcls))
 
 
+def is_process_local_cache(def_cache):
+    # type: (Any) -> bool
+    """
+    Whether `def_cache` is not shared by the processes of the server (e.g.,
+    gunicorn workers), so that entries set or deleted in one process are not
+    seen by the others.
+    """
+    from django.core.cache.backends.dummy import DummyCache
+    from django.core.cache.backends.locmem import LocMemCache
+    return isinstance(def_cache, (DummyCache, LocMemCache))
+
+
 class CriticalCheckMessage(Critical):
     def __init__(self, *args, **kwargs):
         # type: (*Any, **Any) -> None
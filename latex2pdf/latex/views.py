@@ -22,34 +22,43 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
-import shutil
-import tempfile
 import sys
 import zipfile
-import io
 import hashlib
+import re
+from urllib.parse import quote
 
 from crispy_forms.layout import Submit
 from django import forms
 from django.contrib.auth.decorators import login_required
-from django.db.transaction import atomic
 from django.utils.translation import ugettext as _
 from django.shortcuts import render, get_object_or_404
 from django.core.exceptions import PermissionDenied
-from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.views.generic import ListView, CreateView, DeleteView, DetailView
 from django.views.generic.edit import ModelFormMixin
-from django.http import Http404
+from django.conf import settings
+from django.http import (
+    Http404, FileResponse, HttpResponse, HttpResponseRedirect,
+    StreamingHttpResponse)
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django.urls import reverse, reverse_lazy
 from rest_framework import status
 
 from latex.converter import (
     unzipped_folder_to_pdf_converter,
+    post_process_pdf,
     LatexCompileError,
     LATEXMKRC
 )
 from latex.models import LatexProject, LatexCollection, LatexPdf
+from latex.persistence import CompiledPdf, save_compile_result
+from latex.repository import get_repository
+from latex.routers import use_primary_db
 from latex.utils import StyledFormMixin, get_codemirror_widget
+from latex.workspace import (
+    TooManyCompiles, WorkspaceBudgetExceeded, compile_slot,
+    estimate_zip_workspace_bytes, get_workspace_manager)
 
 
 UPLOAD_FILE_MAX_BYTES = 64 * 1024 ** 2
@@ -59,15 +68,24 @@ class ProjectListView(ListView):
     model = LatexProject
     template_name = "latex/project_list.html"
 
+    def get_paginate_by(self, queryset):
+        return getattr(settings, "L2P_PROJECT_LIST_PAGE_SIZE", 50)
+
     def get_queryset(self):
         owner = self.request.user
-        return self.model.objects.filter(creator=owner)
+
+        # Revision info are denormalized on projects
+        return (self.model.objects.filter(creator=owner)
+                .select_related("latest_collection")
+                .order_by("identifier"))
 
 
 class ProjectCreateForm(StyledFormMixin, forms.ModelForm):
     class Meta:
         model = LatexProject
-        fields = ["identifier", "name", "description", "is_private"]
+        fields = [
+            "identifier", "name", "description", "is_private",
+            "keep_revisions", "keep_days"]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -181,28 +199,27 @@ def view_collection(request, project_identifier, zip_file_hash=None):
 
     is_viewing_old_version = zip_file_hash is not None
 
-    project = get_object_or_404(LatexProject, identifier=project_identifier)
+    if zip_file_hash is None:
+        project = get_object_or_404(
+            LatexProject, identifier=project_identifier)
+        collection = get_repository().get_latest_collection(project)
+    else:
+        collection = get_object_or_404(
+            LatexCollection.objects.select_related("project"),
+            project__identifier=project_identifier,
+            zip_file_hash=zip_file_hash)
+        project = collection.project
 
-    if project.is_private and request.user != project.creator:
+    if project.is_private and request.user.pk != project.creator_id:
         raise PermissionDenied("Not allow to view project")
 
-    collections = LatexCollection.objects.filter(project=project)
     pdf_instances = None
 
-    collection = None
-
-    if collections.count():
-        if zip_file_hash is not None:
-            collections = collections.filter(zip_file_hash=zip_file_hash)
-            if collections.count():
-                collection = collections[0]
-            else:
-                raise Http404()
-        else:
-            collection = collections.order_by("-creation_time")[0]
-
     if collection:
-        pdf_instances = LatexPdf.objects.filter(project=project, collection=collection)
+        collection.project = project
+
+        # pdf.collection is set to the collection without extra queries
+        pdf_instances = get_repository().get_pdfs(collection)
 
     ctx = {"collection": collection,
            "pdfs": pdf_instances,
@@ -229,12 +246,52 @@ def get_pdf_mediabox(filepath):
     return list(page.MediaBox)
 
 
+def compile_collection(project, zip_file_hash, working_dir, compiler):
+    """
+    Compile the sources unzipped in `working_dir`, and save the result.
+
+    :return: a tuple of the saved collection and its pdfs (None if the
+        compile failed).
+    """
+    try:
+        compiled_pdf_dict = unzipped_folder_to_pdf_converter(
+            working_dir, compiler=compiler)
+    except LatexCompileError:
+        tp, err, __ = sys.exc_info()
+        error_str = "%s: %s" % (tp.__name__, str(err))
+        return save_compile_result(
+            project, zip_file_hash, compile_error=error_str), None
+
+    compiled_pdfs = []
+    for (filename, filepath) in compiled_pdf_dict.items():
+        original_size, size = post_process_pdf(
+            filepath,
+            optimize=getattr(settings, "L2P_OPTIMIZE_PDF", True),
+            linearize=getattr(settings, "L2P_LINEARIZE_PDF", True))
+
+        compiled_pdfs.append(CompiledPdf(
+            name=filename,
+            path=filepath,
+            mediabox=get_pdf_mediabox(filepath),
+            size=size,
+            original_size=original_size,
+        ))
+
+    collection = save_compile_result(project, zip_file_hash, compiled_pdfs)
+    pdf_instances = LatexPdf.objects.filter(
+        project=project, collection=collection
+    ).select_related("collection")
+    return collection, pdf_instances
+
+
 @login_required(login_url='/login/')
+@use_primary_db
 def compile_project(request, project_identifier):
     pdf_instances = None
     collection = None
     ctx = {}
     unknown_error = None
+    error_status = status.HTTP_500_INTERNAL_SERVER_ERROR
     if request.method == "POST":
         form = CollectionCreateForm(request.POST, request.FILES)
         if form.is_valid():
@@ -247,65 +304,36 @@ def compile_project(request, project_identifier):
             project, created = LatexProject.objects.get_or_create(
                 identifier=project_identifier, creator=request.user)
 
-            collection_qset = LatexCollection.objects.filter(
-                project=project, zip_file_hash=zip_file_hash)
-
-            collection = None
             pdf_instances = None
 
-            if collection_qset.count():
-                assert collection_qset.count() == 1
-                collection = collection_qset[0]
-                pdf_instances = LatexPdf.objects.filter(project=project, collection=collection)
+            collection = get_repository().get_collection(
+                project.pk, zip_file_hash)
+            if collection is not None:
+                pdf_instances = get_repository().get_pdfs(collection)
 
             if collection is None:
                 collection = LatexCollection(project=project, zip_file_hash=zip_file_hash)
-                working_dir = tempfile.mkdtemp()
-                print(working_dir)
-                with zipfile.ZipFile(form_zip_file, "r") as zf:
-                    zf.extractall(working_dir)
-
                 try:
-                    compiled_pdf_dict = unzipped_folder_to_pdf_converter(working_dir, compiler=compiler)
-                except Exception as e:
+                    # The slot is taken before the workspace, so that
+                    # waiting compiles don't hold scratch space
+                    with compile_slot(), \
+                            zipfile.ZipFile(form_zip_file, "r") as zf:
+                        workspace = get_workspace_manager().workspace(
+                            estimate_zip_workspace_bytes(zf))
+                        with workspace as working_dir:
+                            zf.extractall(working_dir)
+                            collection, pdf_instances = compile_collection(
+                                project, zip_file_hash, working_dir, compiler)
+                except (WorkspaceBudgetExceeded, TooManyCompiles) as e:
+                    unknown_error = ctx["unknown_error"] = str(e)
+                    error_status = status.HTTP_503_SERVICE_UNAVAILABLE
+                except Exception:
                     from traceback import print_exc
                     print_exc()
 
                     tp, err, __ = sys.exc_info()
-                    error_str = "%s: %s" % (tp.__name__, str(err))
-                    if isinstance(e, LatexCompileError):
-                        collection.compile_error = error_str
-                        with atomic():
-                            collection.save()
-                    else:
-                        unknown_error = ctx["unknown_error"] = error_str
-                else:
-                    with atomic():
-                        collection.save()
-                    for (filename, filepath) in compiled_pdf_dict.items():
-                        with open(filepath, "rb") as f:
-                            buff = io.BytesIO(f.read())
-
-                        pdf = InMemoryUploadedFile(
-                            file=buff, field_name='file', name=filename,
-                            content_type="application/pdf", size=buff.tell(), charset=None)
-
-                        mediabox = get_pdf_mediabox(filepath)
-                        print(mediabox)
-
-                        pdf = LatexPdf(
-                            project=project,
-                            collection=collection,
-                            name=filename,
-                            pdf=pdf,
-                            mediabox=mediabox
-                        )
-                        with atomic():
-                            pdf.save()
-                    pdf_instances = LatexPdf.objects.filter(
-                        project=project, collection=collection)
-                finally:
-                    shutil.rmtree(working_dir)
+                    unknown_error = ctx["unknown_error"] = (
+                        "%s: %s" % (tp.__name__, str(err)))
 
     else:
         form = CollectionCreateForm()
@@ -328,6 +356,190 @@ def compile_project(request, project_identifier):
             render_kwargs["status"] = status.HTTP_400_BAD_REQUEST
 
     if unknown_error:
-        render_kwargs["status"] = status.HTTP_500_INTERNAL_SERVER_ERROR
+        render_kwargs["status"] = error_status
 
     return render(**render_kwargs)
+
+
+PDF_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Only the content (or the confirmation that the cached content is still
+# valid) is cached as immutable, e.g., not a 416 or a temporary redirect.
+PDF_CACHEABLE_STATUS_CODES = (200, 206, 304)
+PDF_REDIRECT_STATUS_CODES = (301, 302, 303, 307, 308)
+
+
+def get_pdf_etag(pdf):
+    # A compiled pdf never changes for a given collection hash
+    return quote_etag("%s-%d" % (pdf.collection.zip_file_hash, pdf.pk))
+
+
+BYTE_RANGE_REGEX = re.compile(r"^\s*bytes=(\d*)-(\d*)\s*$")
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def get_byte_range(range_header, size):
+    """
+    Parse a ``Range`` header of a file with `size` bytes. Only a single byte
+    range is supported.
+
+    :return: a tuple of (start, end) (both inclusive), or None if the whole
+     content should be served (no range, or the range is not supported).
+    :raise: :class:`RangeNotSatisfiable` if the range is not satisfiable.
+    """
+    if not range_header:
+        return None
+
+    match = BYTE_RANGE_REGEX.match(range_header)
+    if match is None:
+        # e.g., multiple ranges, which are allowed to be ignored
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+
+    if not start:
+        # suffix range, i.e., the last n bytes
+        length = int(end)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def iter_file_range(file, start, length, chunk_size=64 * 1024):
+    try:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def get_pdf_file_response(request, pdf, etag):
+    """
+    Stream the pdf with Django, supporting a single byte range (so that
+    pdf.js can fetch only the part needed for the first page) and
+    ``If-Range``.
+    """
+    try:
+        pdf_file = pdf.pdf.open("rb")
+    except OSError:
+        raise Http404()
+
+    size = pdf.pdf.size
+
+    byte_range = None
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = get_byte_range(request.META.get("HTTP_RANGE"), size)
+        except RangeNotSatisfiable:
+            pdf_file.close()
+            response = HttpResponse(
+                status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response["Content-Range"] = "bytes */%d" % size
+            return response
+
+    if byte_range is None:
+        response = FileResponse(pdf_file, content_type="application/pdf")
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            iter_file_range(pdf_file, start, end - start + 1),
+            status=status.HTTP_206_PARTIAL_CONTENT,
+            content_type="application/pdf")
+        response["Content-Length"] = str(end - start + 1)
+        response["Content-Range"] = "bytes %d-%d/%d" % (start, end, size)
+
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def get_pdf_delivery_response(request, pdf, etag):
+    """
+    Return the response which actually transfers the content of `pdf`.
+    If possible, the transfer is offloaded to nginx (via X-Accel-Redirect,
+    where nginx also takes care of range requests) or to the storage (via a
+    redirect to the storage url, e.g., a signed and expiring S3 url), so
+    that Python workers are not occupied.
+    """
+    x_accel_prefix = getattr(settings, "L2P_PDF_X_ACCEL_REDIRECT_PREFIX", None)
+    if x_accel_prefix:
+        try:
+            # Only available for local file system storages
+            pdf.pdf.path
+        except NotImplementedError:
+            pass
+        else:
+            response = HttpResponse(content_type="application/pdf")
+            response["X-Accel-Redirect"] = (
+                x_accel_prefix.rstrip("/") + "/" + quote(pdf.pdf.name))
+            return response
+
+    if getattr(settings, "L2P_PDF_REDIRECT_TO_STORAGE_URL", False):
+        try:
+            url = pdf.pdf.url
+        except NotImplementedError:
+            # e.g., GridFS, which has no url to redirect to
+            pass
+        else:
+            return HttpResponseRedirect(url)
+
+    return get_pdf_file_response(request, pdf, etag)
+
+
+def serve_pdf(request, zip_file_hash, pdf_id, filename):
+    """
+    Serve a compiled pdf via a content-hash-addressed url (see
+    :meth:`LatexPdf.get_absolute_url`), which is cached by browsers and
+    proxies as immutable.
+    """
+    pdf = get_object_or_404(
+        LatexPdf.objects.select_related("project", "collection"),
+        pk=pdf_id, collection__zip_file_hash=zip_file_hash)
+
+    if filename != pdf.get_filename() or not pdf.pdf:
+        raise Http404()
+
+    project = pdf.project
+    if project.is_private and request.user.pk != project.creator_id:
+        raise PermissionDenied("Not allow to view project")
+
+    etag = get_pdf_etag(pdf)
+    last_modified = int(pdf.collection.creation_time.timestamp())
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        response = get_pdf_delivery_response(request, pdf, etag)
+
+    if response.status_code in PDF_CACHEABLE_STATUS_CODES:
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        patch_cache_control(
+            response, max_age=PDF_CACHE_MAX_AGE, immutable=True,
+            **{"private" if project.is_private else "public": True})
+    elif response.status_code in PDF_REDIRECT_STATUS_CODES:
+        # The storage url (e.g., a signed S3 url) expires, so the redirect
+        # must not be cached longer than it is valid.
+        max_age = getattr(settings, "L2P_PDF_REDIRECT_MAX_AGE", 60)
+        if max_age > 0:
+            patch_cache_control(response, private=True, max_age=max_age)
+        else:
+            patch_cache_control(response, no_store=True)
+    return response
@@ -0,0 +1,438 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from queue import Queue, Empty
+
+from django.conf import settings
+
+from typing import Any, Dict, Iterator, Optional, Text, Tuple  # noqa
+
+WORKSPACE_PREFIX = "l2p-"
+TRASH_PREFIX = ".trash-"
+
+# The estimated size of a workspace is this times the size of the unzipped
+# sources, to leave room for the compiled files.
+WORKSPACE_SIZE_FACTOR = 2
+
+# The tmpfs root is off unless configured: budgets are per process, and
+# /dev/shm of Docker containers is only 64 MiB unless --shm-size is given,
+# which the workspaces of a few workers would exhaust.
+DEFAULT_TMPFS_MAX_BYTES = 16 * 1024 ** 2
+DEFAULT_TMPFS_BUDGET_BYTES = 32 * 1024 ** 2
+DEFAULT_DISK_BUDGET_BYTES = 10 * 1024 ** 3
+
+
+DEFAULT_MAX_CONCURRENT_COMPILES = 1
+DEFAULT_COMPILE_WAIT_SECONDS = 60
+
+
+class WorkspaceBudgetExceeded(RuntimeError):
+    pass
+
+
+class TooManyCompiles(RuntimeError):
+    pass
+
+
+def estimate_zip_workspace_bytes(zip_file):
+    # type: (Any) -> int
+    """
+    :arg zip_file: a :class:`zipfile.ZipFile`.
+    """
+    return WORKSPACE_SIZE_FACTOR * sum(
+        info.file_size for info in zip_file.infolist())
+
+
+def is_pid_alive(pid):
+    # type: (int) -> bool
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Exists, but owned by another user
+        return True
+    return True
+
+
+def get_process_start_time(pid):
+    # type: (int) -> Optional[Text]
+    """
+    The start time of the process `pid` (in clock ticks after boot), which
+    identifies the process together with its pid, since pids are reused,
+    e.g., after the container is restarted. None if not available (e.g., no
+    such process, or no /proc).
+    """
+    try:
+        with open("/proc/%d/stat" % pid) as f:
+            stat = f.read()
+    except OSError:
+        return None
+
+    # The command name (the 2nd field) may contain spaces and parentheses,
+    # the start time is the 22nd field.
+    try:
+        return stat.rsplit(")", 1)[1].split()[19]
+    except IndexError:
+        return None
+
+
+def get_workspace_owner():
+    # type: () -> Text
+    """
+    The owner part of the names of the workspaces of the current process,
+    i.e., its pid and, if available, its start time, see
+    :func:`is_workspace_owner_alive`.
+    """
+    pid = os.getpid()
+    start_time = get_process_start_time(pid)
+    if start_time is None:
+        return str(pid)
+    return "%d.%s" % (pid, start_time)
+
+
+def is_workspace_owner_alive(owner):
+    # type: (Text) -> Optional[bool]
+    """
+    Whether the process which created workspaces with the `owner` part of
+    their names (see :func:`get_workspace_owner`) is still running, i.e., a
+    process with that pid exists and, if the start time was recorded, it
+    started at that time (otherwise the pid was reused).
+
+    :return: None if `owner` is not a valid owner.
+    """
+    pid, __, start_time = owner.partition(".")
+    if not pid.isdigit():
+        return None
+
+    if not is_pid_alive(int(pid)):
+        return False
+
+    if start_time:
+        current_start_time = get_process_start_time(int(pid))
+        if current_start_time is not None:
+            return current_start_time == start_time
+
+    return True
+
+
+class DeferredDeleter(object):
+    """
+    Delete directories in a daemon thread, which is started on the first
+    :meth:`put` (and restarted in forked processes).
+    """
+
+    def __init__(self):
+        self.queue = Queue()  # type: Queue
+        self._lock = threading.Lock()
+        self._thread = None  # type: Optional[threading.Thread]
+        self._pid = None  # type: Optional[int]
+
+    def put(self, path, callback=None):
+        self.ensure_worker()
+        self.queue.put((path, callback))
+
+    def ensure_worker(self):
+        # type: () -> None
+        with self._lock:
+            if (self._thread is not None
+                    and self._pid == os.getpid()
+                    and self._thread.is_alive()):
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self.run, name="l2p-workspace-cleanup", daemon=True)
+            self._thread.start()
+
+    def delete(self, path, callback):
+        try:
+            shutil.rmtree(path, ignore_errors=True)
+        finally:
+            if callback is not None:
+                callback()
+            self.queue.task_done()
+
+    def run(self):
+        # type: () -> None
+        while True:
+            self.delete(*self.queue.get())
+
+    def flush(self):
+        # type: () -> None
+        """
+        Delete the pending directories in the calling thread.
+        """
+        while True:
+            try:
+                item = self.queue.get(block=False)
+            except Empty:
+                return
+            self.delete(*item)
+
+    def join(self):
+        # type: () -> None
+        self.queue.join()
+
+
+class WorkspaceManager(object):
+    """
+    Manage the scratch directories (workspaces) of compiles.
+
+    A workspace is created in the tmpfs root if its estimated size is at
+    most L2P_WORKSPACE_TMPFS_MAX_BYTES and it fits the budget of the tmpfs
+    root, otherwise in the disk root. Roots have budgets of disk usage,
+    which count the estimated sizes of the workspaces in use and of those
+    not deleted yet.
+
+    Budgets are per process, so the budget of a root shared by the workers
+    should be its size divided by the number of workers. To also account
+    for other processes, a root only fits a workspace if its free space
+    minus the outstanding reservations of this process is large enough.
+
+    Workspaces are renamed when released and deleted in the background, so
+    that compiles don't wait for the deletion of many small files. The
+    workspaces left by crashed processes are deleted by
+    :meth:`cleanup_stale_workspaces` (see the ``cleanup_workspaces``
+    management command, which is run before the server is started).
+    """
+
+    def __init__(self, tmpfs_root=None, disk_root=None, tmpfs_max_bytes=None,
+                 tmpfs_budget_bytes=None, disk_budget_bytes=None):
+        self.tmpfs_root = tmpfs_root
+        self.disk_root = disk_root
+        self.tmpfs_max_bytes = tmpfs_max_bytes
+        self.budgets = {
+            tmpfs_root: tmpfs_budget_bytes,
+            disk_root: disk_budget_bytes,
+        }  # type: Dict[Optional[Text], int]
+        self.usage = {}  # type: Dict[Text, int]
+        self.deleter = DeferredDeleter()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        # type: () -> WorkspaceManager
+        tmpfs_root = getattr(settings, "L2P_WORKSPACE_TMPFS_ROOT", None)
+        disk_root = getattr(
+            settings, "L2P_WORKSPACE_DISK_ROOT",
+            os.path.join(tempfile.gettempdir(), "l2p_workspaces"))
+
+        return cls(
+            tmpfs_root=tmpfs_root,
+            disk_root=disk_root,
+            tmpfs_max_bytes=getattr(
+                settings, "L2P_WORKSPACE_TMPFS_MAX_BYTES",
+                DEFAULT_TMPFS_MAX_BYTES),
+            tmpfs_budget_bytes=getattr(
+                settings, "L2P_WORKSPACE_TMPFS_BUDGET_BYTES",
+                DEFAULT_TMPFS_BUDGET_BYTES),
+            disk_budget_bytes=getattr(
+                settings, "L2P_WORKSPACE_DISK_BUDGET_BYTES",
+                DEFAULT_DISK_BUDGET_BYTES))
+
+    @property
+    def roots(self):
+        return [root for root in (self.tmpfs_root, self.disk_root) if root]
+
+    def fits(self, root, n_bytes):
+        # type: (Text, int) -> bool
+        reserved = self.usage.get(root, 0)
+        if reserved + n_bytes > self.budgets[root]:
+            return False
+
+        os.makedirs(root, mode=0o700, exist_ok=True)
+
+        # The reserved workspaces may not have been filled yet
+        return shutil.disk_usage(root).free - reserved >= n_bytes
+
+    def reserve(self, n_bytes):
+        # type: (int) -> Text
+        """
+        Reserve `n_bytes` in a root, and return the root.
+        """
+        candidates = [self.disk_root]
+        if self.tmpfs_root and n_bytes <= self.tmpfs_max_bytes:
+            candidates.insert(0, self.tmpfs_root)
+
+        for attempt in range(2):
+            with self._lock:
+                for root in candidates:
+                    if self.fits(root, n_bytes):
+                        self.usage[root] = self.usage.get(root, 0) + n_bytes
+                        return root
+
+            # Reclaim the space of the workspaces pending deletion
+            self.deleter.flush()
+
+        raise WorkspaceBudgetExceeded(
+            "No scratch space left for a workspace of %d bytes" % n_bytes)
+
+    def release(self, root, n_bytes):
+        # type: (Text, int) -> None
+        with self._lock:
+            self.usage[root] = max(self.usage.get(root, 0) - n_bytes, 0)
+
+    def delete_later(self, root, path, n_bytes=0):
+        # type: (Text, Text, int) -> None
+        trash_path = os.path.join(
+            root, TRASH_PREFIX + os.path.basename(path))
+        try:
+            # Fast, and marks the workspace as unused in case of a crash
+            os.rename(path, trash_path)
+        except OSError:
+            trash_path = path
+        self.deleter.put(
+            trash_path, callback=lambda: self.release(root, n_bytes))
+
+    @contextmanager
+    def workspace(self, estimated_bytes=0):
+        # type: (int) -> Iterator[Text]
+        """
+        A context manager which creates a workspace of `estimated_bytes`,
+        and deletes it in the background on exit.
+        """
+        root = self.reserve(estimated_bytes)
+        try:
+            path = tempfile.mkdtemp(
+                prefix="%s%s-" % (WORKSPACE_PREFIX, get_workspace_owner()),
+                dir=root)
+        except Exception:
+            self.release(root, estimated_bytes)
+            raise
+
+        try:
+            yield path
+        finally:
+            self.delete_later(root, path, estimated_bytes)
+
+    def cleanup_stale_workspaces(self):
+        # type: () -> int
+        """
+        Delete (in the background) the workspaces of processes which no
+        longer exist (see :func:`is_workspace_owner_alive`), and the
+        leftovers of interrupted deletions.
+
+        :return: the number of workspaces deleted.
+        """
+        n_stale = 0
+        for root in self.roots:
+            try:
+                names = os.listdir(root)
+            except FileNotFoundError:
+                continue
+
+            for name in names:
+                path = os.path.join(root, name)
+                if name.startswith(TRASH_PREFIX):
+                    self.deleter.put(path)
+                    n_stale += 1
+                    continue
+
+                if not name.startswith(WORKSPACE_PREFIX):
+                    continue
+
+                owner = name[len(WORKSPACE_PREFIX):].split("-", 1)[0]
+                if is_workspace_owner_alive(owner) is False:
+                    self.delete_later(root, path)
+                    n_stale += 1
+
+        return n_stale
+
+
+_workspace_manager = None  # type: Optional[WorkspaceManager]
+_workspace_manager_lock = threading.Lock()
+
+
+def get_workspace_manager():
+    # type: () -> WorkspaceManager
+    global _workspace_manager
+
+    if _workspace_manager is None:
+        with _workspace_manager_lock:
+            if _workspace_manager is None:
+                _workspace_manager = WorkspaceManager.from_settings()
+                # Don't leave workspaces behind on graceful shutdown
+                atexit.register(_workspace_manager.deleter.flush)
+
+    return _workspace_manager
+
+
+_compile_semaphore = None  # type: Optional[Tuple[int, threading.BoundedSemaphore]]  # noqa
+_compile_semaphore_lock = threading.Lock()
+
+
+def get_compile_semaphore():
+    # type: () -> Optional[threading.BoundedSemaphore]
+    """
+    The semaphore limiting the compiles running at once in this process to
+    L2P_MAX_CONCURRENT_COMPILES, or None if that is 0 (no limit).
+    """
+    global _compile_semaphore
+
+    max_compiles = getattr(
+        settings, "L2P_MAX_CONCURRENT_COMPILES",
+        DEFAULT_MAX_CONCURRENT_COMPILES)
+    if not max_compiles:
+        return None
+
+    with _compile_semaphore_lock:
+        if _compile_semaphore is None or _compile_semaphore[0] != max_compiles:
+            _compile_semaphore = (
+                max_compiles, threading.BoundedSemaphore(max_compiles))
+        return _compile_semaphore[1]
+
+
+@contextmanager
+def compile_slot():
+    # type: () -> Iterator[None]
+    """
+    A context manager which waits (at most L2P_COMPILE_WAIT_SECONDS) until
+    fewer than L2P_MAX_CONCURRENT_COMPILES compiles run in this process.
+    Compiles are CPU bound, while the threads of a worker also serve I/O
+    bound requests, so the compiles are limited separately.
+
+    :raise: :class:`TooManyCompiles` if no compile finished in time.
+    """
+    semaphore = get_compile_semaphore()
+    if semaphore is None:
+        yield
+        return
+
+    wait_seconds = getattr(
+        settings, "L2P_COMPILE_WAIT_SECONDS", DEFAULT_COMPILE_WAIT_SECONDS)
+    if not semaphore.acquire(timeout=wait_seconds):
+        raise TooManyCompiles(
+            "Too many compiles in progress, please try again later")
+    try:
+        yield
+    finally:
+        semaphore.release()
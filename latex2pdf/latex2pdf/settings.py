@@ -93,6 +93,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'latex.routers.ReplicaPinningMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -129,60 +130,158 @@ WSGI_APPLICATION = 'latex2pdf.wsgi.application'
 # {{{ Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-# https://github.com/nesdis/djongo/issues/390#issuecomment-640847108
+# L2P_DB_BACKEND: one of "mongo" (default), "postgres" and "sqlite", each
+# with its own tuned defaults below. All of them are configured by env vars.
+# "sqlite" (in WAL mode) is meant for single node deployments.
+
+L2P_DB_BACKEND = os.environ.get("L2P_DB_BACKEND", "mongo")
+
+# Persistent connections, in seconds, for "postgres" and "sqlite". 0 to close
+# the connection at the end of each request, "None" for unlimited.
+_conn_max_age = os.environ.get("L2P_DB_CONN_MAX_AGE", "600")
+db_conn_max_age = None if _conn_max_age == "None" else int(_conn_max_age)
+
+if L2P_DB_BACKEND == "mongo":
+    # https://github.com/nesdis/djongo/issues/390#issuecomment-640847108
+
+    db_name = os.environ.get("L2P_MONGO_DB_NAME", 'latex2pdf')
+
+    DATABASES = {
+            'default': {
+                'ENGINE': 'djongo',
+                'ENFORCE_SCHEMA': True,
+                'NAME': db_name,
+                'LOGGING': {
+                    'version': 1,
+                    'loggers': {
+                        'djongo': {
+                            'level': 'DEBUG',
+                            'propogate': False,
+                        }
+                    },
+                 },
+                # 'CLIENT': {
+                #     'host': 'host-name or ip address',
+                #     'port': 27017,
+                #     'username': 'db-username',
+                #     'password': 'password',
+                #     'authSource': 'db-name',
+                #     'authMechanism': 'SCRAM-SHA-1'
+                # }
+            }
+        }
+
+    client = {}
+
+    # For Mac as the host, set "-e L2P_MONGODB_PORT=docker.for.mac.host.internal"
+    # https://stackoverflow.com/a/45002996/3437454
+    mongo_host = os.environ.get("L2P_MONGODB_HOST", "host.docker.internal")
+    if mongo_host:
+        client["host"] = mongo_host
+    mongo_port = os.environ.get("L2P_MONGODB_PORT", None)
+    if mongo_port:
+        client.setdefault("host", "localhost")
+        client["port"] = mongo_port
+    mongo_user = os.environ.get("L2P_MONGODB_USERNAME", None)
+    mongo_pwd = os.environ.get("L2P_MONGODB_PASSWORD", None)
+    if mongo_user and mongo_pwd:
+        client["username"] = mongo_user
+        client["password"] = mongo_pwd
+
+    # The size of the connection pool of each process (pymongo's default)
+    client["maxPoolSize"] = int(os.environ.get("L2P_MONGODB_MAX_POOL_SIZE", 100))
 
-db_name = os.environ.get("L2P_MONGO_DB_NAME", 'latex2pdf')
+    DATABASES["default"]["CLIENT"] = client
 
-DATABASES = {
+    # Set to e.g. "secondaryPreferred" to send reads to the secondaries of
+    # the replica set, via the "replica" database alias, see L2P_DB_REPLICAS.
+    mongo_read_preference = os.environ.get("L2P_MONGODB_READ_PREFERENCE", None)
+    if mongo_read_preference:
+        DATABASES["replica"] = dict(
+            DATABASES["default"],
+            CLIENT=dict(client, readPreference=mongo_read_preference),
+            TEST={"MIRROR": "default"})
+
+    # Execute the following in mongo cmdline:
+    # > use latex2pdf
+    # switched to db latex2pdf
+    # > db.createUser({user:"your_mongo_user", pwd: "your_passwd", roles: ['root']})
+
+elif L2P_DB_BACKEND == "postgres":
+    # Django 2.2 has no connection pool, use persistent connections (and
+    # pgbouncer in front of the server if there are many workers).
+    DATABASES = {
         'default': {
-            'ENGINE': 'djongo',
-            'ENFORCE_SCHEMA': True,
-            'NAME': db_name,
-            'LOGGING': {
-                'version': 1,
-                'loggers': {
-                    'djongo': {
-                        'level': 'DEBUG',
-                        'propogate': False,
-                    }
-                },
-             },
-            # 'CLIENT': {
-            #     'host': 'host-name or ip address',
-            #     'port': 27017,
-            #     'username': 'db-username',
-            #     'password': 'password',
-            #     'authSource': 'db-name',
-            #     'authMechanism': 'SCRAM-SHA-1'
-            # }
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get("L2P_POSTGRES_DB_NAME", "latex2pdf"),
+            'USER': os.environ.get("L2P_POSTGRES_USER", "latex2pdf"),
+            'PASSWORD': os.environ.get("L2P_POSTGRES_PASSWORD", ""),
+            'HOST': os.environ.get("L2P_POSTGRES_HOST", "localhost"),
+            'PORT': os.environ.get("L2P_POSTGRES_PORT", "5432"),
+            'CONN_MAX_AGE': db_conn_max_age,
+            'OPTIONS': {
+                'connect_timeout': 10,
+            },
         }
     }
 
-client = {}
-
-# For Mac as the host, set "-e L2P_MONGODB_PORT=docker.for.mac.host.internal"
-# https://stackoverflow.com/a/45002996/3437454
-mongo_host = os.environ.get("L2P_MONGODB_HOST", "host.docker.internal")
-if mongo_host:
-    client["host"] = mongo_host
-mongo_port = os.environ.get("L2P_MONGODB_PORT", None)
-if mongo_port:
-    client.setdefault("host", "localhost")
-    client["port"] = mongo_port
-mongo_user = os.environ.get("L2P_MONGODB_USERNAME", None)
-mongo_pwd = os.environ.get("L2P_MONGODB_PASSWORD", None)
-if mongo_user and mongo_pwd:
-    client["username"] = mongo_user
-    client["password"] = mongo_pwd
-
-if client and DATABASES["default"]["ENGINE"] == "djongo":
-    DATABASES["default"]["CLIENT"] = client
-
+    # Comma separated hosts of streaming replicas, which are added as
+    # "replica_0", "replica_1", ..., see L2P_DB_REPLICAS.
+    for i, host in enumerate(filter(None, os.environ.get(
+            "L2P_POSTGRES_REPLICA_HOSTS", "").split(","))):
+        DATABASES["replica_%d" % i] = dict(
+            DATABASES["default"], HOST=host.strip(),
+            TEST={"MIRROR": "default"})
+
+elif L2P_DB_BACKEND == "sqlite":
+    # WAL mode and the other pragmas are set on each new connection, see
+    # L2P_SQLITE_PRAGMAS below.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get(
+                "L2P_SQLITE_PATH", os.path.join(BASE_DIR, "db.sqlite3")),
+            'CONN_MAX_AGE': db_conn_max_age,
+            'OPTIONS': {
+                # seconds to wait for the write lock
+                'timeout': 20,
+            },
+        }
+    }
 
-# Execute the following in mongo cmdline:
-# > use latex2pdf
-# switched to db latex2pdf
-# > db.createUser({user:"your_mongo_user", pwd: "your_passwd", roles: ['root']})
+else:
+    from django.core.exceptions import ImproperlyConfigured
+    raise ImproperlyConfigured(
+        "L2P_DB_BACKEND must be one of 'mongo', 'postgres' and 'sqlite', "
+        "got '%s'" % L2P_DB_BACKEND)
+
+# L2P_DB_REPLICAS: the aliases of DATABASES which are read replicas of
+# "default". Reads are sent to them by latex.routers.ReplicaRouter, except
+# in requests which wrote, and in requests of users who recently wrote to
+# the latex app (e.g., compiled), for L2P_DB_REPLICA_PIN_SECONDS (default
+# to 10), which should be longer than the usual replication lag. Set both
+# in local_settings.py if DATABASES is overridden there. Users are pinned in
+# CACHES["default"], which must then be shared by all the processes (e.g.,
+# memcached or redis, not the default locmem), otherwise reads raise
+# ImproperlyConfigured.
+
+L2P_DB_REPLICAS = [alias for alias in DATABASES if alias.startswith("replica")]
+
+DATABASE_ROUTERS = ["latex.routers.ReplicaRouter"]
+
+# L2P_DB_REPLICA_PIN_SECONDS = 10
+
+# L2P_SQLITE_PRAGMAS: the pragmas executed on each new sqlite connection
+# (whichever L2P_DB_BACKEND is, e.g., also when DATABASES is overridden in
+# local_settings.py). WAL allows reads concurrent with a write.
+
+L2P_SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -64000,  # in KiB
+    "mmap_size": 268435456,
+}
 
 
 # }}}
@@ -190,11 +289,110 @@ if client and DATABASES["default"]["ENGINE"] == "djongo":
 
 L2P_CACHE_MAX_BYTES = 65536
 
+# L2P_API_BULK_MAX_KEYS: Default to 200. The max number of tex_keys allowed
+# in one request to the bulk lookup api (api/bulk).
+
+# L2P_API_BULK_MAX_KEYS = 200
+
+# L2P_API_LIST_PAGE_SIZE: Default to 100. The default number of pdfs in a
+# page of the list api (api/list), which can be overridden by the
+# "page_size" query param up to 1000.
+
+# L2P_API_LIST_PAGE_SIZE = 100
+
+# L2P_TOKEN_CACHE_TIMEOUT: The number of seconds a valid API token (and its
+# user) is cached for authentication, 0 to disable. Cached tokens are
+# invalidated on rotation or user change, in CACHES["default"], so that
+# cache must be shared by all the processes (e.g., memcached or redis).
+# Default to 60 with such a cache, and to 0 with a per-process cache (e.g.,
+# the default locmem), in which an invalidation would only happen in the
+# process making the change.
+
+# L2P_TOKEN_CACHE_TIMEOUT = 60
+
+# L2P_HOT_READ_BACKEND: Default to "orm". With "pymongo", the hot read
+# queries (collection by hash, pdfs of a collection, see latex/repository.py)
+# are issued directly via pymongo on a pooled client instead of through
+# djongo. Only valid with the djongo engine.
+
+# L2P_HOT_READ_BACKEND = "orm"
+
+# L2P_RETENTION_KEEP_REVISIONS, L2P_RETENTION_KEEP_DAYS: Default to None
+# (no limit). The global retention policy of revisions (collections),
+# which can be overridden per project: revisions which are neither among
+# the latest L2P_RETENTION_KEEP_REVISIONS ones, nor newer than
+# L2P_RETENTION_KEEP_DAYS days, nor pinned, are deleted by the
+# "gc_revisions" management command. The latest revision is always kept.
+
+# L2P_RETENTION_KEEP_REVISIONS = 20
+# L2P_RETENTION_KEEP_DAYS = 90
+
+# L2P_STORAGE_CLEANUP_BATCH_SIZE: Default to 1000. When pdfs are deleted
+# (e.g., by deleting a project), their files and cache are deleted by a
+# background thread after the transaction is committed, using the batch
+# delete API of the storage (e.g., S3 DeleteObjects) with at most this
+# number of files per batch.
+
+# L2P_STORAGE_CLEANUP_BATCH_SIZE = 1000
+
+# L2P_WORKSPACE_TMPFS_ROOT: Default to None. L2P_WORKSPACE_DISK_ROOT: Default
+# to "l2p_workspaces" in the temp directory. Compiles unzip and compile
+# sources in scratch directories (workspaces) under these roots. If a tmpfs
+# root (e.g., "/dev/shm/l2p_workspaces") is configured, a workspace goes to
+# it if its estimated size (twice the size of the unzipped sources) is at
+# most L2P_WORKSPACE_TMPFS_MAX_BYTES (default to 16 MiB), and it fits
+# L2P_WORKSPACE_TMPFS_BUDGET_BYTES (default to 32 MiB), otherwise it goes to
+# the disk root, with a budget of L2P_WORKSPACE_DISK_BUDGET_BYTES (default to
+# 10 GiB). Budgets are per process, so the budget should be at most the size
+# of the root divided by the number of gunicorn workers. Note that /dev/shm
+# in Docker containers is 64 MiB unless the container is run with a larger
+# --shm-size (shm_size in docker-compose), so only enable the tmpfs root
+# with a larger shm size. Workspaces are deleted in the background after
+# compiles, and those left by crashed processes are deleted by the
+# "cleanup_workspaces" management command, which is run before the server
+# is started.
+
+# L2P_WORKSPACE_TMPFS_ROOT = "/dev/shm/l2p_workspaces"
+# L2P_WORKSPACE_TMPFS_BUDGET_BYTES = 32 * 1024 ** 2
+# L2P_WORKSPACE_DISK_BUDGET_BYTES = 10 * 1024 ** 3
+
+# L2P_MAX_CONCURRENT_COMPILES: Default to 1. Max number of compiles running
+# at once in each (gunicorn worker) process, as compiles are CPU bound. The
+# default number of gunicorn workers is the number of CPUs plus one, see
+# gunicorn.conf.py. 0 for no limit. Compiles wait at most
+# L2P_COMPILE_WAIT_SECONDS (default to 60) for a slot, after which a 503
+# response is returned.
+
+# L2P_MAX_CONCURRENT_COMPILES = 1
+
+# L2P_WARM_CACHE_ON_MIGRATE: Default to False. Whether to run the
+# "warm_cache" management command after "migrate", so that the result
+# cache is pre-populated after a deploy. On startup, this only happens when
+# migrations are applied, not on restarts with an up to date database.
+
+# L2P_WARM_CACHE_ON_MIGRATE = False
+
+# L2P_METRICS_ENABLED: Default to True. Whether to collect metrics (e.g.,
+# result cache hits/misses and lookup latency), which are exposed in
+# Prometheus text format at /metrics to staff users.
+
+# L2P_METRICS_ENABLED = True
+
+# L2P_METRICS_MULTIPROC_DIR: Default to None. Metrics are kept in the memory
+# of each process, so with several (gunicorn) workers a scrape only returns
+# the values of the worker which handled it. If set, each process also
+# writes its values to a file in this directory, and /metrics returns the
+# values aggregated over all the processes. The directory must be local to
+# the server and emptied before it starts (start-server.sh does that).
+
+L2P_METRICS_MULTIPROC_DIR = os.environ.get("L2P_METRICS_MULTIPROC_DIR", None)
+
 # L2P_API_PDF_RETURNS_RELATIVE_PATH: Default to True. If False, api query
-# only image will return the url of the file according to the MEDIA_URL and
-# MEDIA_ROOT you configured. If True, the relative path of the file in the
+# of pdfs will return the absolute url at which the pdf is served (with
+# permission checks) by this site, i.e., the url of its download view, not the
+# url of the storage. If True, the relative path of the file in the
 # storage will be returned. Noticing that the returned value will be cached
-# in create and detail view. If False, changes to MEDIA_URL will require a
+# in create and detail view. If False, changes to the host name will require a
 # flush of cache.
 
 # L2P_API_PDF_RETURNS_RELATIVE_PATH = True
@@ -230,6 +428,11 @@ if os.environ.get("L2P_ENABLE_PASSWORD_VALIDATORS", False):
 
 LOGIN_REDIRECT_URL = 'home'
 
+# SESSION_ENGINE: Default to "cached_db" (sessions are read from the cache
+# and written through to the database) if CACHES["default"] is shared by all
+# the processes, otherwise to "db", since a session changed (e.g., logged
+# out) in one process would still be valid in the caches of the others.
+
 # {{{ CORS settings
 # CORS_ORIGIN_ALLOW_ALL: If True, all origins will be accepted (not use the whitelist below). Defaults to False.
 # CORS_ORIGIN_WHITELIST: List of origins that are authorized to make cross-site HTTP requests. Defaults to []
@@ -258,7 +461,7 @@ if custom_whitelist_items:
 # https://stackoverflow.com/a/52347668/3437454
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'latex.auth.CachedTokenAuthentication',
     ]
 }
 
@@ -302,6 +505,81 @@ MEDIA_ROOT = BASE_DIR + "/"
 
 # DEFAULT_FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
 
+# To store pdfs in a remote storage (e.g., S3) while serving the recently
+# used ones from the local disk, use the tiered storage:
+# DEFAULT_FILE_STORAGE = "latex.storage.TieredStorage"
+
+# L2P_TIERED_STORAGE_REMOTE: Default to
+# "django_s3_storage.storage.S3Storage". The storage class to which the
+# tiered storage writes through, and from which missing local copies are
+# fetched.
+
+# L2P_TIERED_STORAGE_REMOTE = "django_s3_storage.storage.S3Storage"
+
+# L2P_TIERED_STORAGE_LOCAL_ROOT: Default to "l2p_local_cache" under
+# MEDIA_ROOT. The directory of the local copies, which should be on a
+# local disk of the node.
+
+# L2P_TIERED_STORAGE_LOCAL_ROOT = "/var/cache/l2p"
+
+# L2P_TIERED_STORAGE_LOCAL_MAX_BYTES: Default to 1 GiB. Least recently
+# used local copies are evicted beyond this size.
+
+# L2P_TIERED_STORAGE_LOCAL_MAX_BYTES = 1024 ** 3
+
+# To store pdfs in GridFS of the MongoDB (through the pooled client of the
+# default mongo database), so that any node can serve any pdf without a
+# shared file system (pdfs in GridFS have no storage url, and are always
+# streamed by the pdf download view):
+# DEFAULT_FILE_STORAGE = "latex.storage.GridFSStorage"
+
+# L2P_GRIDFS_DATABASE: Default to the name of the default database.
+# L2P_GRIDFS_BUCKET_NAME: Default to "l2p_pdf".
+# L2P_GRIDFS_CHUNK_SIZE: Default to 255 KiB, the size of GridFS chunks.
+
+# L2P_GRIDFS_BUCKET_NAME = "l2p_pdf"
+
+# L2P_PDF_X_ACCEL_REDIRECT_PREFIX: If set, after permissions are checked,
+# the transfer of pdfs stored in the local file system is handed over to
+# nginx via the "X-Accel-Redirect" header, with the value of this prefix
+# plus the file name in the storage. The prefix must be mapped to
+# MEDIA_ROOT by an "internal" location in nginx configurations.
+L2P_PDF_X_ACCEL_REDIRECT_PREFIX = os.environ.get(
+    "L2P_PDF_X_ACCEL_REDIRECT_PREFIX", None)
+
+# L2P_PDF_REDIRECT_TO_STORAGE_URL: Default to False. If True, after
+# permissions are checked, pdfs not stored in the local file system are
+# redirected to the storage url (e.g., S3 signed urls with expiration
+# configured by your storage) instead of being streamed by Django. Pdfs in
+# storages without urls (e.g., GridFS) are still streamed.
+
+# L2P_PDF_REDIRECT_TO_STORAGE_URL = False
+
+# L2P_PDF_REDIRECT_MAX_AGE: Default to 60. The max-age (in seconds) of the
+# (private) Cache-Control header of redirects to storage urls, which must be
+# shorter than the lifetime of the signed url (e.g., AWS_QUERYSTRING_EXPIRE,
+# which defaults to 3600 in django-storages). If 0, redirects are sent with
+# "no-store".
+
+# L2P_PDF_REDIRECT_MAX_AGE = 60
+
+# L2P_PROJECT_LIST_PAGE_SIZE: Default to 50. Number of projects per page
+# in the project list (home) page.
+
+# L2P_PROJECT_LIST_PAGE_SIZE = 50
+
+# L2P_OPTIMIZE_PDF: Default to True. Whether to rewrite compiled pdfs with
+# PyMuPDF (garbage collection, compression and object streams) to reduce
+# storage and bandwidth. The pdf is kept as is if the result is not smaller.
+
+# L2P_OPTIMIZE_PDF = True
+
+# L2P_LINEARIZE_PDF: Default to True. Whether to linearize compiled pdfs
+# (requires qpdf), so that the online viewer can render the first page
+# before the whole file is downloaded.
+
+# L2P_LINEARIZE_PDF = True
+
 # }}}
 
 SELECT2_I18N_PATH = 'select2/dist/js/i18n'
@@ -316,3 +594,11 @@ if local_settings is not None:
         import local_settings  # noqa
     except ImportError:
         pass
+
+if "SESSION_ENGINE" not in globals():
+    _default_cache_backend = globals().get("CACHES", {}).get("default", {}).get(
+        "BACKEND", "django.core.cache.backends.locmem.LocMemCache")
+    if _default_cache_backend not in (
+            "django.core.cache.backends.locmem.LocMemCache",
+            "django.core.cache.backends.dummy.DummyCache"):
+        SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
@@ -27,8 +27,6 @@ from django.contrib import admin
 from django.urls import path
 from django.conf.urls import url, include
 from django.contrib.auth import views as auth_views
-from django.conf import settings
-from django.conf.urls.static import static
 from django.utils.translation import ugettext_lazy as _
 
 from latex import api, views, auth
@@ -54,10 +52,15 @@ urlpatterns = [
     url(r"^project/" + PROJECT_ID_REGEX + "/detail/" + ZIP_FILE_HASH_REGEX +"/$",
         views.view_collection, name="view-collection"),
 
+    url(r"^pdf/" + ZIP_FILE_HASH_REGEX + r"/(?P<pdf_id>[0-9]+)/(?P<filename>[^/]+)$",
+        views.serve_pdf, name="pdf-download"),
+
     url(r"^api/list$", api.LatexPdfList.as_view(), name="list"),
     url(r"^api/detail/(?P<tex_key>[a-zA-Z0-9_]+)$", api.LatexImageDetail.as_view(), name="detail"),
     url(r"^api/create$", api.LatexImageCreate.as_view(), name="create"),
+    url(r"^api/bulk$", api.LatexPdfBulkDetail.as_view(), name="bulk"),
     path('api-auth/', include('rest_framework.urls')),
+    url(r"^metrics$", api.MetricsView.as_view(), name="metrics"),
 
     url(r'^login/$', auth_views.LoginView.as_view(
         template_name='registration/login.html', form_class=auth.AuthenticationForm,
@@ -66,5 +69,5 @@ urlpatterns = [
     url(r'^profile/$', auth.user_profile, name='profile'),
 ]
 
-# For generated image files
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Compiled pdfs are served by views.serve_pdf, which checks permissions,
+# instead of being served from MEDIA_ROOT.
@@ -14,3 +14,31 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'latex2pdf.settings')
 
 application = get_wsgi_application()
+
+
+def preload():
+    """
+    Import the modules which are otherwise imported on the first requests
+    (the url conf with all the views, DRF, and PyMuPDF), so that with
+    ``gunicorn --preload`` they are imported once in the master, and shared
+    by the workers.
+    """
+    from django.db import connections
+    from django.urls import get_resolver
+
+    # Imports all the views, and DRF with them
+    get_resolver().url_patterns
+
+    import rest_framework.authtoken.models  # noqa
+    import rest_framework.renderers  # noqa
+
+    try:
+        import fitz  # noqa
+    except ImportError:
+        pass
+
+    # Connections must not be shared by forked workers
+    connections.close_all()
+
+
+preload()
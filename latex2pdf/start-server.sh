@@ -5,13 +5,31 @@
 #    (python manage.py createsuperuser --no-input)
 #fi
 
+# Only install the user requirements when they changed since the last start
+# of the container.
 USER_REQUIREMENTS=/opt/latex2pdf/local_settings/requirements.txt
+USER_REQUIREMENTS_HASH=/opt/latex2pdf/tmp/user-requirements.sha256
 if test -f "$USER_REQUIREMENTS"; then
-    pip install -r $USER_REQUIREMENTS --upgrade
+    if ! sha256sum --status -c "$USER_REQUIREMENTS_HASH" 2>/dev/null; then
+        pip install -r $USER_REQUIREMENTS --upgrade \
+            && sha256sum "$USER_REQUIREMENTS" > "$USER_REQUIREMENTS_HASH"
+    fi
 fi
 
-python manage.py makemigrations
-python manage.py migrate --noinput
+# Migrations are shipped with the code. This only checks the migration
+# state when the database is up to date.
+python manage.py ensure_migrated
 
-(gunicorn latex2pdf.wsgi --user www-data --bind 0.0.0.0:8011 --workers 3) &
+# Delete the compile workspaces left by the workers of the previous run.
+python manage.py cleanup_workspaces
+
+# Delete the metrics snapshots of the processes of the previous run.
+if [ -n "$L2P_METRICS_MULTIPROC_DIR" ]; then
+    rm -rf "$L2P_METRICS_MULTIPROC_DIR"
+fi
+
+# Workers, threads, recycling and timeouts are configured by
+# gunicorn.conf.py, which also preloads the app in the master, so that it
+# is shared copy-on-write by the workers.
+(gunicorn latex2pdf.wsgi -c gunicorn.conf.py --user www-data) &
 nginx -g "daemon off;"
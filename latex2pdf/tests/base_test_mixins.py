@@ -24,10 +24,12 @@ THE SOFTWARE.
 
 import sys
 import tempfile
+from contextlib import contextmanager
 from functools import wraps
 from io import StringIO
 from urllib.parse import quote
 
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.test import Client, override_settings
 from django.core.files.storage import FileSystemStorage
 from django.urls import reverse
@@ -399,3 +401,58 @@ def improperly_configured_cache_patch():
         return built_in_import(name, globals, locals, fromlist, level)
 
     return mock.patch(built_in_import_path, side_effect=my_disable_cache_import)
+
+
+@contextmanager
+def capture_on_commit_callbacks(using=DEFAULT_DB_ALIAS, execute=False):
+    """
+    Context manager capturing :func:`transaction.on_commit` callbacks, which
+    are never run in ``TestCase``, and run them on exit if `execute`.
+    Backported from ``TestCase.captureOnCommitCallbacks`` of Django 3.2.
+    """
+    callbacks = []
+    start_count = len(connections[using].run_on_commit)
+    try:
+        yield callbacks
+    finally:
+        run_on_commit = connections[using].run_on_commit[start_count:]
+        callbacks[:] = [func for sids, func in run_on_commit]
+        if execute:
+            for callback in callbacks:
+                callback()
+
+
+def get_fake_pdf_content(text="foo"):
+    return ("%%PDF-1.4\n%% %s\n%%%%EOF\n" % text).encode()
+
+
+def create_latex_project(creator, identifier="test-project", **kwargs):
+    from latex.models import LatexProject
+    kwargs.setdefault("name", identifier)
+    return LatexProject.objects.create(
+        identifier=identifier, creator=creator, **kwargs)
+
+
+def create_latex_collection(project, zip_file_hash, compile_error=None,
+                            pdf_names=("main.pdf",), **kwargs):
+    """
+    Create a collection of `project`, with a :class:`LatexPdf` for each of the
+    `pdf_names` if there is no `compile_error`.
+    """
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from latex.models import LatexCollection, LatexPdf
+
+    collection = LatexCollection.objects.create(
+        project=project, zip_file_hash=zip_file_hash,
+        compile_error=compile_error, **kwargs)
+
+    if compile_error is None:
+        for name in pdf_names:
+            LatexPdf.objects.create(
+                project=project, collection=collection, name=name,
+                pdf=SimpleUploadedFile(
+                    name, get_fake_pdf_content(name),
+                    content_type="application/pdf"),
+                mediabox=[0, 0, 595, 842])
+
+    return collection
@@ -0,0 +1,248 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, capture_on_commit_callbacks, create_latex_project,
+    create_latex_collection, improperly_configured_cache_patch)
+from latex.api import get_field_cache_key
+from latex.models import LatexPdf
+
+
+@override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=True)
+class LatexPdfBulkDetailTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.test_user)
+
+        self.project = create_latex_project(self.test_user)
+        self.collections = [
+            create_latex_collection(self.project, "hash_%d" % i)
+            for i in range(3)]
+        self.errored_collection = create_latex_collection(
+            self.project, "hash_errored", compile_error="some error")
+
+    def get_bulk_url(self, tex_keys=None, fields=None):
+        url = reverse("bulk")
+        params = []
+        if tex_keys is not None:
+            params.append("tex_keys=%s" % ",".join(tex_keys))
+        if fields is not None:
+            params.append("fields=%s" % fields)
+        if params:
+            url += "?" + "&".join(params)
+        return url
+
+    def get_expected_pdf(self, zip_file_hash):
+        return str(LatexPdf.objects.get(
+            collection__zip_file_hash=zip_file_hash).pdf)
+
+    def test_get_not_authenticated(self):
+        self.client.force_authenticate(user=None)
+        resp = self.client.get(self.get_bulk_url(["hash_0"]))
+        self.assertEqual(resp.status_code, 401)
+
+    def test_get_no_tex_keys(self):
+        resp = self.client.get(self.get_bulk_url())
+        self.assertEqual(resp.status_code, 400)
+
+    @override_settings(L2P_API_BULK_MAX_KEYS=2)
+    def test_too_many_keys(self):
+        resp = self.client.get(
+            self.get_bulk_url(["hash_0", "hash_1", "hash_2"]))
+        self.assertEqual(resp.status_code, 400)
+
+    def test_get_all_cached(self):
+        # values are cached by the receiver on save, and the creators of
+        # the keys on the first lookup
+        tex_keys = ["hash_0", "hash_1", "hash_2"]
+        with self.assertNumQueries(1):
+            resp = self.client.get(self.get_bulk_url(tex_keys, "pdf"))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp.json(),
+            dict((key, {"pdf": self.get_expected_pdf(key)})
+                 for key in tex_keys))
+
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.get_bulk_url(tex_keys, "pdf"))
+        self.assertEqual(
+            resp.json(),
+            dict((key, {"pdf": self.get_expected_pdf(key)})
+                 for key in tex_keys))
+
+    def test_get_misses_one_query_and_back_filled(self):
+        self.test_cache.clear()
+        tex_keys = ["hash_0", "hash_1", "hash_2"]
+
+        with self.assertNumQueries(2):
+            resp = self.client.get(self.get_bulk_url(tex_keys, "pdf"))
+        self.assertEqual(resp.status_code, 200)
+
+        for key in tex_keys:
+            self.assertEqual(resp.json()[key], {"pdf": self.get_expected_pdf(key)})
+            self.assertEqual(
+                self.test_cache.get(get_field_cache_key(key, "pdf")),
+                self.get_expected_pdf(key))
+
+        with self.assertNumQueries(0):
+            self.client.get(self.get_bulk_url(tex_keys, "pdf"))
+
+    def test_superuser_all_cached_no_query(self):
+        self.client.force_authenticate(user=self.superuser)
+        tex_keys = ["hash_0", "hash_1", "hash_2"]
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.get_bulk_url(tex_keys, "pdf"))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp.json(),
+            dict((key, {"pdf": self.get_expected_pdf(key)})
+                 for key in tex_keys))
+
+    def test_other_users_keys_not_returned(self):
+        other_user = self.create_user({
+            "username": "other_user", "password": "mypassword",
+            "email": "other_email@example.com"})
+        other_project = create_latex_project(other_user, "other-project")
+        create_latex_collection(other_project, "other_hash")
+        create_latex_collection(
+            other_project, "other_errored", compile_error="other error")
+
+        tex_keys = ["hash_0", "other_hash", "other_errored"]
+        expected = {
+            "hash_0": {"pdf": self.get_expected_pdf("hash_0")},
+            "other_hash": {},
+            "other_errored": {},
+        }
+
+        # cached hits (filled on save) are not returned either
+        resp = self.client.get(self.get_bulk_url(tex_keys, "pdf"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), expected)
+
+        self.test_cache.clear()
+        resp = self.client.get(self.get_bulk_url(tex_keys, "pdf"))
+        self.assertEqual(resp.json(), expected)
+        self.assertIsNone(
+            self.test_cache.get(get_field_cache_key("other_hash", "pdf")))
+
+        # with the creators cached
+        with self.assertNumQueries(0):
+            resp = self.client.get(self.get_bulk_url(tex_keys, "pdf"))
+        self.assertEqual(resp.json(), expected)
+
+        self.client.force_authenticate(user=self.superuser)
+        resp = self.client.get(self.get_bulk_url(tex_keys, "pdf"))
+        self.assertEqual(resp.json(), {
+            "hash_0": {"pdf": self.get_expected_pdf("hash_0")},
+            "other_hash": {"pdf": self.get_expected_pdf("other_hash")},
+            "other_errored": {"compile_error": "other error"},
+        })
+
+    def test_cached_creators_invalidated(self):
+        other_user = self.create_user({
+            "username": "other_user", "password": "mypassword",
+            "email": "other_email@example.com"})
+        other_project = create_latex_project(other_user, "other-project")
+        create_latex_collection(other_project, "shared_hash")
+
+        resp = self.client.get(self.get_bulk_url(["shared_hash"], "pdf"))
+        self.assertEqual(resp.json(), {"shared_hash": {}})
+
+        # The same zip file compiled in a project of the user
+        with capture_on_commit_callbacks(execute=True):
+            collection = create_latex_collection(self.project, "shared_hash")
+        resp = self.client.get(self.get_bulk_url(["shared_hash"], "pdf"))
+        self.assertNotEqual(resp.json(), {"shared_hash": {}})
+
+        with capture_on_commit_callbacks(execute=True):
+            collection.delete()
+        resp = self.client.get(self.get_bulk_url(["shared_hash"], "pdf"))
+        self.assertEqual(resp.json(), {"shared_hash": {}})
+
+    def test_post_mixed(self):
+        self.test_cache.delete(get_field_cache_key("hash_1", "pdf"))
+        resp = self.client.post(
+            reverse("bulk"),
+            data={"tex_keys": ["hash_0", "hash_1", "hash_errored",
+                               "not_exist"],
+                  "fields": "pdf"},
+            format="json")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), {
+            "hash_0": {"pdf": self.get_expected_pdf("hash_0")},
+            "hash_1": {"pdf": self.get_expected_pdf("hash_1")},
+            "hash_errored": {"compile_error": "some error"},
+            "not_exist": {},
+        })
+        self.assertEqual(
+            self.test_cache.get(
+                get_field_cache_key("hash_errored", "compile_error")),
+            "some error")
+
+    def test_post_tex_keys_not_list(self):
+        resp = self.client.post(
+            reverse("bulk"), data={"tex_keys": "hash_0"}, format="json")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_post_tex_keys_not_strings(self):
+        for tex_keys in [["hash_0", 1], [["hash_0"]], [{"a": 1}], [None]]:
+            with self.subTest(tex_keys=tex_keys):
+                resp = self.client.post(
+                    reverse("bulk"), data={"tex_keys": tex_keys},
+                    format="json")
+                self.assertEqual(resp.status_code, 400)
+
+    def test_post_fields_not_string(self):
+        resp = self.client.post(
+            reverse("bulk"), data={"tex_keys": ["hash_0"], "fields": ["pdf"]},
+            format="json")
+        self.assertEqual(resp.status_code, 400)
+
+    @override_settings(L2P_API_BULK_MAX_KEYS=2)
+    def test_post_too_many_keys(self):
+        resp = self.client.post(
+            reverse("bulk"), data={"tex_keys": [""] * 3}, format="json")
+        self.assertEqual(resp.status_code, 400)
+
+    def test_cache_improperly_configured(self):
+        with improperly_configured_cache_patch():
+            resp = self.client.get(self.get_bulk_url(["hash_0"], "pdf"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp.json(), {"hash_0": {"pdf": self.get_expected_pdf("hash_0")}})
+
+    def test_detail_uses_same_lookup(self):
+        self.test_cache.clear()
+        resp = self.client.get(
+            self.get_detail_url("hash_0", fields="pdf"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), {"pdf": self.get_expected_pdf("hash_0")})
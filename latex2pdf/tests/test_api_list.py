@@ -0,0 +1,179 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+from datetime import timedelta
+from urllib.parse import urlencode
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+from rest_framework.test import APIClient
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, create_latex_project, create_latex_collection)
+from latex.models import LatexPdf
+
+
+@override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=True)
+class LatexPdfListTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.test_user)
+
+        self.project = create_latex_project(self.test_user)
+        self.base_time = now()
+        for i in range(5):
+            collection = create_latex_collection(
+                self.project, "hash_%d" % i,
+                creation_time=self.base_time - timedelta(days=i),
+                pdf_names=("a.pdf", "b.pdf"))
+            LatexPdf.objects.filter(collection=collection).update(
+                creation_time=collection.creation_time)
+        create_latex_collection(
+            self.project, "hash_errored", compile_error="some error")
+
+        other_project = create_latex_project(
+            self.superuser, identifier="other-project")
+        create_latex_collection(other_project, "hash_other")
+
+    def get_list(self, **params):
+        url = reverse("list")
+        if params:
+            url += "?" + urlencode(params)
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()
+
+    def get_all_pages(self, **params):
+        data = self.get_list(**params)
+        results = data["results"]
+        while data["next"]:
+            resp = self.client.get(data["next"])
+            self.assertEqual(resp.status_code, 200)
+            data = resp.json()
+            results.extend(data["results"])
+        return results
+
+    def test_paginated(self):
+        data = self.get_list(page_size=3)
+        self.assertEqual(len(data["results"]), 3)
+        self.assertIsNone(data["previous"])
+        self.assertIsNotNone(data["next"])
+
+        results = self.get_all_pages(page_size=3)
+        self.assertEqual(len(results), 10)
+        self.assertEqual(len({result["id"] for result in results}), 10)
+
+        # newest first
+        pdfs = {pdf.pk: pdf for pdf in LatexPdf.objects.all()}
+        creation_times = [pdfs[result["id"]].creation_time for result in results]
+        self.assertEqual(creation_times, sorted(creation_times, reverse=True))
+
+    @override_settings(L2P_API_LIST_PAGE_SIZE=4)
+    def test_page_size_setting(self):
+        self.assertEqual(len(self.get_list()["results"]), 4)
+
+    def test_pages_stable_after_create(self):
+        data = self.get_list(page_size=4)
+        first_page_ids = [result["id"] for result in data["results"]]
+
+        create_latex_collection(self.project, "hash_new")
+
+        resp = self.client.get(data["next"])
+        second_page_ids = [result["id"] for result in resp.json()["results"]]
+        self.assertEqual(len(second_page_ids), 4)
+        self.assertFalse(set(first_page_ids) & set(second_page_ids))
+
+    def test_superuser_sees_all(self):
+        self.client.force_authenticate(user=self.superuser)
+        self.assertEqual(len(self.get_all_pages()), 11)
+
+    def test_filter_project(self):
+        self.client.force_authenticate(user=self.superuser)
+        self.assertEqual(len(self.get_all_pages(project="other-project")), 1)
+
+    def test_filter_collection(self):
+        results = self.get_all_pages(collection="hash_1")
+        self.assertEqual(
+            {LatexPdf.objects.get(pk=result["id"]).collection.zip_file_hash
+             for result in results}, {"hash_1"})
+        self.assertEqual(len(results), 2)
+
+    def test_filter_creation_time(self):
+        results = self.get_all_pages(
+            created_after=(self.base_time - timedelta(days=2, hours=1)
+                           ).isoformat(),
+            created_before=(self.base_time - timedelta(hours=1)).isoformat())
+
+        # hash_1 and hash_2
+        self.assertEqual(len(results), 4)
+
+    def test_filter_has_error(self):
+        self.assertEqual(len(self.get_all_pages(has_error="false")), 10)
+        self.assertEqual(len(self.get_all_pages(has_error="true")), 0)
+
+    def test_bad_filters(self):
+        for params in [{"created_after": "foo"}, {"created_before": "2020-13-01"},
+                       {"has_error": "maybe"}]:
+            with self.subTest(params=params):
+                resp = self.client.get(reverse("list") + "?" + urlencode(params))
+                self.assertEqual(resp.status_code, 400)
+
+    def test_fields_trimmed(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.get_list(fields="id")
+
+        self.assertEqual(set(data["results"][0]), {"id"})
+        sql = ctx.captured_queries[-1]["sql"]
+        self.assertNotIn('"pdf"', sql)
+        self.assertNotIn("mediabox", sql)
+
+    def test_large_columns_not_loaded(self):
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.get_list()
+
+        self.assertEqual(set(data["results"][0]), {"id", "pdf"})
+        self.assertNotIn("mediabox", ctx.captured_queries[-1]["sql"])
+
+    @override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=False)
+    def test_pdf_urls(self):
+        results = self.get_all_pages(fields="pdf", collection="hash_1")
+        self.assertEqual(len(results), 2)
+        self.assertEqual(
+            sorted(result["pdf"] for result in results),
+            sorted("http://testserver" + pdf.get_absolute_url()
+                   for pdf in LatexPdf.objects.filter(
+                       collection__zip_file_hash="hash_1")))
+
+    def test_constant_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.get_list(page_size=2)
+        n_queries = len(ctx.captured_queries)
+
+        with self.assertNumQueries(n_queries):
+            self.get_list(page_size=8)
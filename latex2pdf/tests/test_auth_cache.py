@@ -0,0 +1,160 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, improperly_configured_cache_patch)
+from latex.auth import get_token_cache, get_token_cache_key
+
+
+@override_settings(L2P_TOKEN_CACHE_TIMEOUT=60)
+class CachedTokenAuthenticationTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.get(user=self.test_user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        self.url = reverse("list")
+
+    def get(self, expected_status=200):
+        resp = self.client.get(self.url)
+        self.assertEqual(resp.status_code, expected_status)
+        return resp
+
+    def test_cached(self):
+        self.get()
+        self.assertEqual(
+            self.test_cache.get(get_token_cache_key(self.token.key)),
+            self.test_user.pk)
+
+        # The token is not queried, the user is queried by pk
+        with CaptureQueriesContext(connection) as ctx:
+            self.get()
+        self.assertEqual(len(ctx.captured_queries), 2)
+        self.assertNotIn("authtoken", ctx.captured_queries[0]["sql"])
+
+    def test_cached_user_is_fresh(self):
+        self.get()
+        # bypass the receivers, as if the invalidation were missed
+        type(self.test_user).objects.filter(pk=self.test_user.pk).update(
+            is_active=False)
+        self.assertIsNotNone(
+            self.test_cache.get(get_token_cache_key(self.token.key)))
+
+        self.get(401)
+        self.assertIsNone(
+            self.test_cache.get(get_token_cache_key(self.token.key)))
+
+    def test_raw_key_not_in_cache_key(self):
+        self.assertNotIn(self.token.key, get_token_cache_key(self.token.key))
+
+    def test_invalid_token_not_cached(self):
+        self.client.credentials(HTTP_AUTHORIZATION="Token foo")
+        self.get(401)
+        self.assertIsNone(self.test_cache.get(get_token_cache_key("foo")))
+
+    def test_token_rotated(self):
+        self.get()
+        self.token.delete()
+        self.get(401)
+
+        new_token = Token.objects.create(user=self.test_user)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + new_token.key)
+        self.get()
+
+    def test_user_deactivated(self):
+        self.get()
+        self.test_user.is_active = False
+        self.test_user.save()
+        self.get(401)
+
+    def test_user_deleted(self):
+        self.get()
+        self.test_user.delete()
+        self.get(401)
+
+    def test_login_does_not_invalidate(self):
+        self.get()
+        self.test_user.save(update_fields=["last_login"])
+        self.assertIsNotNone(
+            self.test_cache.get(get_token_cache_key(self.token.key)))
+
+    @override_settings(L2P_TOKEN_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self.get()
+        self.assertIsNone(
+            self.test_cache.get(get_token_cache_key(self.token.key)))
+
+    def test_cache_not_configured(self):
+        with improperly_configured_cache_patch():
+            self.get()
+            self.token.delete()
+            self.get(401)
+
+    @override_settings(L2P_TOKEN_CACHE_TIMEOUT=None)
+    def test_default_disabled_with_process_local_cache(self):
+        self.get()
+        self.assertIsNone(
+            self.test_cache.get(get_token_cache_key(self.token.key)))
+
+    @override_settings(L2P_TOKEN_CACHE_TIMEOUT=None)
+    def test_default_enabled_with_shared_cache(self):
+        cache_dir = tempfile.mkdtemp(prefix="l2p_test_cache_")
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with override_settings(CACHES={
+                "default": {
+                    "BACKEND":
+                        "django.core.cache.backends.filebased.FileBasedCache",
+                    "LOCATION": cache_dir}}):
+            self.get()
+            self.assertEqual(
+                get_token_cache().get(get_token_cache_key(self.token.key)),
+                self.test_user.pk)
+
+
+class SessionTest(L2ITestMixinBase, TestCase):
+    def test_sessions_not_cached_with_process_local_cache(self):
+        # No CACHES in the test settings, see SESSION_ENGINE in settings.py
+        self.assertEqual(
+            settings.SESSION_ENGINE, "django.contrib.sessions.backends.db")
+
+    def test_login_cache_not_configured(self):
+        with improperly_configured_cache_patch():
+            resp = self.c.post(reverse("login"), data={
+                "username": "test_user", "password": "mypassword"})
+            self.assertEqual(resp.status_code, 302)
+
+            self.assertEqual(
+                int(self.c.session["_auth_user_id"]), self.test_user.pk)
@@ -0,0 +1,201 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+from unittest import mock
+
+from django.db import connection
+from django.db.transaction import atomic
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, capture_on_commit_callbacks, create_latex_project,
+    create_latex_collection)
+from latex.api import get_field_cache_key
+from latex.cleanup import (
+    CleanupItem, CleanupQueue, delete_storage_files, get_cleanup_queue)
+from latex.models import LatexCollection, LatexPdf
+
+
+class BatchDeleteStorage(object):
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    def delete_many(self, names):
+        if self.fail:
+            raise RuntimeError("storage is down")
+        self.batches.append(list(names))
+
+
+class DeleteStorageFilesTest(SimpleTestCase):
+    def test_delete_many(self):
+        storage = BatchDeleteStorage()
+        storage.delete = mock.MagicMock()
+        delete_storage_files(storage, ["a", "b"])
+        self.assertEqual(storage.batches, [["a", "b"]])
+        storage.delete.assert_not_called()
+
+    def test_s3_delete_objects(self):
+        storage = mock.MagicMock(spec=["s3_connection", "settings",
+                                       "_get_key_name", "delete"])
+        storage.settings.AWS_S3_BUCKET_NAME = "bucket"
+        storage._get_key_name.side_effect = lambda name: "prefix/" + name
+
+        names = ["file%d.pdf" % i for i in range(1500)]
+        delete_storage_files(storage, names)
+
+        calls = storage.s3_connection.delete_objects.call_args_list
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[0][1]["Bucket"], "bucket")
+        self.assertEqual(len(calls[0][1]["Delete"]["Objects"]), 1000)
+        self.assertEqual(
+            calls[1][1]["Delete"]["Objects"][-1], {"Key": "prefix/file1499.pdf"})
+        storage.delete.assert_not_called()
+
+    def test_delete_one_by_one(self):
+        storage = mock.MagicMock(spec=["delete"])
+        delete_storage_files(storage, ["a", "b"])
+        self.assertEqual(storage.delete.call_count, 2)
+
+
+class CleanupQueueTest(SimpleTestCase):
+    def test_flush_in_batches(self):
+        storage = BatchDeleteStorage()
+        cache = mock.MagicMock()
+        queue = CleanupQueue(batch_size=2)
+        for name in "abcde":
+            queue.queue.put(CleanupItem(storage, name, cache, "key"))
+
+        queue.flush()
+        self.assertEqual(storage.batches, [["a", "b"], ["c", "d"], ["e"]])
+
+        # duplicated cache keys are deleted once per batch
+        self.assertEqual(
+            [call[0][0] for call in cache.delete_many.call_args_list],
+            [["key"], ["key"], ["key"]])
+
+    def test_worker(self):
+        storage = BatchDeleteStorage()
+        queue = CleanupQueue()
+        for name in "abc":
+            queue.put(storage, name)
+        queue.join()
+
+        self.assertEqual(
+            sorted(name for batch in storage.batches for name in batch),
+            ["a", "b", "c"])
+
+    def test_worker_survives_errors(self):
+        storage = BatchDeleteStorage(fail=True)
+        queue = CleanupQueue()
+        with mock.patch("latex.cleanup.logger") as mock_logger:
+            queue.put(storage, "a")
+            queue.join()
+        self.assertEqual(mock_logger.exception.call_count, 1)
+
+        storage.fail = False
+        queue.put(storage, "b")
+        queue.join()
+        self.assertEqual(storage.batches, [["b"]])
+
+
+class CascadingDeleteCleanupTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = create_latex_project(self.test_user)
+        for i in range(3):
+            create_latex_collection(
+                self.project, "hash_%d" % i, pdf_names=("a.pdf", "b.pdf"))
+
+        self.pdf_paths = [pdf.pdf.path for pdf in LatexPdf.objects.all()]
+        self.assertEqual(len(self.pdf_paths), 6)
+        self.assertTrue(all(os.path.isfile(path) for path in self.pdf_paths))
+
+        self.cache_keys = [
+            get_field_cache_key("hash_%d" % i, "pdf") for i in range(3)]
+        self.assertTrue(all(
+            self.test_cache.get(key) is not None for key in self.cache_keys))
+
+    def test_delete_project(self):
+        # Drained synchronously, so that how items are batched doesn't
+        # depend on the scheduling of the worker thread
+        queue = CleanupQueue()
+        with mock.patch("latex.cleanup.delete_storage_files",
+                        wraps=delete_storage_files) as mock_delete:
+            with mock.patch.object(queue, "ensure_worker"):
+                with mock.patch("latex.receivers.get_cleanup_queue",
+                                return_value=queue):
+                    with capture_on_commit_callbacks(execute=True):
+                        self.project.delete()
+                queue.flush()
+
+        self.assertFalse(any(os.path.isfile(path) for path in self.pdf_paths))
+        self.assertTrue(all(
+            self.test_cache.get(key) is None for key in self.cache_keys))
+
+        n_deleted = sum(
+            len(call[0][1]) for call in mock_delete.call_args_list)
+        self.assertEqual(n_deleted, 6)
+        self.assertEqual(mock_delete.call_count, 1)
+
+    def get_delete_query_count(self, collection):
+        with capture_on_commit_callbacks(execute=True):
+            with CaptureQueriesContext(connection) as ctx:
+                LatexCollection.objects.get(pk=collection.pk).delete()
+        get_cleanup_queue().join()
+        return len(ctx.captured_queries)
+
+    def test_cascading_delete_does_not_fetch_collection_per_pdf(self):
+        small = create_latex_collection(
+            self.project, "hash_small", pdf_names=("a.pdf",))
+        big = create_latex_collection(
+            self.project, "hash_big",
+            pdf_names=["%d.pdf" % i for i in range(5)])
+
+        # so that neither of them is the latest collection
+        create_latex_collection(self.project, "hash_latest")
+
+        self.assertEqual(
+            self.get_delete_query_count(small),
+            self.get_delete_query_count(big))
+
+        self.assertIsNone(
+            self.test_cache.get(get_field_cache_key("hash_big", "pdf")))
+
+    def test_nothing_deleted_on_rollback(self):
+        class Rollback(Exception):
+            pass
+
+        with capture_on_commit_callbacks(execute=True) as callbacks:
+            with self.assertRaises(Rollback):
+                with atomic():
+                    self.project.delete()
+                    raise Rollback()
+        get_cleanup_queue().join()
+
+        self.assertEqual(callbacks, [])
+        self.assertTrue(all(os.path.isfile(path) for path in self.pdf_paths))
@@ -0,0 +1,238 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, create_latex_project, create_latex_collection,
+    improperly_configured_cache_patch)
+from latex.api import get_field_cache_key
+from latex.management.commands.audit_indexes import (
+    HOT_QUERIES, find_mongo_stages)
+
+
+@override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=True)
+class WarmCacheCommandTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = create_latex_project(self.test_user)
+        for i in range(5):
+            create_latex_collection(
+                self.project, "hash_%d" % i,
+                creation_time=now() - timedelta(days=i))
+        create_latex_collection(
+            self.project, "hash_errored", compile_error="some error",
+            creation_time=now() - timedelta(days=10))
+        self.test_cache.clear()
+
+    def call_command(self, **options):
+        stdout = StringIO()
+        call_command("warm_cache", stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def assertCached(self, zip_file_hash, attr="pdf"):  # noqa
+        self.assertIsNotNone(
+            self.test_cache.get(get_field_cache_key(zip_file_hash, attr)))
+
+    def assertNotCached(self, zip_file_hash, attr="pdf"):  # noqa
+        self.assertIsNone(
+            self.test_cache.get(get_field_cache_key(zip_file_hash, attr)))
+
+    def test_warm_all(self):
+        output = self.call_command(batch_size=2)
+        self.assertIn("Warmed 6 cache items of 6 collections", output)
+        for i in range(5):
+            self.assertCached("hash_%d" % i)
+        self.assertCached("hash_errored", "compile_error")
+        self.assertEqual(
+            self.test_cache.get(
+                get_field_cache_key("hash_errored", "compile_error")),
+            "some error")
+
+    def test_warm_newest_first(self):
+        self.call_command(limit=2)
+        self.assertCached("hash_0")
+        self.assertCached("hash_1")
+        self.assertNotCached("hash_2")
+        self.assertNotCached("hash_errored", "compile_error")
+
+    def test_queries_per_batch(self):
+        # one query for ids, then 2 queries per batch
+        with self.assertNumQueries(1 + 2 * 3):
+            self.call_command(batch_size=2)
+
+    def test_rate(self):
+        self.call_command(batch_size=1, rate=1000)
+        self.assertCached("hash_4")
+
+    @override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=False)
+    def test_pdf_url_not_cached(self):
+        self.call_command()
+        self.assertNotCached("hash_0")
+        self.assertCached("hash_errored", "compile_error")
+
+    def test_invalid_options(self):
+        for options in [{"limit": 0}, {"batch_size": -1},
+                        {"concurrency": 0}, {"rate": -1}]:
+            with self.subTest(options=options):
+                with self.assertRaises(CommandError):
+                    self.call_command(**options)
+
+    def test_cache_improperly_configured(self):
+        with improperly_configured_cache_patch():
+            with self.assertRaises(CommandError):
+                self.call_command()
+
+    @override_settings(L2P_WARM_CACHE_ON_MIGRATE=True)
+    def test_warm_on_migrate(self):
+        from django.apps import apps
+        from latex.receivers import warm_cache_after_migrate
+        warm_cache_after_migrate(
+            sender=apps.get_app_config("latex"), verbosity=0)
+        self.assertCached("hash_0")
+
+    def test_not_warm_on_migrate_by_default(self):
+        from django.apps import apps
+        from latex.receivers import warm_cache_after_migrate
+        warm_cache_after_migrate(
+            sender=apps.get_app_config("latex"), verbosity=0)
+        self.assertNotCached("hash_0")
+
+
+class AuditIndexesCommandTest(TestCase):
+    def call_command(self, **options):
+        stdout = StringIO()
+        call_command("audit_indexes", stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_no_scans(self):
+        output = self.call_command(fail_on_scan=True)
+        self.assertNotIn("SCAN", output)
+        self.assertEqual(output.count("OK: "), len(HOT_QUERIES))
+
+    def test_scan_detected(self):
+        from latex.management.commands.audit_indexes import HotQuery
+        from latex.models import LatexPdf
+        scanning_query = HotQuery(
+            "pdfs by name", LatexPdf, {"name": "main.pdf"}, ())
+
+        with mock.patch(
+                "latex.management.commands.audit_indexes.HOT_QUERIES",
+                HOT_QUERIES + [scanning_query]):
+            output = self.call_command(verbosity=2)
+            self.assertIn("SCAN: pdfs by name", output)
+
+            with self.assertRaises(CommandError) as cm:
+                self.call_command(fail_on_scan=True)
+            self.assertIn("pdfs by name", str(cm.exception))
+
+    def test_find_mongo_stages(self):
+        plan = {
+            "stage": "FETCH",
+            "inputStage": {
+                "stage": "IXSCAN", "indexName": "latex_coll_hash_idx"}}
+        self.assertEqual(find_mongo_stages(plan), ["FETCH", "IXSCAN"])
+        self.assertEqual(
+            find_mongo_stages({"stage": "SORT", "inputStage": {
+                "stage": "COLLSCAN"}}), ["SORT", "COLLSCAN"])
+
+
+class BenchmarkQueriesCommandTest(L2ITestMixinBase, TestCase):
+    def call_command(self, **options):
+        stdout = StringIO()
+        call_command("benchmark_queries", stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_benchmark(self):
+        project = create_latex_project(self.test_user)
+        for i in range(3):
+            create_latex_collection(project, "hash_%d" % i)
+
+        output = self.call_command(iterations=3, n_hashes=2)
+        for description in [
+                "project with latest collection",
+                "collection by project and hash",
+                "pdfs of a collection", "pdf values by 2 hashes"]:
+            self.assertIn(description, output)
+        self.assertIn("default (sqlite)", output)
+
+    def test_no_data(self):
+        self.assertIn("skipped", self.call_command(iterations=1))
+
+    def test_bad_options(self):
+        with self.assertRaises(CommandError):
+            self.call_command(iterations=0)
+        with self.assertRaises(CommandError):
+            self.call_command(databases=["foo"])
+
+
+class EnsureMigratedCommandTest(TestCase):
+    def call_command(self, **options):
+        stdout = StringIO()
+        call_command("ensure_migrated", stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_no_missing_migrations(self):
+        # Migrations are no longer made on startup
+        call_command("makemigrations", check=True, dry_run=True,
+                     stdout=StringIO())
+
+    def test_up_to_date(self):
+        with mock.patch(
+                "latex.management.commands.ensure_migrated.call_command"
+        ) as mock_call_command:
+            output = self.call_command()
+        self.assertIn("No migrations to apply.", output)
+        mock_call_command.assert_not_called()
+
+    @override_settings(L2P_WARM_CACHE_ON_MIGRATE=True)
+    def test_up_to_date_no_warm_cache(self):
+        with mock.patch(
+                "latex.management.commands.ensure_migrated.call_command"
+        ) as mock_call_command:
+            self.call_command()
+        mock_call_command.assert_not_called()
+
+    def test_unapplied(self):
+        with mock.patch(
+                "latex.management.commands.ensure_migrated"
+                ".get_unapplied_migrations",
+                return_value=[("latex", "0007_foo")]):
+            with self.assertRaises(CommandError) as cm:
+                self.call_command(check=True)
+            self.assertIn("latex.0007_foo", str(cm.exception))
+
+            with mock.patch(
+                    "latex.management.commands.ensure_migrated.call_command"
+            ) as mock_call_command:
+                self.call_command()
+
+        self.assertEqual(mock_call_command.call_count, 1)
+        self.assertEqual(mock_call_command.call_args[0], ("migrate", ))
@@ -0,0 +1,102 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import runpy
+import shutil
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.test import SimpleTestCase, override_settings
+
+SETTINGS_PATH = os.path.join(settings.BASE_DIR, "latex2pdf", "settings.py")
+
+
+def load_settings(**environ):
+    # Without local settings, which override DATABASES
+    environ.setdefault("L2P_LOCAL_TEST_SETTINGS", "/not/exist/local_settings.py")
+    with mock.patch.dict(os.environ, environ):
+        return runpy.run_path(SETTINGS_PATH)
+
+
+class DbBackendProfileTest(SimpleTestCase):
+    def test_mongo_default(self):
+        database = load_settings()["DATABASES"]["default"]
+        self.assertEqual(database["ENGINE"], "djongo")
+        self.assertEqual(database["CLIENT"]["maxPoolSize"], 100)
+
+    def test_mongo_pool_size(self):
+        database = load_settings(
+            L2P_MONGODB_MAX_POOL_SIZE="10")["DATABASES"]["default"]
+        self.assertEqual(database["CLIENT"]["maxPoolSize"], 10)
+
+    def test_postgres(self):
+        database = load_settings(
+            L2P_DB_BACKEND="postgres", L2P_POSTGRES_HOST="db",
+            L2P_DB_CONN_MAX_AGE="60")["DATABASES"]["default"]
+        self.assertEqual(database["ENGINE"], "django.db.backends.postgresql")
+        self.assertEqual(database["HOST"], "db")
+        self.assertEqual(database["CONN_MAX_AGE"], 60)
+
+    def test_sqlite(self):
+        database = load_settings(
+            L2P_DB_BACKEND="sqlite", L2P_SQLITE_PATH="/tmp/foo.sqlite3",
+            L2P_DB_CONN_MAX_AGE="None")["DATABASES"]["default"]
+        self.assertEqual(database["ENGINE"], "django.db.backends.sqlite3")
+        self.assertEqual(database["NAME"], "/tmp/foo.sqlite3")
+        self.assertIsNone(database["CONN_MAX_AGE"])
+
+    def test_unknown(self):
+        with self.assertRaises(ImproperlyConfigured):
+            load_settings(L2P_DB_BACKEND="mysql")
+
+
+class SqlitePragmasTest(SimpleTestCase):
+    def setUp(self):
+        working_dir = tempfile.mkdtemp(prefix="l2p_test_")
+        self.addCleanup(shutil.rmtree, working_dir)
+
+        default = connections["default"]
+        settings_dict = dict(
+            default.settings_dict, NAME=os.path.join(working_dir, "db.sqlite3"))
+        self.connection = default.__class__(settings_dict, alias="pragmas")
+        self.addCleanup(self.connection.close)
+
+    def get_pragma(self, name):
+        with self.connection.cursor() as cursor:
+            cursor.execute("PRAGMA %s" % name)
+            return cursor.fetchone()[0]
+
+    def test_wal(self):
+        self.assertEqual(self.get_pragma("journal_mode"), "wal")
+        # NORMAL
+        self.assertEqual(self.get_pragma("synchronous"), 1)
+
+    @override_settings(L2P_SQLITE_PRAGMAS={})
+    def test_no_pragmas(self):
+        self.assertEqual(self.get_pragma("journal_mode"), "delete")
@@ -0,0 +1,116 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import unittest
+import uuid
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+
+from latex.cleanup import delete_storage_files, iter_storage_files
+from latex.storage import GridFSStorage
+
+try:
+    import pymongo
+except ImportError:
+    pymongo = None
+
+# e.g., mongodb://localhost:27017
+MONGODB_URI = os.environ.get("L2P_TEST_MONGODB_URI")
+
+
+@unittest.skipUnless(
+    pymongo is not None and MONGODB_URI,
+    "pymongo and L2P_TEST_MONGODB_URI are required")
+class GridFSStorageTest(SimpleTestCase):
+    def setUp(self):
+        client = pymongo.MongoClient(MONGODB_URI)
+        database = "l2p_test_%s" % uuid.uuid4().hex
+        self.addCleanup(client.close)
+        self.addCleanup(client.drop_database, database)
+
+        self.storage = GridFSStorage(
+            database=database, client=client, chunk_size=4)
+
+    def test_save_and_open(self):
+        name = self.storage.save("a/1.pdf", ContentFile(b"0123456789"))
+        self.assertEqual(name, "a/1.pdf")
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.size(name), 10)
+        self.assertIsNotNone(self.storage.get_modified_time(name))
+
+        with self.storage.open(name) as f:
+            self.assertEqual(f.size, 10)
+            self.assertEqual(f.read(), b"0123456789")
+
+    def test_range_read(self):
+        name = self.storage.save("a/1.pdf", ContentFile(b"0123456789"))
+        with self.storage.open(name) as f:
+            f.seek(3)
+            self.assertEqual(f.read(5), b"34567")
+
+    def test_no_url(self):
+        name = self.storage.save("a/1.pdf", ContentFile(b"0123456789"))
+        with self.assertRaises(NotImplementedError):
+            self.storage.url(name)
+
+    def test_open_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open("missing.pdf")
+        self.assertFalse(self.storage.exists("missing.pdf"))
+
+    def test_open_for_writing(self):
+        with self.assertRaises(ValueError):
+            self.storage.open("a/1.pdf", "wb")
+
+    def test_latest_revision_read(self):
+        self.storage.save("a/1.pdf", ContentFile(b"old"))
+        self.storage._save("a/1.pdf", ContentFile(b"new"))
+        with self.storage.open("a/1.pdf") as f:
+            self.assertEqual(f.read(), b"new")
+
+        self.assertEqual(
+            [storage_file.name
+             for storage_file in iter_storage_files(self.storage, "a")],
+            ["a/1.pdf"])
+
+    def test_delete(self):
+        names = [
+            self.storage.save(name, ContentFile(b"0123456789"))
+            for name in ["a/1.pdf", "a/2.pdf", "a/3.pdf"]]
+        self.storage.delete(names[0])
+        delete_storage_files(self.storage, names[1:])
+
+        for name in names:
+            self.assertFalse(self.storage.exists(name))
+        self.assertEqual(self.storage.chunks.count_documents({}), 0)
+
+    def test_listdir(self):
+        for name in ["a/1.pdf", "a/b/2.pdf", "a/c/3.pdf", "4.pdf"]:
+            self.storage.save(name, ContentFile(b"x"))
+
+        self.assertEqual(self.storage.listdir("a"), (["b", "c"], ["1.pdf"]))
+        self.assertEqual(self.storage.listdir(""), (["a"], ["4.pdf"]))
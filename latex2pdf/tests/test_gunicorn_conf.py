@@ -0,0 +1,87 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import runpy
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+CONF_PATH = os.path.join(settings.BASE_DIR, "gunicorn.conf.py")
+
+
+def load_conf(cpu_count=4, **environ):
+    with mock.patch.dict(os.environ, environ):
+        with mock.patch("os.sched_getaffinity", create=True,
+                        return_value=set(range(cpu_count))):
+            with mock.patch("builtins.open", side_effect=OSError):
+                # No cgroup cpu limit
+                return runpy.run_path(CONF_PATH)
+
+
+class GunicornConfTest(SimpleTestCase):
+    def test_defaults(self):
+        conf = load_conf(cpu_count=4)
+        self.assertEqual(conf["worker_class"], "gthread")
+        self.assertEqual(conf["workers"], 5)
+        self.assertEqual(conf["threads"], 4)
+        self.assertEqual(conf["max_requests"], 1000)
+        self.assertEqual(conf["max_requests_jitter"], 100)
+        self.assertTrue(conf["preload_app"])
+        self.assertEqual(conf["bind"], "0.0.0.0:8011")
+
+    def test_environ(self):
+        conf = load_conf(
+            L2P_GUNICORN_WORKERS="2", L2P_GUNICORN_THREADS="8",
+            L2P_GUNICORN_MAX_REQUESTS="500", L2P_GUNICORN_TIMEOUT="60")
+        self.assertEqual(conf["workers"], 2)
+        self.assertEqual(conf["threads"], 8)
+        self.assertEqual(conf["max_requests_jitter"], 50)
+        self.assertEqual(conf["timeout"], 60)
+
+    def test_bad_environ(self):
+        with self.assertRaises(ValueError):
+            load_conf(L2P_GUNICORN_WORKERS="many")
+
+    def test_cgroup_cpu_limit(self):
+        conf = load_conf()
+
+        with mock.patch(
+                "builtins.open", mock.mock_open(read_data="200000 100000\n")):
+            self.assertEqual(conf["get_cgroup_cpu_limit"](), 2)
+        with mock.patch(
+                "builtins.open", mock.mock_open(read_data="max 100000\n")):
+            self.assertIsNone(conf["get_cgroup_cpu_limit"]())
+
+    def test_recycle_on_peak_rss(self):
+        worker = mock.MagicMock(alive=True)
+        conf = load_conf()
+        conf["post_request"](worker, None, {}, None)
+        self.assertTrue(worker.alive)
+
+        conf = load_conf(L2P_GUNICORN_MAX_WORKER_RSS_MB="1")
+        conf["post_request"](worker, None, {}, None)
+        self.assertFalse(worker.alive)
@@ -0,0 +1,232 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, capture_on_commit_callbacks, create_latex_project,
+    create_latex_collection)
+from latex import metrics
+from latex.cleanup import get_cleanup_queue
+
+
+class MetricTypesTest(SimpleTestCase):
+    def setUp(self):
+        self.counter = metrics.Counter(
+            "test_counter_total", "A counter.", ("field",))
+        self.histogram = metrics.Histogram(
+            "test_histogram", "A histogram.", ("view",), buckets=(0.1, 1))
+        self.addCleanup(metrics.REGISTRY.remove, self.counter)
+        self.addCleanup(metrics.REGISTRY.remove, self.histogram)
+
+    def test_counter(self):
+        self.counter.inc(field="pdf")
+        self.counter.inc(2, field="pdf")
+        self.counter.inc(field='a"b')
+        self.assertEqual(self.counter.get(field="pdf"), 3)
+
+        lines = self.counter.render()
+        self.assertIn("# TYPE test_counter_total counter", lines)
+        self.assertIn('test_counter_total{field="pdf"} 3', lines)
+        self.assertIn('test_counter_total{field="a\\"b"} 1', lines)
+
+    def test_histogram(self):
+        self.histogram.observe(0.05, view="detail")
+        self.histogram.observe(0.5, view="detail")
+        self.histogram.observe(5, view="detail")
+        with self.histogram.time(view="detail"):
+            pass
+        self.assertEqual(self.histogram.get_count(view="detail"), 4)
+
+        lines = self.histogram.render()
+        self.assertIn('test_histogram_bucket{view="detail",le="0.1"} 2', lines)
+        self.assertIn('test_histogram_bucket{view="detail",le="1"} 3', lines)
+        self.assertIn('test_histogram_bucket{view="detail",le="+Inf"} 4', lines)
+        self.assertIn('test_histogram_count{view="detail"} 4', lines)
+
+    @override_settings(L2P_METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.counter.inc(field="pdf")
+        self.histogram.observe(0.05, view="detail")
+        self.assertEqual(self.counter.get(field="pdf"), 0)
+        self.assertEqual(self.histogram.get_count(view="detail"), 0)
+
+
+class MultiprocMetricsTest(SimpleTestCase):
+    def setUp(self):
+        self.counter = metrics.Counter(
+            "test_mp_counter_total", "A counter.", ("field",))
+        self.histogram = metrics.Histogram(
+            "test_mp_histogram", "A histogram.", ("view",), buckets=(0.1, 1))
+        self.addCleanup(metrics.REGISTRY.remove, self.counter)
+        self.addCleanup(metrics.REGISTRY.remove, self.histogram)
+
+        self.multiproc_dir = tempfile.mkdtemp(prefix="l2p_test_metrics_")
+        self.addCleanup(shutil.rmtree, self.multiproc_dir, True)
+        settings_override = override_settings(
+            L2P_METRICS_MULTIPROC_DIR=self.multiproc_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def update(self):
+        self.counter.inc(2, field="pdf")
+        self.histogram.observe(0.05, view="detail")
+
+    def test_aggregated_over_processes(self):
+        self.update()
+
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            # The child
+            exit_code = 1
+            try:
+                self.counter.reset()
+                self.histogram.reset()
+                self.update()
+                self.counter.inc(field="image")
+                metrics.SNAPSHOT_WRITER.write()
+                exit_code = 0
+            finally:
+                os._exit(exit_code)
+
+        __, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+
+        rendered = metrics.render_metrics()
+        self.assertIn('test_mp_counter_total{field="pdf"} 4', rendered)
+        self.assertIn('test_mp_counter_total{field="image"} 1', rendered)
+        self.assertIn(
+            'test_mp_histogram_bucket{view="detail",le="0.1"} 2', rendered)
+        self.assertIn('test_mp_histogram_count{view="detail"} 2', rendered)
+
+        # Values of the current process are not counted twice
+        metrics.SNAPSHOT_WRITER.write()
+        self.assertIn(
+            'test_mp_counter_total{field="pdf"} 4', metrics.render_metrics())
+
+        # The values of this process in memory are not changed
+        self.assertEqual(self.counter.get(field="pdf"), 2)
+        self.assertEqual(self.histogram.get_count(view="detail"), 1)
+
+    def test_bad_snapshot_skipped(self):
+        self.update()
+        with open(os.path.join(self.multiproc_dir, "1-bad.json"), "w") as f:
+            f.write("{")
+
+        rendered = metrics.render_metrics()
+        self.assertIn('test_mp_counter_total{field="pdf"} 2', rendered)
+
+    def test_multiproc_dir_not_created_yet(self):
+        shutil.rmtree(self.multiproc_dir)
+        self.update()
+        self.assertIn(
+            'test_mp_counter_total{field="pdf"} 2', metrics.render_metrics())
+
+
+@override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=True)
+class CacheMetricsTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        metrics.reset_metrics()
+        self.addCleanup(metrics.reset_metrics)
+
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.test_user)
+        self.project = create_latex_project(self.test_user)
+        self.collection = create_latex_collection(self.project, "hash_0")
+        create_latex_collection(
+            self.project, "hash_errored", compile_error="some error")
+
+    def get_detail(self, tex_key):
+        return self.client.get(
+            reverse("detail", args=(tex_key,)) + "?fields=pdf")
+
+    def test_fill_on_save(self):
+        self.assertEqual(
+            metrics.CACHE_FILLS.get(field="pdf", view="pdf_save"), 1)
+
+    def test_hit_miss_negative_hit(self):
+        self.get_detail("hash_0")
+        self.assertEqual(
+            metrics.CACHE_HITS.get(field="pdf", view="detail"), 1)
+
+        self.test_cache.clear()
+        self.get_detail("hash_0")
+        self.assertEqual(
+            metrics.CACHE_MISSES.get(field="pdf", view="detail"), 1)
+        self.assertEqual(
+            metrics.CACHE_FILLS.get(field="pdf", view="detail"), 1)
+
+        # not cached yet
+        self.get_detail("hash_errored")
+        self.assertEqual(
+            metrics.CACHE_FILLS.get(field="compile_error", view="detail"), 1)
+        self.get_detail("hash_errored")
+        self.assertEqual(
+            metrics.CACHE_NEGATIVE_HITS.get(field="pdf", view="detail"), 1)
+
+        self.assertEqual(
+            metrics.CACHE_LOOKUP_SECONDS.get_count(view="detail", outcome="hit"),
+            2)
+        self.assertEqual(
+            metrics.CACHE_LOOKUP_SECONDS.get_count(
+                view="detail", outcome="miss"), 2)
+
+    @override_settings(L2P_CACHE_MAX_BYTES=1)
+    def test_oversize_skip(self):
+        self.test_cache.clear()
+        self.get_detail("hash_0")
+        self.assertEqual(
+            metrics.CACHE_OVERSIZE_SKIPS.get(field="pdf", view="detail"), 1)
+        self.assertEqual(
+            metrics.CACHE_FILLS.get(field="pdf", view="detail"), 0)
+
+    def test_eviction(self):
+        with capture_on_commit_callbacks(execute=True):
+            self.collection.entries.all().delete()
+        get_cleanup_queue().join()
+        self.assertEqual(
+            metrics.CACHE_EVICTIONS.get(field="pdf", view="pdf_delete"), 1)
+
+    def test_metrics_view(self):
+        self.get_detail("hash_0")
+        resp = self.client.get(reverse("metrics"))
+        self.assertEqual(resp.status_code, 403)
+
+        self.client.force_authenticate(user=self.superuser)
+        resp = self.client.get(reverse("metrics"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(
+            resp, 'l2p_cache_hits_total{field="pdf",view="detail"} 1')
+
+        with override_settings(L2P_METRICS_ENABLED=False):
+            resp = self.client.get(reverse("metrics"))
+        self.assertEqual(resp.status_code, 404)
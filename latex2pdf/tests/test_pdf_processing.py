@@ -0,0 +1,154 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+
+from django.test import SimpleTestCase
+
+from latex.converter import linearize_pdf, optimize_pdf, post_process_pdf
+
+
+def make_pdf(path, n_pages=3):
+    # Saved without compression or garbage collection
+    import fitz
+    doc = fitz.open()
+    for i in range(n_pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), "Page %d " % i * 20)
+    doc.save(path)
+    doc.close()
+
+
+def get_pdf_texts(path):
+    import fitz
+    doc = fitz.open(path)
+    texts = [page.get_text() for page in doc]
+    doc.close()
+    return texts
+
+
+class LinearizePdfTest(SimpleTestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp(prefix="l2p_test_")
+        self.addCleanup(shutil.rmtree, self.working_dir)
+        self.pdf_path = os.path.join(self.working_dir, "main.pdf")
+        make_pdf(self.pdf_path)
+
+    def test_qpdf_not_available(self):
+        with open(self.pdf_path, "rb") as f:
+            content = f.read()
+
+        with mock.patch("shutil.which", return_value=None):
+            self.assertFalse(linearize_pdf(self.pdf_path))
+
+        with open(self.pdf_path, "rb") as f:
+            self.assertEqual(f.read(), content)
+
+    def test_qpdf_failed(self):
+        with mock.patch("shutil.which", return_value="qpdf"), mock.patch(
+                "latex.converter.popen_wrapper") as mock_popen:
+            mock_popen.return_value = ("", "some error", 2)
+            self.assertFalse(linearize_pdf(self.pdf_path))
+
+        self.assertEqual(os.listdir(self.working_dir), ["main.pdf"])
+
+    @skipUnless(shutil.which("qpdf"), "qpdf is not installed")
+    def test_linearize(self):
+        self.assertTrue(linearize_pdf(self.pdf_path))
+        self.assertEqual(os.listdir(self.working_dir), ["main.pdf"])
+        with open(self.pdf_path, "rb") as f:
+            self.assertIn(b"/Linearized", f.read(1024))
+
+
+class OptimizePdfTest(SimpleTestCase):
+    def setUp(self):
+        self.working_dir = tempfile.mkdtemp(prefix="l2p_test_")
+        self.addCleanup(shutil.rmtree, self.working_dir)
+        self.pdf_path = os.path.join(self.working_dir, "main.pdf")
+        make_pdf(self.pdf_path)
+
+    def test_optimize(self):
+        original_size = os.path.getsize(self.pdf_path)
+        original_texts = get_pdf_texts(self.pdf_path)
+
+        self.assertTrue(optimize_pdf(self.pdf_path))
+        self.assertLess(os.path.getsize(self.pdf_path), original_size)
+        self.assertEqual(get_pdf_texts(self.pdf_path), original_texts)
+        self.assertEqual(os.listdir(self.working_dir), ["main.pdf"])
+
+    def test_optimize_not_smaller_untouched(self):
+        self.assertTrue(optimize_pdf(self.pdf_path))
+        with open(self.pdf_path, "rb") as f:
+            content = f.read()
+
+        self.assertFalse(optimize_pdf(self.pdf_path))
+        with open(self.pdf_path, "rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(self.working_dir), ["main.pdf"])
+
+    def test_optimize_broken_pdf(self):
+        with open(self.pdf_path, "wb") as f:
+            f.write(b"not a pdf")
+        self.assertFalse(optimize_pdf(self.pdf_path))
+        self.assertEqual(os.listdir(self.working_dir), ["main.pdf"])
+
+    def test_optimize_failed_untouched(self):
+        with open(self.pdf_path, "rb") as f:
+            content = f.read()
+
+        def save(path, **kwargs):
+            with open(path, "wb") as f:
+                f.write(b"partial")
+            raise ValueError("some error")
+
+        with mock.patch("fitz.Document.save", side_effect=save):
+            with self.assertLogs("latex.converter", "ERROR") as logs:
+                self.assertFalse(optimize_pdf(self.pdf_path))
+        self.assertIn("some error", logs.output[0])
+
+        with open(self.pdf_path, "rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(self.working_dir), ["main.pdf"])
+
+    def test_post_process(self):
+        original_size = os.path.getsize(self.pdf_path)
+        with mock.patch("latex.converter.linearize_pdf") as mock_linearize:
+            self.assertEqual(
+                post_process_pdf(self.pdf_path),
+                (original_size, os.path.getsize(self.pdf_path)))
+            mock_linearize.assert_called_once_with(self.pdf_path)
+        self.assertLess(os.path.getsize(self.pdf_path), original_size)
+
+    def test_post_process_disabled(self):
+        original_size = os.path.getsize(self.pdf_path)
+        with mock.patch("latex.converter.linearize_pdf") as mock_linearize:
+            self.assertEqual(
+                post_process_pdf(
+                    self.pdf_path, optimize=False, linearize=False),
+                (original_size, original_size))
+            mock_linearize.assert_not_called()
@@ -0,0 +1,239 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, create_latex_project, create_latex_collection,
+    get_fake_pdf_content)
+from latex.models import LatexPdf
+
+
+class ServePdfTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = create_latex_project(self.test_user, is_private=False)
+        create_latex_collection(self.project, "hash_0")
+        self.pdf = LatexPdf.objects.get(collection__zip_file_hash="hash_0")
+
+    def test_url(self):
+        self.assertEqual(
+            self.pdf.get_absolute_url(),
+            reverse("pdf-download", kwargs={
+                "zip_file_hash": "hash_0", "pdf_id": self.pdf.pk,
+                "filename": "main.pdf"}))
+        self.assertIn("hash_0", self.pdf.get_absolute_url())
+
+    def test_get(self):
+        resp = self.c.get(self.pdf.get_absolute_url())
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "application/pdf")
+        self.assertEqual(
+            b"".join(resp.streaming_content), get_fake_pdf_content("main.pdf"))
+        self.assertEqual(resp["ETag"], '"hash_0-%d"' % self.pdf.pk)
+        self.assertIn("immutable", resp["Cache-Control"])
+        self.assertIn("public", resp["Cache-Control"])
+        self.assertIn("max-age=31536000", resp["Cache-Control"])
+
+    def test_if_none_match(self):
+        resp = self.c.get(
+            self.pdf.get_absolute_url(),
+            HTTP_IF_NONE_MATCH='"hash_0-%d"' % self.pdf.pk)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b"")
+        self.assertIn("immutable", resp["Cache-Control"])
+
+    def test_if_modified_since(self):
+        resp = self.c.get(
+            self.pdf.get_absolute_url(),
+            HTTP_IF_MODIFIED_SINCE=http_date(
+                self.pdf.collection.creation_time.timestamp() + 10))
+        self.assertEqual(resp.status_code, 304)
+
+    def test_wrong_hash_or_filename(self):
+        for kwargs in [{"zip_file_hash": "hash_1"}, {"filename": "foo.pdf"}]:
+            url_kwargs = {"zip_file_hash": "hash_0", "pdf_id": self.pdf.pk,
+                          "filename": "main.pdf"}
+            url_kwargs.update(kwargs)
+            with self.subTest(kwargs=kwargs):
+                resp = self.c.get(reverse("pdf-download", kwargs=url_kwargs))
+                self.assertEqual(resp.status_code, 404)
+
+    def test_file_missing(self):
+        self.pdf.pdf.storage.delete(self.pdf.pdf.name)
+        resp = self.c.get(self.pdf.get_absolute_url())
+        self.assertEqual(resp.status_code, 404)
+
+    def test_private(self):
+        self.project.is_private = True
+        self.project.save()
+
+        resp = self.c.get(self.pdf.get_absolute_url())
+        self.assertEqual(resp.status_code, 403)
+
+        with self.temporarily_switch_to_user(self.test_user):
+            resp = self.c.get(self.pdf.get_absolute_url())
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("private", resp["Cache-Control"])
+        self.assertNotIn("public", resp["Cache-Control"])
+
+    def test_project_detail_links(self):
+        resp = self.c.get(reverse("project-detail", args=(self.project.identifier,)))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, "?file=%s" % self.pdf.get_absolute_url())
+
+    @override_settings(L2P_PDF_X_ACCEL_REDIRECT_PREFIX="/protected-media/")
+    def test_x_accel_redirect(self):
+        resp = self.c.get(self.pdf.get_absolute_url())
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, b"")
+        self.assertEqual(
+            resp["X-Accel-Redirect"], "/protected-media/" + self.pdf.pdf.name)
+        self.assertEqual(resp["Content-Type"], "application/pdf")
+        self.assertIn("immutable", resp["Cache-Control"])
+
+    @override_settings(L2P_PDF_X_ACCEL_REDIRECT_PREFIX="/protected-media/")
+    def test_x_accel_redirect_private_not_allowed(self):
+        self.project.is_private = True
+        self.project.save()
+        resp = self.c.get(self.pdf.get_absolute_url())
+        self.assertEqual(resp.status_code, 403)
+        self.assertFalse(resp.has_header("X-Accel-Redirect"))
+
+    @override_settings(
+        L2P_PDF_X_ACCEL_REDIRECT_PREFIX="/protected-media/",
+        L2P_PDF_REDIRECT_TO_STORAGE_URL=True)
+    def test_not_local_storage_redirect_to_storage_url(self):
+        with mock.patch(
+                "django.core.files.storage.FileSystemStorage.path"
+        ) as mock_path, mock.patch(
+                "django.core.files.storage.FileSystemStorage.url"
+        ) as mock_url:
+            mock_path.side_effect = NotImplementedError()
+            mock_url.return_value = "https://s3.example.com/foo.pdf?sig=bar"
+            resp = self.c.get(self.pdf.get_absolute_url())
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp["Location"], "https://s3.example.com/foo.pdf?sig=bar")
+        self.assertFalse(resp.has_header("X-Accel-Redirect"))
+
+        # the signed url expires, so the redirect is not cached as immutable
+        self.assertFalse(resp.has_header("ETag"))
+        self.assertFalse(resp.has_header("Last-Modified"))
+        self.assertNotIn("immutable", resp["Cache-Control"])
+        self.assertIn("private", resp["Cache-Control"])
+        self.assertIn("max-age=60", resp["Cache-Control"])
+
+    @override_settings(
+        L2P_PDF_REDIRECT_TO_STORAGE_URL=True, L2P_PDF_REDIRECT_MAX_AGE=0)
+    def test_redirect_to_storage_url_no_store(self):
+        with mock.patch(
+                "django.core.files.storage.FileSystemStorage.url"
+        ) as mock_url:
+            mock_url.return_value = "https://s3.example.com/foo.pdf?sig=bar"
+            resp = self.c.get(self.pdf.get_absolute_url())
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp["Cache-Control"], "no-store")
+
+    @override_settings(L2P_PDF_REDIRECT_TO_STORAGE_URL=True)
+    def test_storage_without_url_streamed(self):
+        with mock.patch(
+                "django.core.files.storage.FileSystemStorage.url"
+        ) as mock_url:
+            # e.g., GridFS
+            mock_url.side_effect = NotImplementedError()
+            resp = self.c.get(self.pdf.get_absolute_url())
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            b"".join(resp.streaming_content), get_fake_pdf_content("main.pdf"))
+        self.assertIn("immutable", resp["Cache-Control"])
+
+    def test_media_root_not_served(self):
+        resp = self.c.get("/media/" + self.pdf.pdf.name)
+        self.assertEqual(resp.status_code, 404)
+
+    def get_content(self):
+        return get_fake_pdf_content("main.pdf")
+
+    def test_accept_ranges(self):
+        resp = self.c.get(self.pdf.get_absolute_url())
+        self.assertEqual(resp["Accept-Ranges"], "bytes")
+
+    def test_range(self):
+        content = self.get_content()
+        for range_header, expected_range in [
+                ("bytes=0-4", (0, 4)),
+                ("bytes=5-", (5, len(content) - 1)),
+                ("bytes=-3", (len(content) - 3, len(content) - 1)),
+                ("bytes=2-100000", (2, len(content) - 1))]:
+            with self.subTest(range_header=range_header):
+                resp = self.c.get(
+                    self.pdf.get_absolute_url(), HTTP_RANGE=range_header)
+                self.assertEqual(resp.status_code, 206)
+                start, end = expected_range
+                self.assertEqual(
+                    b"".join(resp.streaming_content), content[start:end + 1])
+                self.assertEqual(
+                    resp["Content-Range"],
+                    "bytes %d-%d/%d" % (start, end, len(content)))
+                self.assertEqual(resp["Content-Length"], str(end - start + 1))
+
+    def test_range_not_satisfiable(self):
+        for range_header in ["bytes=100000-", "bytes=5-2", "bytes=-0"]:
+            with self.subTest(range_header=range_header):
+                resp = self.c.get(
+                    self.pdf.get_absolute_url(), HTTP_RANGE=range_header)
+                self.assertEqual(resp.status_code, 416)
+                self.assertEqual(
+                    resp["Content-Range"], "bytes */%d" % len(self.get_content()))
+                self.assertFalse(resp.has_header("ETag"))
+                self.assertFalse(resp.has_header("Cache-Control"))
+
+    def test_range_ignored(self):
+        for range_header in ["bytes=0-1,3-4", "lines=1-2", "bytes=-"]:
+            with self.subTest(range_header=range_header):
+                resp = self.c.get(
+                    self.pdf.get_absolute_url(), HTTP_RANGE=range_header)
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(
+                    b"".join(resp.streaming_content), self.get_content())
+
+    def test_if_range(self):
+        etag = '"hash_0-%d"' % self.pdf.pk
+        resp = self.c.get(
+            self.pdf.get_absolute_url(), HTTP_RANGE="bytes=0-4",
+            HTTP_IF_RANGE=etag)
+        self.assertEqual(resp.status_code, 206)
+
+        resp = self.c.get(
+            self.pdf.get_absolute_url(), HTTP_RANGE="bytes=0-4",
+            HTTP_IF_RANGE='"another-etag"')
+        self.assertEqual(resp.status_code, 200)
@@ -0,0 +1,171 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, create_latex_project, get_fake_pdf_content,
+    improperly_configured_cache_patch)
+from latex.api import get_field_cache_key
+from latex.models import LatexProject, LatexCollection, LatexPdf
+from latex.persistence import (
+    CompiledPdf, delete_stored_files, save_compile_result)
+
+
+@override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=True)
+class SaveCompileResultTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = create_latex_project(self.test_user)
+
+        self.working_dir = tempfile.mkdtemp(prefix="l2p_test_")
+        self.addCleanup(shutil.rmtree, self.working_dir)
+
+    def get_compiled_pdfs(self, n_pdfs=3):
+        compiled_pdfs = []
+        for i in range(n_pdfs):
+            name = "file%d.pdf" % i
+            path = os.path.join(self.working_dir, name)
+            content = get_fake_pdf_content(name)
+            with open(path, "wb") as f:
+                f.write(content)
+            compiled_pdfs.append(CompiledPdf(
+                name=name, path=path, mediabox=[0, 0, 595, 842],
+                size=len(content), original_size=len(content) + 10))
+        return compiled_pdfs
+
+    def get_stored_files(self):
+        storage = LatexPdf._meta.get_field("pdf").storage
+        stored_files = []
+        for root, __, files in os.walk(storage.location):
+            stored_files.extend(files)
+        return stored_files
+
+    def test_save_pdfs(self):
+        compiled_pdfs = self.get_compiled_pdfs()
+
+        collection = save_compile_result(self.project, "hash_0", compiled_pdfs)
+        self.assertIsNone(collection.compile_error)
+
+        pdfs = list(collection.entries.order_by("name"))
+        self.assertEqual([pdf.name for pdf in pdfs],
+                         ["file0.pdf", "file1.pdf", "file2.pdf"])
+        for pdf, compiled_pdf in zip(pdfs, compiled_pdfs):
+            with pdf.pdf.open("rb") as f:
+                self.assertEqual(
+                    f.read(), get_fake_pdf_content(compiled_pdf.name))
+            self.assertEqual(pdf.size, compiled_pdf.size)
+            self.assertEqual(pdf.mediabox, [0, 0, 595, 842])
+
+        project = LatexProject.objects.get(pk=self.project.pk)
+        self.assertEqual(project.latest_collection, collection)
+        self.assertEqual(project.n_collections, 1)
+        self.assertEqual(
+            project.total_bytes, sum(pdf.size for pdf in compiled_pdfs))
+
+        self.assertIsNotNone(
+            self.test_cache.get(get_field_cache_key("hash_0", "pdf")))
+
+    def test_pdfs_inserted_in_one_query(self):
+        compiled_pdfs = self.get_compiled_pdfs(n_pdfs=10)
+        with mock.patch(
+                "latex.persistence.LatexPdf.objects.bulk_create",
+                wraps=LatexPdf.objects.bulk_create) as mock_bulk_create:
+            save_compile_result(self.project, "hash_0", compiled_pdfs)
+            self.assertEqual(mock_bulk_create.call_count, 1)
+
+        self.assertEqual(LatexPdf.objects.count(), 10)
+
+    def test_compile_error(self):
+        collection = save_compile_result(
+            self.project, "hash_0", compile_error="some error")
+        self.assertEqual(
+            LatexCollection.objects.get().compile_error, "some error")
+        self.assertEqual(collection.entries.count(), 0)
+
+        project = LatexProject.objects.get(pk=self.project.pk)
+        self.assertIsNone(project.latest_successful_collection)
+        self.assertEqual(project.n_collections, 1)
+
+    def test_failure_cleans_up_stored_files(self):
+        compiled_pdfs = self.get_compiled_pdfs()
+
+        with mock.patch(
+                "latex.persistence.LatexPdf.objects.bulk_create",
+                side_effect=IntegrityError("foo")):
+            with self.assertRaises(IntegrityError):
+                save_compile_result(self.project, "hash_0", compiled_pdfs)
+
+        self.assertEqual(LatexCollection.objects.count(), 0)
+        self.assertEqual(LatexPdf.objects.count(), 0)
+        self.assertEqual(self.get_stored_files(), [])
+        self.assertIsNone(
+            self.test_cache.get(get_field_cache_key("hash_0", "pdf")))
+
+    def test_storage_failure_cleans_up_stored_files(self):
+        compiled_pdfs = self.get_compiled_pdfs()
+        os.remove(compiled_pdfs[-1].path)
+
+        with self.assertRaises(FileNotFoundError):
+            save_compile_result(self.project, "hash_0", compiled_pdfs)
+
+        self.assertEqual(LatexCollection.objects.count(), 0)
+        self.assertEqual(self.get_stored_files(), [])
+
+    def test_concurrent_compile_keeps_winner_files(self):
+        winner = save_compile_result(
+            self.project, "hash_0", self.get_compiled_pdfs())
+        stored_files = sorted(self.get_stored_files())
+        self.assertEqual(len(stored_files), 3)
+
+        with mock.patch(
+                "latex.persistence.store_pdf_files") as mock_store:
+            collection = save_compile_result(
+                self.project, "hash_0", self.get_compiled_pdfs())
+            mock_store.assert_not_called()
+
+        self.assertEqual(collection.pk, winner.pk)
+        self.assertEqual(LatexCollection.objects.count(), 1)
+        self.assertEqual(LatexPdf.objects.count(), 3)
+        self.assertEqual(sorted(self.get_stored_files()), stored_files)
+
+    def test_failure_does_not_delete_saved_pdf_files(self):
+        save_compile_result(self.project, "hash_0", self.get_compiled_pdfs())
+        names = list(LatexPdf.objects.values_list("pdf", flat=True))
+
+        delete_stored_files(names)
+        self.assertEqual(len(self.get_stored_files()), 3)
+
+    def test_cache_not_configured(self):
+        compiled_pdfs = self.get_compiled_pdfs()
+        with improperly_configured_cache_patch():
+            save_compile_result(self.project, "hash_0", compiled_pdfs)
+        self.assertEqual(LatexPdf.objects.count(), 3)
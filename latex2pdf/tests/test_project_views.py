@@ -0,0 +1,225 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import now
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, create_latex_project, create_latex_collection)
+from latex.models import LatexProject, LatexCollection, LatexPdf
+
+
+# The session engine with a shared cache, see settings.py
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cached_db")
+class ProjectListViewTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.c.force_login(self.test_user)
+
+    def create_projects(self, n, n_collections=2):
+        for i in range(n):
+            project = create_latex_project(
+                self.test_user, identifier="project-%03d" % i)
+            for j in range(n_collections):
+                create_latex_collection(
+                    project, "hash_%d_%d" % (i, j),
+                    creation_time=now() - timedelta(days=j))
+
+    def get_list(self, **kwargs):
+        return self.c.get(reverse("project-list"), kwargs)
+
+    def test_revision_info(self):
+        self.create_projects(1, n_collections=3)
+        create_latex_project(self.test_user, identifier="empty-project")
+        create_latex_project(self.superuser, identifier="others-project")
+
+        resp = self.get_list()
+        self.assertEqual(resp.status_code, 200)
+
+        projects = list(resp.context["object_list"])
+        self.assertEqual(
+            [p.identifier for p in projects], ["empty-project", "project-000"])
+
+        self.assertEqual(projects[0].get_collections_info(), (0, None))
+
+        self.assertEqual(
+            projects[1].get_collections_info(),
+            (3, LatexCollection.objects.get(zip_file_hash="hash_0_0").creation_time))
+
+    def test_constant_queries(self):
+        # user, count for pagination, and projects with the latest
+        # collections (the session is cached)
+        self.create_projects(2)
+        with self.assertNumQueries(3):
+            self.get_list()
+
+        for i in range(2, 10):
+            project = create_latex_project(
+                self.test_user, identifier="project-%03d" % i)
+            create_latex_collection(project, "hash_%d" % i)
+
+        with self.assertNumQueries(3):
+            self.get_list()
+
+    @override_settings(L2P_PROJECT_LIST_PAGE_SIZE=3)
+    def test_paginated(self):
+        self.create_projects(7, n_collections=1)
+
+        resp = self.get_list()
+        self.assertEqual(len(resp.context["object_list"]), 3)
+        self.assertTrue(resp.context["is_paginated"])
+        self.assertContains(resp, "?page=2")
+
+        resp = self.get_list(page=3)
+        self.assertEqual(
+            [p.identifier for p in resp.context["object_list"]],
+            ["project-006"])
+
+
+class ProjectCollectionStatsTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = create_latex_project(self.test_user)
+
+    def refresh_project(self):
+        self.project = LatexProject.objects.get(pk=self.project.pk)
+        return self.project
+
+    def test_no_collections(self):
+        self.assertIsNone(self.project.latest_collection)
+        self.assertIsNone(self.project.latest_successful_collection)
+        self.assertEqual(self.project.n_collections, 0)
+        self.assertEqual(self.project.total_bytes, 0)
+
+    def test_create_collections(self):
+        old = create_latex_collection(
+            self.project, "hash_old", creation_time=now() - timedelta(days=1))
+        LatexPdf.objects.filter(collection=old).update(size=100)
+        self.project.update_collection_stats()
+        create_latex_collection(self.project, "hash_errored", compile_error="error")
+
+        project = self.refresh_project()
+        self.assertEqual(project.latest_collection.zip_file_hash, "hash_errored")
+        self.assertEqual(project.latest_successful_collection, old)
+        self.assertEqual(project.n_collections, 2)
+        self.assertEqual(project.total_bytes, 100)
+
+    def test_pdf_size(self):
+        collection = create_latex_collection(self.project, "hash_0")
+        pdf = LatexPdf.objects.create(
+            project=self.project, collection=collection, name="another.pdf",
+            size=200)
+        self.assertEqual(self.refresh_project().total_bytes, 200)
+
+        pdf.delete()
+        self.assertEqual(self.refresh_project().total_bytes, 0)
+
+    def test_delete_collection(self):
+        old = create_latex_collection(
+            self.project, "hash_old", creation_time=now() - timedelta(days=1))
+        new = create_latex_collection(self.project, "hash_new")
+        self.assertEqual(self.refresh_project().latest_collection, new)
+
+        new.delete()
+        project = self.refresh_project()
+        self.assertEqual(project.latest_collection, old)
+        self.assertEqual(project.latest_successful_collection, old)
+        self.assertEqual(project.n_collections, 1)
+
+        old.delete()
+        project = self.refresh_project()
+        self.assertIsNone(project.latest_collection)
+        self.assertEqual(project.n_collections, 0)
+
+    def test_delete_project_no_stats_update(self):
+        for i in range(3):
+            create_latex_collection(self.project, "hash_%d" % i)
+
+        with mock.patch(
+                "latex.models.LatexProject.update_collection_stats"
+        ) as mock_update:
+            self.project.delete()
+            mock_update.assert_not_called()
+
+        self.assertEqual(LatexCollection.objects.count(), 0)
+
+        from latex.receivers import get_deleting_project_ids
+        self.assertEqual(get_deleting_project_ids(), set())
+
+
+# The session engine with a shared cache, see settings.py
+@override_settings(SESSION_ENGINE="django.contrib.sessions.backends.cached_db")
+class ViewCollectionTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.c.force_login(self.test_user)
+        self.project = create_latex_project(self.test_user)
+        create_latex_collection(
+            self.project, "hash_old", creation_time=now() - timedelta(days=1),
+            pdf_names=("a.pdf", "b.pdf"))
+        create_latex_collection(
+            self.project, "hash_new", pdf_names=("a.pdf", "b.pdf", "c.pdf"))
+
+    def test_latest(self):
+        # user, project, the latest collection (via the repository), and
+        # pdfs (the session is cached)
+        with self.assertNumQueries(4):
+            resp = self.c.get(
+                reverse("project-detail", args=(self.project.identifier,)))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context["collection"].zip_file_hash, "hash_new")
+        self.assertEqual(len(resp.context["pdfs"]), 3)
+
+    def test_old_version(self):
+        with self.assertNumQueries(3):
+            resp = self.c.get(reverse(
+                "view-collection", args=(self.project.identifier, "hash_old")))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.context["collection"].zip_file_hash, "hash_old")
+        self.assertEqual(len(resp.context["pdfs"]), 2)
+
+    def test_not_found(self):
+        resp = self.c.get(reverse(
+            "view-collection", args=(self.project.identifier, "hash_foo")))
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.c.get(reverse("project-detail", args=("foo",)))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_no_collections(self):
+        project = create_latex_project(self.test_user, identifier="empty")
+        resp = self.c.get(reverse("project-detail", args=(project.identifier,)))
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNone(resp.context["collection"])
+
+    def test_private(self):
+        with self.temporarily_switch_to_user(self.superuser):
+            resp = self.c.get(
+                reverse("project-detail", args=(self.project.identifier,)))
+        self.assertEqual(resp.status_code, 403)
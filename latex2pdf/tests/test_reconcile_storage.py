@@ -0,0 +1,171 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command, CommandError
+from django.test import TestCase
+from django.utils.timezone import now
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, capture_on_commit_callbacks, create_latex_project,
+    create_latex_collection)
+from latex.cleanup import (
+    StorageFile, get_cleanup_queue, iter_storage_files)
+from latex.management.commands.reconcile_storage import (
+    ensure_sorted, iter_pdf_rows, merge_join)
+from latex.models import LatexCollection, LatexPdf
+
+
+class MergeJoinTest(TestCase):
+    def test_merge_join(self):
+        files = [StorageFile(name, 1, None) for name in ["a", "b", "d"]]
+        rows = [("b", 1, 1, 1), ("b", 2, 1, 1), ("c", 3, 1, 1)]
+
+        result = [
+            (name, storage_file is not None, [row[1] for row in rows])
+            for name, storage_file, rows in merge_join(iter(files), iter(rows))]
+        self.assertEqual(result, [
+            ("a", True, []), ("b", True, [1, 2]), ("c", False, [3]),
+            ("d", True, [])])
+
+    def test_ensure_sorted(self):
+        with self.assertRaises(CommandError):
+            list(ensure_sorted([("b", ), ("a", )], "Storage"))
+
+
+class ReconcileStorageTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = LatexPdf._meta.get_field("pdf").storage
+        old_time = now() - timedelta(days=1)
+
+        self.project = create_latex_project(self.test_user)
+        self.good = create_latex_collection(
+            self.project, "hash_good", pdf_names=("a.pdf", "b.pdf"))
+        self.broken = create_latex_collection(
+            self.project, "hash_broken", pdf_names=("a.pdf", "b.pdf"))
+        self.empty = create_latex_collection(
+            self.project, "hash_empty", pdf_names=(), creation_time=old_time)
+
+        # A crashed compile
+        self.missing_pdf = self.broken.entries.get(name="a.pdf")
+        self.storage.delete(self.missing_pdf.pdf.name)
+
+        # A file of a deleted collection, and one of a running compile
+        self.orphan_name = self.storage.save(
+            "l2p_pdf/1/foo/hash_gone/a.pdf", ContentFile(b"orphan"))
+        timestamp = time.time() - 86400
+        os.utime(self.storage.path(self.orphan_name), (timestamp, timestamp))
+        self.new_name = self.storage.save(
+            "l2p_pdf/1/foo/hash_new/a.pdf", ContentFile(b"new"))
+
+    def call_command(self, **options):
+        stdout = StringIO()
+        with capture_on_commit_callbacks(execute=True):
+            call_command("reconcile_storage", stdout=stdout, **options)
+        get_cleanup_queue().join()
+        return stdout.getvalue()
+
+    def test_report(self):
+        output = self.call_command(verbosity=2)
+        self.assertIn(
+            "Checked 5 files: 1 orphaned files (6 bytes), 1 pdfs with missing "
+            "files, 1 empty collections.", output)
+        self.assertIn("Orphaned file: %s" % self.orphan_name, output)
+        self.assertIn("Missing file: %s" % self.missing_pdf.pdf.name, output)
+        self.assertNotIn(self.new_name, output)
+
+        self.assertTrue(self.storage.exists(self.orphan_name))
+        self.assertEqual(LatexCollection.objects.count(), 3)
+
+    def test_delete(self):
+        output = self.call_command(delete=True)
+        self.assertIn("Deleted 1 orphaned files and 2 collections.", output)
+
+        self.assertFalse(self.storage.exists(self.orphan_name))
+        self.assertTrue(self.storage.exists(self.new_name))
+        self.assertEqual(
+            list(LatexCollection.objects.values_list("pk", flat=True)),
+            [self.good.pk])
+
+        # The remaining file of the broken collection is deleted
+        self.assertEqual(
+            sorted(storage_file.name for storage_file in iter_storage_files(
+                self.storage, "l2p_pdf")),
+            sorted([self.new_name]
+                   + [pdf.pdf.name for pdf in self.good.entries.all()]))
+
+        output = self.call_command(delete=True, min_age=0)
+        self.assertIn("Checked 3 files: 1 orphaned files", output)
+        self.assertFalse(self.storage.exists(self.new_name))
+
+    def test_usage(self):
+        other_user = self.create_user({
+            "username": "other_user", "password": "mypassword",
+            "email": "other@example.com"})
+        other_project = create_latex_project(
+            other_user, identifier="other-project")
+        create_latex_collection(other_project, "hash_other")
+
+        output = self.call_command(usage=True)
+        good_bytes = sum(pdf.pdf.size for pdf in self.good.entries.all())
+        broken_bytes = self.broken.entries.get(name="b.pdf").pdf.size
+        self.assertIn(
+            "  %s (test_user): 3 files, %d bytes"
+            % (self.project.identifier, good_bytes + broken_bytes), output)
+        self.assertIn("  other_user: 1 files", output)
+
+    def test_iter_pdf_rows(self):
+        names = [row[0] for row in iter_pdf_rows(batch_size=1)]
+        self.assertEqual(names, sorted(names))
+        self.assertEqual(len(names), LatexPdf.objects.count())
+
+    def test_bad_options(self):
+        for options in [{"batch_size": 0}, {"min_age": -1}]:
+            with self.subTest(options=options):
+                with self.assertRaises(CommandError):
+                    self.call_command(**options)
+
+
+class IterStorageFilesTest(L2ITestMixinBase, TestCase):
+    def test_sorted(self):
+        storage = FileSystemStorage()
+        for name in ["r/a0.pdf", "r/a/b.pdf", "r/a.pdf", "r/b/c/d.pdf"]:
+            storage.save(name, ContentFile(b"x"))
+
+        self.assertEqual(
+            [storage_file.name
+             for storage_file in iter_storage_files(storage, "r")],
+            ["r/a.pdf", "r/a/b.pdf", "r/a0.pdf", "r/b/c/d.pdf"])
+
+    def test_not_exist(self):
+        self.assertEqual(
+            list(iter_storage_files(FileSystemStorage(), "not_exist")), [])
@@ -0,0 +1,293 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import sys
+import unittest
+import uuid
+from datetime import datetime
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import is_aware
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, create_latex_project, create_latex_collection)
+from latex.models import LatexCollection, LatexPdf, LatexProject
+from latex.repository import (
+    OrmRepository, PymongoRepository, get_mongo_client, get_repository,
+    model_from_document, values_from_document)
+
+try:
+    import pymongo
+except ImportError:
+    pymongo = None
+
+# e.g., mongodb://localhost:27017
+MONGODB_URI = os.environ.get("L2P_TEST_MONGODB_URI")
+
+
+class OrmRepositoryTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = create_latex_project(self.test_user)
+        self.collection = create_latex_collection(
+            self.project, "hash_0", pdf_names=("a.pdf", "b.pdf"))
+        create_latex_collection(
+            self.project, "hash_errored", compile_error="some error")
+        self.repository = OrmRepository()
+
+    def test_get_collection(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                self.repository.get_collection(self.project.pk, "hash_0"),
+                self.collection)
+        self.assertIsNone(
+            self.repository.get_collection(self.project.pk, "hash_foo"))
+
+    def test_get_latest_collection(self):
+        project = LatexProject.objects.get(pk=self.project.pk)
+        latest = LatexCollection.objects.get(zip_file_hash="hash_errored")
+        with self.assertNumQueries(1):
+            collection = self.repository.get_latest_collection(project)
+            self.assertEqual(collection, latest)
+            self.assertIs(collection.project, project)
+
+        project = create_latex_project(self.test_user, "empty-project")
+        with self.assertNumQueries(0):
+            self.assertIsNone(self.repository.get_latest_collection(project))
+
+    def test_get_pdfs(self):
+        with self.assertNumQueries(1):
+            pdfs = self.repository.get_pdfs(self.collection)
+            self.assertEqual(
+                sorted(pdf.name for pdf in pdfs), ["a.pdf", "b.pdf"])
+            for pdf in pdfs:
+                self.assertIs(pdf.collection, self.collection)
+
+    def test_get_pdf_values_by_hashes(self):
+        with self.assertNumQueries(1):
+            rows = self.repository.get_pdf_values_by_hashes(
+                ["hash_0", "hash_errored", "hash_foo"], ["id", "pdf"])
+        self.assertEqual(
+            sorted(rows, key=lambda row: row["id"]),
+            [{"zip_file_hash": "hash_0", "id": pdf.id, "pdf": pdf.pdf.name}
+             for pdf in LatexPdf.objects.order_by("id")])
+
+    def test_get_compile_errors(self):
+        self.assertEqual(
+            self.repository.get_compile_errors(["hash_0", "hash_errored"]),
+            [("hash_errored", "some error")])
+
+    def test_creator(self):
+        other_user = self.create_user({
+            "username": "other_user", "password": "mypassword",
+            "email": "other_email@example.com"})
+        other_project = create_latex_project(other_user, "other-project")
+        create_latex_collection(other_project, "hash_0")
+        create_latex_collection(
+            other_project, "hash_other", compile_error="other error")
+
+        hashes = ["hash_0", "hash_errored", "hash_other", "hash_foo"]
+        self.assertEqual(
+            self.repository.get_creator_ids_by_hashes(hashes), {
+                "hash_0": {self.test_user.pk, other_user.pk},
+                "hash_errored": {self.test_user.pk},
+                "hash_other": {other_user.pk}})
+        self.assertEqual(
+            {row["id"] for row in self.repository.get_pdf_values_by_hashes(
+                hashes, ["id"], self.test_user.pk)},
+            set(self.collection.entries.values_list("id", flat=True)))
+        self.assertEqual(
+            self.repository.get_compile_errors(hashes, other_user.pk),
+            [("hash_other", "other error")])
+
+
+@unittest.skipUnless(
+    pymongo is not None and MONGODB_URI,
+    "pymongo and L2P_TEST_MONGODB_URI are required")
+class PymongoRepositoryTest(SimpleTestCase):
+    """
+    Run against documents inserted as djongo stores them, in a temporary
+    database.
+    """
+
+    def setUp(self):
+        client = pymongo.MongoClient(MONGODB_URI)
+        database = "l2p_test_%s" % uuid.uuid4().hex
+        self.addCleanup(client.close)
+        self.addCleanup(client.drop_database, database)
+
+        with mock.patch(
+                "latex.repository.get_mongo_client", return_value=client):
+            self.repository = PymongoRepository()
+        self.repository.db = client[database]
+
+        self.insert(LatexProject, [
+            {"id": 1, "identifier": "project", "name": "project",
+             "creator_id": 10},
+            {"id": 2, "identifier": "other", "name": "other",
+             "creator_id": 20}])
+        self.insert(LatexCollection, [
+            {"id": 1, "project_id": 1, "zip_file_hash": "hash_0",
+             "compile_error": None,
+             "creation_time": datetime(2020, 1, 1, 12, 0, 0)},
+            {"id": 2, "project_id": 1, "zip_file_hash": "hash_errored",
+             "compile_error": "some error",
+             "creation_time": datetime(2020, 1, 2, 12, 0, 0)},
+            {"id": 3, "project_id": 2, "zip_file_hash": "hash_0",
+             "compile_error": None,
+             "creation_time": datetime(2020, 1, 3, 12, 0, 0)}])
+        self.insert(LatexPdf, [
+            {"id": pdf_id, "project_id": project_id,
+             "collection_id": collection_id, "name": name,
+             "pdf": "l2p_pdf/%d/hash_0/%s" % (project_id, name),
+             "mediabox": "[0, 0, 595, 842]", "size": 100,
+             "creation_time": datetime(2020, 1, 1, 12, 0, 0)}
+            for pdf_id, project_id, collection_id, name in [
+                (1, 1, 1, "a.pdf"), (2, 1, 1, "b.pdf"), (3, 2, 3, "a.pdf")]])
+
+    def insert(self, model, documents):
+        self.repository.get_mongo_collection(model).insert_many(documents)
+
+    def test_get_collection(self):
+        collection = self.repository.get_collection(1, "hash_0")
+        self.assertIsInstance(collection, LatexCollection)
+        self.assertEqual(collection.pk, 1)
+        self.assertTrue(is_aware(collection.creation_time))
+        self.assertIsNone(self.repository.get_collection(1, "hash_foo"))
+
+    def test_get_latest_collection(self):
+        project = LatexProject(id=1, latest_collection_id=2)
+        collection = self.repository.get_latest_collection(project)
+        self.assertIsInstance(collection, LatexCollection)
+        self.assertEqual(collection.pk, 2)
+        self.assertEqual(collection.compile_error, "some error")
+        self.assertIs(collection.project, project)
+
+        self.assertIsNone(
+            self.repository.get_latest_collection(LatexProject(id=1)))
+        self.assertIsNone(self.repository.get_latest_collection(
+            LatexProject(id=1, latest_collection_id=100)))
+
+    def test_get_pdfs(self):
+        collection = self.repository.get_collection(1, "hash_0")
+        pdfs = self.repository.get_pdfs(collection)
+        self.assertEqual(sorted(pdf.name for pdf in pdfs), ["a.pdf", "b.pdf"])
+        for pdf in pdfs:
+            self.assertIs(pdf.collection, collection)
+            self.assertEqual(pdf.mediabox, [0, 0, 595, 842])
+
+    def test_get_pdf_values_by_hashes(self):
+        rows = self.repository.get_pdf_values_by_hashes(
+            ["hash_0", "hash_errored", "hash_foo"], ["id", "pdf"])
+        self.assertEqual(
+            sorted(rows, key=lambda row: row["id"]),
+            [{"zip_file_hash": "hash_0", "id": pdf_id,
+              "pdf": "l2p_pdf/%d/hash_0/%s" % (project_id, name)}
+             for pdf_id, project_id, name in [
+                 (1, 1, "a.pdf"), (2, 1, "b.pdf"), (3, 2, "a.pdf")]])
+
+        self.assertEqual(
+            self.repository.get_pdf_values_by_hashes(["hash_foo"], ["id"]),
+            [])
+
+    def test_get_compile_errors(self):
+        self.assertEqual(
+            self.repository.get_compile_errors(["hash_0", "hash_errored"]),
+            [("hash_errored", "some error")])
+
+    def test_creator(self):
+        hashes = ["hash_0", "hash_errored"]
+        self.assertEqual(
+            self.repository.get_creator_ids_by_hashes(hashes + ["hash_foo"]),
+            {"hash_0": {10, 20}, "hash_errored": {10}})
+        self.assertEqual(
+            [row["id"] for row in self.repository.get_pdf_values_by_hashes(
+                hashes, ["id"], 20)],
+            [3])
+        self.assertEqual(self.repository.get_compile_errors(hashes, 20), [])
+
+
+@mock.patch("latex.repository._mongo_client", None)
+class GetMongoClientTest(SimpleTestCase):
+    def test_pymongo_not_installed(self):
+        with mock.patch.dict(sys.modules, {"pymongo": None}):
+            with self.assertRaises(ImproperlyConfigured):
+                get_mongo_client()
+
+    @unittest.skipUnless(pymongo is not None, "pymongo is required")
+    def test_shared(self):
+        with mock.patch("pymongo.MongoClient") as mock_client:
+            client = get_mongo_client()
+            self.assertIs(get_mongo_client(), client)
+
+        self.assertEqual(mock_client.call_count, 1)
+        # Connections are made in the workers, after fork
+        self.assertFalse(mock_client.call_args[1]["connect"])
+
+
+class DocumentConversionTest(L2ITestMixinBase, TestCase):
+    def test_model_from_document(self):
+        document = {
+            "_id": "5f0c0a3b1c9d440000a1b2c3",
+            "id": 3, "project_id": 1, "collection_id": 2, "name": "a.pdf",
+            "pdf": "l2p_pdf/1/foo/hash_0/a.pdf",
+            "mediabox": "[0, 0, 595, 842]", "size": 100,
+            "creation_time": datetime(2020, 1, 1, 12, 0, 0)}
+
+        pdf = model_from_document(LatexPdf, document)
+        self.assertIsInstance(pdf, LatexPdf)
+        self.assertFalse(pdf._state.adding)
+        self.assertEqual(pdf.pk, 3)
+        self.assertEqual(pdf.collection_id, 2)
+        self.assertEqual(pdf.pdf.name, "l2p_pdf/1/foo/hash_0/a.pdf")
+        self.assertEqual(pdf.mediabox, [0, 0, 595, 842])
+        self.assertIsNone(pdf.original_size)
+        self.assertTrue(is_aware(pdf.creation_time))
+
+    def test_values_from_document(self):
+        self.assertEqual(
+            values_from_document(
+                LatexCollection,
+                {"id": 1, "zip_file_hash": "hash_0", "compile_error": None},
+                ["id", "compile_error"]),
+            {"id": 1, "compile_error": None})
+
+
+class GetRepositoryTest(TestCase):
+    def test_default(self):
+        self.assertIsInstance(get_repository(), OrmRepository)
+
+    @override_settings(L2P_HOT_READ_BACKEND="foo")
+    def test_unknown_backend(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_repository()
+
+    @override_settings(L2P_HOT_READ_BACKEND="pymongo")
+    def test_pymongo_requires_djongo(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_repository()
@@ -0,0 +1,197 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command, CommandError
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, capture_on_commit_callbacks, create_latex_project,
+    create_latex_collection)
+from latex.cleanup import get_cleanup_queue
+from latex.models import LatexProject, LatexCollection, LatexPdf
+
+
+class RetentionTestMixin(L2ITestMixinBase):
+    def setUp(self):
+        super().setUp()
+        self.project = create_latex_project(self.test_user)
+
+        # hash_0 is the latest
+        for i in range(6):
+            create_latex_collection(
+                self.project, "hash_%d" % i,
+                creation_time=now() - timedelta(days=10 * i))
+        self.project.refresh_from_db()
+
+    def get_remaining_hashes(self, project=None):
+        return set(
+            LatexCollection.objects.filter(project=project or self.project)
+            .values_list("zip_file_hash", flat=True))
+
+    def get_expired_hashes(self):
+        return set(
+            self.project.get_expired_collections()
+            .values_list("zip_file_hash", flat=True))
+
+
+class ExpiredCollectionsTest(RetentionTestMixin, TestCase):
+    def test_no_policy(self):
+        self.assertEqual(self.get_expired_hashes(), set())
+
+    @override_settings(L2P_RETENTION_KEEP_REVISIONS=2)
+    def test_keep_revisions(self):
+        self.assertEqual(
+            self.get_expired_hashes(),
+            {"hash_2", "hash_3", "hash_4", "hash_5"})
+
+    @override_settings(L2P_RETENTION_KEEP_DAYS=25)
+    def test_keep_days(self):
+        self.assertEqual(
+            self.get_expired_hashes(), {"hash_3", "hash_4", "hash_5"})
+
+    @override_settings(
+        L2P_RETENTION_KEEP_REVISIONS=2, L2P_RETENTION_KEEP_DAYS=35)
+    def test_keep_both(self):
+        # kept if either keeps it
+        self.assertEqual(self.get_expired_hashes(), {"hash_4", "hash_5"})
+
+    @override_settings(L2P_RETENTION_KEEP_REVISIONS=2)
+    def test_project_overrides(self):
+        self.project.keep_revisions = 4
+        self.assertEqual(self.get_expired_hashes(), {"hash_4", "hash_5"})
+
+        self.project.keep_revisions = None
+        self.project.keep_days = 15
+        self.assertEqual(
+            self.get_expired_hashes(),
+            {"hash_2", "hash_3", "hash_4", "hash_5"})
+
+    @override_settings(L2P_RETENTION_KEEP_REVISIONS=1)
+    def test_pinned_kept(self):
+        LatexCollection.objects.filter(zip_file_hash="hash_3").update(
+            is_pinned=True)
+        self.assertEqual(
+            self.get_expired_hashes(),
+            {"hash_1", "hash_2", "hash_4", "hash_5"})
+
+    @override_settings(L2P_RETENTION_KEEP_DAYS=1)
+    def test_latest_kept(self):
+        create_latex_collection(
+            self.project, "hash_errored", compile_error="error",
+            creation_time=now() - timedelta(days=2))
+        create_latex_collection(
+            self.project, "hash_new_errored", compile_error="error",
+            creation_time=now() - timedelta(days=1, hours=1))
+        LatexCollection.objects.filter(zip_file_hash="hash_0").update(
+            creation_time=now() - timedelta(days=3))
+        self.project.update_collection_stats()
+
+        expired = self.get_expired_hashes()
+
+        # the latest and the latest successful ones
+        self.assertNotIn("hash_new_errored", expired)
+        self.assertNotIn("hash_0", expired)
+        self.assertIn("hash_errored", expired)
+
+
+@override_settings(L2P_RETENTION_KEEP_REVISIONS=2)
+class GcRevisionsCommandTest(RetentionTestMixin, TestCase):
+    def call_command(self, **options):
+        stdout = StringIO()
+        call_command("gc_revisions", stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_gc(self):
+        pdf_paths = [
+            pdf.pdf.path for pdf in LatexPdf.objects.filter(
+                collection__zip_file_hash="hash_5")]
+        self.assertTrue(all(os.path.isfile(path) for path in pdf_paths))
+
+        with capture_on_commit_callbacks(execute=True):
+            output = self.call_command(batch_size=3)
+        self.assertIn("Deleted 4 collections (4 pdfs) of 1 projects", output)
+        self.assertEqual(self.get_remaining_hashes(), {"hash_0", "hash_1"})
+
+        get_cleanup_queue().join()
+        self.assertFalse(any(os.path.isfile(path) for path in pdf_paths))
+
+        project = LatexProject.objects.get(pk=self.project.pk)
+        self.assertEqual(project.n_collections, 2)
+        self.assertEqual(project.latest_collection.zip_file_hash, "hash_0")
+
+    def test_idempotent(self):
+        self.call_command()
+        output = self.call_command()
+        self.assertIn("Deleted 0 collections", output)
+        self.assertEqual(self.get_remaining_hashes(), {"hash_0", "hash_1"})
+
+    def test_stats_updated_once_per_batch(self):
+        with mock.patch(
+                "latex.models.LatexProject.update_collection_stats",
+                autospec=True) as mock_update:
+            self.call_command(batch_size=3)
+        self.assertEqual(mock_update.call_count, 2)
+
+    def test_dry_run(self):
+        output = self.call_command(dry_run=True)
+        self.assertIn("4 collections of 1 projects would be deleted", output)
+        self.assertEqual(len(self.get_remaining_hashes()), 6)
+
+    def test_limit(self):
+        self.call_command(limit=3, batch_size=2)
+
+        # oldest first
+        self.assertEqual(
+            self.get_remaining_hashes(), {"hash_0", "hash_1", "hash_2"})
+
+    def test_projects(self):
+        other_project = create_latex_project(
+            self.test_user, identifier="other-project")
+        for i in range(3):
+            create_latex_collection(
+                other_project, "other_%d" % i,
+                creation_time=now() - timedelta(days=i))
+
+        self.call_command(projects=["other-project"])
+        self.assertEqual(len(self.get_remaining_hashes()), 6)
+        self.assertEqual(
+            self.get_remaining_hashes(other_project), {"other_0", "other_1"})
+
+    def test_rate(self):
+        with mock.patch("latex.utils.time.sleep") as mock_sleep:
+            self.call_command(batch_size=1, rate=0.01)
+        self.assertEqual(mock_sleep.call_count, 3)
+
+    def test_bad_options(self):
+        for options in [{"batch_size": 0}, {"rate": -1}, {"limit": -1}]:
+            with self.subTest(options=options):
+                with self.assertRaises(CommandError):
+                    self.call_command(**options)
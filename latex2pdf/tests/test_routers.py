@@ -0,0 +1,182 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import shutil
+import tempfile
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ImproperlyConfigured
+from django.contrib.sessions.models import Session
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+from django.utils.functional import SimpleLazyObject
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, improperly_configured_cache_patch)
+from latex.models import LatexProject
+from latex import routers
+from latex.routers import (
+    ReplicaRouter, ReplicaPinningMiddleware, use_primary_db,
+    is_user_pinned_to_primary)
+
+
+@override_settings(L2P_DB_REPLICAS=["replica"])
+class ReplicaRouterTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.router = ReplicaRouter()
+        self.addCleanup(routers._local.__dict__.clear)
+
+        # Pins need a cache shared by the processes
+        cache_dir = tempfile.mkdtemp(prefix="l2p_test_cache_")
+        self.addCleanup(shutil.rmtree, cache_dir)
+        cache_override = override_settings(CACHES={
+            "default": {
+                "BACKEND":
+                    "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": cache_dir,
+            }})
+        cache_override.enable()
+        self.addCleanup(cache_override.disable)
+
+    def get_response(self, user, view=None):
+        request = RequestFactory().get("/")
+        request.user = user
+
+        def get_response(request):
+            self.db_for_read = self.router.db_for_read(LatexProject)
+            if view is not None:
+                view()
+            return HttpResponse()
+
+        ReplicaPinningMiddleware(get_response)(request)
+        return self.db_for_read
+
+    def test_reads_to_replica(self):
+        self.assertEqual(self.router.db_for_read(LatexProject), "replica")
+        self.assertEqual(self.router.db_for_write(LatexProject), "default")
+
+    @override_settings(L2P_DB_REPLICAS=[])
+    def test_no_replicas(self):
+        self.assertIsNone(self.router.db_for_read(LatexProject))
+
+    def test_reads_after_write_in_request_to_primary(self):
+        self.router.db_for_write(Session)
+        self.assertIsNone(self.router.db_for_read(LatexProject))
+
+    def test_use_primary_db(self):
+        @use_primary_db
+        def view():
+            return self.router.db_for_read(LatexProject)
+
+        self.assertIsNone(view())
+
+    def test_allow_migrate(self):
+        self.assertFalse(self.router.allow_migrate("replica", "latex"))
+        self.assertIsNone(self.router.allow_migrate("default", "latex"))
+
+    def test_allow_relation(self):
+        project1 = LatexProject()
+        project1._state.db = "replica"
+        project2 = LatexProject()
+        project2._state.db = "default"
+        self.assertTrue(self.router.allow_relation(project1, project2))
+
+        project2._state.db = "other"
+        self.assertIsNone(self.router.allow_relation(project1, project2))
+
+    def test_user_pinned_after_app_write(self):
+        self.assertEqual(self.get_response(self.test_user), "replica")
+
+        self.get_response(
+            self.test_user,
+            view=lambda: self.router.db_for_write(LatexProject))
+        self.assertTrue(is_user_pinned_to_primary(self.test_user.pk))
+
+        # The next request of the user reads from the primary
+        self.assertIsNone(self.get_response(self.test_user))
+
+        # but not those of the others
+        self.assertEqual(self.get_response(self.superuser), "replica")
+        self.assertEqual(self.get_response(AnonymousUser()), "replica")
+
+    @override_settings(L2P_DB_REPLICA_PIN_SECONDS=0)
+    def test_user_pin_expires(self):
+        self.get_response(
+            self.test_user,
+            view=lambda: self.router.db_for_write(LatexProject))
+        self.assertEqual(self.get_response(self.test_user), "replica")
+
+    def test_user_not_pinned_after_other_writes(self):
+        self.get_response(
+            self.test_user, view=lambda: self.router.db_for_write(Session))
+        self.assertFalse(is_user_pinned_to_primary(self.test_user.pk))
+
+    def test_lazy_user_not_resolved(self):
+        pin_user = self.test_user
+
+        def get_user():
+            raise AssertionError("the user should not be resolved")
+
+        routers.pin_user_to_primary(pin_user.pk)
+        self.assertEqual(
+            self.get_response(SimpleLazyObject(get_user)), "replica")
+
+        # Once resolved (e.g., by the auth of the view), it is used
+        lazy_user = SimpleLazyObject(lambda: pin_user)
+        self.assertEqual(lazy_user.pk, pin_user.pk)
+        self.assertIsNone(self.get_response(lazy_user))
+
+    def test_state_cleared_after_request(self):
+        self.get_response(
+            self.test_user, view=lambda: self.router.db_for_write(LatexProject))
+        self.assertEqual(routers._local.__dict__, {})
+
+    def test_process_local_cache_not_allowed(self):
+        with override_settings(CACHES={
+                "default": {
+                    "BACKEND":
+                        "django.core.cache.backends.locmem.LocMemCache"}}):
+            with self.assertRaises(ImproperlyConfigured):
+                self.get_response(
+                    self.test_user,
+                    view=lambda: self.router.db_for_write(LatexProject))
+            with self.assertRaises(ImproperlyConfigured):
+                self.get_response(self.test_user)
+
+    def test_cache_not_configured(self):
+        with improperly_configured_cache_patch():
+            with self.assertRaises(ImproperlyConfigured):
+                self.get_response(self.test_user)
+
+    @override_settings(L2P_DB_REPLICAS=[])
+    def test_no_replicas_process_local_cache(self):
+        with override_settings(CACHES={
+                "default": {
+                    "BACKEND":
+                        "django.core.cache.backends.locmem.LocMemCache"}}):
+            self.assertIsNone(self.get_response(
+                self.test_user,
+                view=lambda: self.router.db_for_write(LatexProject)))
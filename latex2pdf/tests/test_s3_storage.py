@@ -0,0 +1,113 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.test import SimpleTestCase
+
+from latex.cleanup import delete_storage_files, iter_storage_files
+from latex.storage import TieredStorage
+
+try:
+    from django_s3_storage.storage import S3Storage
+    try:
+        from moto import mock_aws
+    except ImportError:
+        # moto < 5
+        from moto import mock_s3 as mock_aws
+except ImportError:
+    mock_aws = None
+
+BUCKET_NAME = "l2p-test"
+
+
+@unittest.skipUnless(
+    mock_aws is not None, "moto and django-s3-storage are required")
+class S3StorageTest(SimpleTestCase):
+    def setUp(self):
+        aws_mock = mock_aws()
+        aws_mock.start()
+        self.addCleanup(aws_mock.stop)
+
+        self.storage = S3Storage(
+            aws_region="us-east-1", aws_access_key_id="testing",
+            aws_secret_access_key="testing", aws_s3_bucket_name=BUCKET_NAME,
+            aws_s3_key_prefix="prefix")
+        self.storage.s3_connection.create_bucket(Bucket=BUCKET_NAME)
+
+    def save(self, names, content=b"1111"):
+        return [self.storage.save(name, ContentFile(content))
+                for name in names]
+
+    def test_iter_storage_files(self):
+        self.save(["a/1.pdf", "a/b/2.pdf", "a0.pdf", "b/3.pdf"])
+
+        files = list(iter_storage_files(self.storage, "a"))
+        self.assertEqual(
+            [storage_file.name for storage_file in files],
+            ["a/1.pdf", "a/b/2.pdf"])
+        for storage_file in files:
+            self.assertEqual(storage_file.size, 4)
+            self.assertIsNotNone(storage_file.modified_time)
+
+        self.assertEqual(list(iter_storage_files(self.storage, "c")), [])
+
+    def test_delete_storage_files(self):
+        names = self.save(["a/1.pdf", "a/2.pdf", "a/3.pdf", "a/4.pdf"])
+
+        with mock.patch("latex.cleanup.S3_DELETE_OBJECTS_MAX_KEYS", 2), \
+                mock.patch.object(
+                    self.storage, "delete",
+                    side_effect=AssertionError("deleted one by one")):
+            delete_storage_files(self.storage, names[:3])
+
+        self.assertEqual(
+            [name for name in names if self.storage.exists(name)],
+            ["a/4.pdf"])
+
+    def test_file_size(self):
+        name, = self.save(["a/1.pdf"], b"0123456789")
+        with self.storage.open(name) as f:
+            self.assertEqual(f.size, 10)
+            self.assertEqual(f.read(), b"0123456789")
+
+    def test_tiered_storage(self):
+        local_dir = tempfile.mkdtemp(prefix="l2p_test_local_")
+        self.addCleanup(shutil.rmtree, local_dir)
+        storage = TieredStorage(
+            remote=self.storage, local_location=local_dir, max_bytes=10)
+
+        small, big = self.save(["small.pdf"]) + self.save(["big.pdf"], b"x" * 20)
+
+        for name, content in [(small, b"1111"), (big, b"x" * 20)]:
+            with storage.open(name) as f:
+                self.assertEqual(f.read(), content)
+
+        self.assertTrue(storage.local.exists(small))
+        self.assertFalse(storage.local.exists(big))
+        self.assertEqual(storage.local_index.total_bytes, 4)
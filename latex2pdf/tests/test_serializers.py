@@ -0,0 +1,110 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+from django.db.models import F
+from django.test import TestCase, override_settings
+from rest_framework.test import APIRequestFactory
+
+from tests.base_test_mixins import (
+    L2ITestMixinBase, create_latex_project, create_latex_collection)
+from latex.models import LatexPdf
+from latex.serializers import LatexPdfSerializer
+
+
+class LatexPdfSerializerTest(L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        project = create_latex_project(self.test_user)
+        create_latex_collection(
+            project, "hash_0", pdf_names=("a.pdf", "b.pdf"))
+        self.request = APIRequestFactory().get("/api/list")
+
+    def test_field_subset_class_cached(self):
+        serializer = LatexPdfSerializer(fields="pdf")
+        self.assertEqual(list(serializer.fields), ["pdf"])
+        self.assertIsNot(type(serializer), LatexPdfSerializer)
+        self.assertIsInstance(serializer, LatexPdfSerializer)
+
+        self.assertIs(type(LatexPdfSerializer(fields="pdf")), type(serializer))
+        self.assertIs(
+            type(LatexPdfSerializer(fields="pdf,foo")), type(serializer))
+        self.assertIs(
+            type(LatexPdfSerializer(fields="id,pdf")),
+            type(LatexPdfSerializer(fields="pdf,id")))
+
+        self.assertEqual(list(LatexPdfSerializer(fields="foo").fields), [])
+        self.assertEqual(
+            list(LatexPdfSerializer().fields), ["id", "pdf"])
+
+    def test_many(self):
+        data = LatexPdfSerializer(
+            LatexPdf.objects.order_by("id"), many=True, fields="id").data
+        self.assertEqual(
+            [dict(item) for item in data],
+            [{"id": pk} for pk in
+             LatexPdf.objects.order_by("id").values_list("id", flat=True)])
+
+    def assert_values_same_as_instances(self, fields=None):
+        serializer = LatexPdfSerializer(
+            fields=fields, context={"request": self.request})
+        rows = LatexPdf.objects.order_by("id").values(
+            *serializer.get_value_sources(),
+            zip_file_hash=F("collection__zip_file_hash"))
+        instances = LatexPdf.objects.order_by("id")
+
+        self.assertEqual(
+            [serializer.values_to_representation(row) for row in rows],
+            [serializer.to_representation(instance) for instance in instances])
+
+    @override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=True)
+    def test_values_relative_path(self):
+        self.assert_values_same_as_instances()
+        self.assert_values_same_as_instances("pdf")
+
+    @override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=False)
+    def test_values_url(self):
+        self.assert_values_same_as_instances()
+        self.assert_values_same_as_instances("id")
+
+    @override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=False)
+    def test_url_is_served(self):
+        self.assert_values_same_as_instances("pdf")
+
+        pdf = LatexPdf.objects.order_by("id").first()
+        url = LatexPdfSerializer(
+            pdf, fields="pdf", context={"request": self.request}).data["pdf"]
+        self.assertEqual(
+            url, "http://testserver" + pdf.get_absolute_url())
+
+        self.client.force_login(self.test_user)
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            b"".join(resp.streaming_content), pdf.pdf.open("rb").read())
+
+    @override_settings(L2P_API_PDF_RETURNS_RELATIVE_PATH=False)
+    def test_values_empty_file(self):
+        LatexPdf.objects.update(pdf="")
+        self.assert_values_same_as_instances()
@@ -0,0 +1,175 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase
+
+from latex.cleanup import iter_storage_files
+from latex.storage import TieredStorage
+
+
+class CountingStorage(FileSystemStorage):
+    """
+    A local stand-in of the remote (S3) storage, counting the files opened.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.opened = []
+
+    def _open(self, name, mode="rb"):
+        self.opened.append(name)
+        return super()._open(name, mode)
+
+
+class TieredStorageTest(SimpleTestCase):
+    def setUp(self):
+        self.remote_dir = tempfile.mkdtemp(prefix="l2p_test_remote_")
+        self.addCleanup(shutil.rmtree, self.remote_dir)
+        self.local_dir = tempfile.mkdtemp(prefix="l2p_test_local_")
+        self.addCleanup(shutil.rmtree, self.local_dir)
+
+        self.remote = CountingStorage(location=self.remote_dir)
+        self.storage = self.get_storage()
+
+    def get_storage(self, max_bytes=10):
+        return TieredStorage(
+            remote=self.remote, local_location=self.local_dir,
+            max_bytes=max_bytes)
+
+    def local_exists(self, name):
+        return os.path.isfile(os.path.join(self.local_dir, name))
+
+    def read(self, name):
+        with self.storage.open(name) as f:
+            return f.read()
+
+    def test_write_through(self):
+        name = self.storage.save("a/1.pdf", ContentFile(b"1111"))
+        self.assertEqual(name, "a/1.pdf")
+        self.assertTrue(self.remote.exists(name))
+        self.assertTrue(self.local_exists(name))
+
+        self.assertEqual(self.read(name), b"1111")
+        self.assertEqual(self.storage.size(name), 4)
+        self.assertEqual(self.remote.opened, [])
+
+    def test_fetch_missing_local_copy(self):
+        self.remote.save("a/1.pdf", ContentFile(b"1111"))
+        self.assertTrue(self.storage.exists("a/1.pdf"))
+        self.assertFalse(self.local_exists("a/1.pdf"))
+
+        self.assertEqual(self.read("a/1.pdf"), b"1111")
+        self.assertEqual(self.read("a/1.pdf"), b"1111")
+        self.assertEqual(self.remote.opened, ["a/1.pdf"])
+        self.assertTrue(self.local_exists("a/1.pdf"))
+
+    def test_lru_eviction(self):
+        for name in ["1.pdf", "2.pdf"]:
+            self.storage.save(name, ContentFile(b"1111"))
+
+        # 1.pdf is now more recently used than 2.pdf
+        self.read("1.pdf")
+        self.storage.save("3.pdf", ContentFile(b"3333"))
+
+        self.assertTrue(self.local_exists("1.pdf"))
+        self.assertFalse(self.local_exists("2.pdf"))
+        self.assertTrue(self.local_exists("3.pdf"))
+        self.assertEqual(self.storage.local_index.total_bytes, 8)
+
+        # Evicted files are still served
+        self.assertEqual(self.read("2.pdf"), b"1111")
+        self.assertEqual(self.remote.opened, ["2.pdf"])
+
+    def test_file_larger_than_local_cache(self):
+        name = self.storage.save("big.pdf", ContentFile(b"x" * 20))
+        self.assertFalse(self.local_exists(name))
+        self.assertEqual(self.read(name), b"x" * 20)
+        self.assertFalse(self.local_exists(name))
+
+    def test_index_rebuilt_from_disk(self):
+        for name in ["1.pdf", "2.pdf"]:
+            self.storage.save(name, ContentFile(b"1111"))
+
+        storage = self.get_storage()
+        self.assertEqual(storage.local_index.total_bytes, 8)
+        storage.save("3.pdf", ContentFile(b"3333"))
+        self.assertEqual(
+            len([name for name in ["1.pdf", "2.pdf"]
+                 if self.local_exists(name)]), 1)
+
+    def test_shared_by_processes(self):
+        # Indexes of other processes, sharing the local directory
+        other = self.get_storage()
+        self.assertEqual(self.storage.local_index.total_bytes, 0)
+        self.assertEqual(other.local_index.total_bytes, 0)
+
+        for name in ["1.pdf", "2.pdf"]:
+            self.storage.save(name, ContentFile(b"1111"))
+        for name in ["3.pdf", "4.pdf"]:
+            other.save(name, ContentFile(b"3333"))
+
+        local_bytes = sum(
+            os.path.getsize(os.path.join(self.local_dir, name))
+            for name in ["1.pdf", "2.pdf", "3.pdf", "4.pdf"]
+            if self.local_exists(name))
+        self.assertLessEqual(local_bytes, 10)
+        self.assertEqual(self.storage.local_index.total_bytes, local_bytes)
+        self.assertEqual(other.local_index.total_bytes, local_bytes)
+        self.assertTrue(self.local_exists("4.pdf"))
+
+    def test_exists_checks_remote(self):
+        name = self.storage.save("1.pdf", ContentFile(b"1111"))
+        self.assertTrue(self.storage.exists(name))
+
+        # e.g., deleted by the cleanup of another node
+        self.remote.delete(name)
+        self.assertTrue(self.local_exists(name))
+        self.assertFalse(self.storage.exists(name))
+
+    def test_delete(self):
+        names = [
+            self.storage.save(name, ContentFile(b"1"))
+            for name in ["1.pdf", "2.pdf", "3.pdf"]]
+
+        self.storage.delete(names[0])
+        self.storage.delete_many(names[1:])
+
+        for name in names:
+            self.assertFalse(self.storage.exists(name))
+            self.assertFalse(self.local_exists(name))
+        self.assertEqual(self.storage.local_index.total_bytes, 0)
+
+    def test_iter_files(self):
+        self.remote.save("r/1.pdf", ContentFile(b"1"))
+        self.assertEqual(
+            [storage_file.name
+             for storage_file in iter_storage_files(self.storage, "r")],
+            ["r/1.pdf"])
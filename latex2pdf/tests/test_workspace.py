@@ -0,0 +1,343 @@
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import zipfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from tests.base_test_mixins import L2ITestMixinBase, create_latex_project
+from latex.converter import LatexCompileError
+from latex.models import LatexCollection
+from latex.workspace import (
+    TRASH_PREFIX, WORKSPACE_PREFIX, TooManyCompiles, WorkspaceBudgetExceeded,
+    WorkspaceManager, compile_slot, estimate_zip_workspace_bytes,
+    get_compile_semaphore, get_process_start_time, get_workspace_owner,
+    is_workspace_owner_alive)
+
+
+def get_zip_file_content(files):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as zf:
+        for name, content in files.items():
+            zf.writestr(name, content)
+    return buf.getvalue()
+
+
+class WorkspaceManagerTestMixin(object):
+    def setUp(self):
+        super().setUp()
+        self.tmpfs_root = tempfile.mkdtemp(prefix="l2p_test_tmpfs_")
+        self.addCleanup(shutil.rmtree, self.tmpfs_root)
+        self.disk_root = tempfile.mkdtemp(prefix="l2p_test_disk_")
+        self.addCleanup(shutil.rmtree, self.disk_root)
+
+        self.manager = WorkspaceManager(
+            tmpfs_root=self.tmpfs_root, disk_root=self.disk_root,
+            tmpfs_max_bytes=100, tmpfs_budget_bytes=150,
+            disk_budget_bytes=1000)
+
+
+class WorkspaceManagerTest(WorkspaceManagerTestMixin, SimpleTestCase):
+    def test_workspace(self):
+        with self.manager.workspace(10) as working_dir:
+            self.assertEqual(os.path.dirname(working_dir), self.tmpfs_root)
+            self.assertTrue(os.path.basename(working_dir).startswith(
+                "%s%s-" % (WORKSPACE_PREFIX, get_workspace_owner())))
+            with open(os.path.join(working_dir, "main.tex"), "w") as f:
+                f.write("foo")
+            self.assertEqual(self.manager.usage[self.tmpfs_root], 10)
+
+        self.manager.deleter.join()
+        self.assertFalse(os.path.exists(working_dir))
+        self.assertEqual(os.listdir(self.tmpfs_root), [])
+        self.assertEqual(self.manager.usage[self.tmpfs_root], 0)
+
+    def test_workspace_deleted_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.manager.workspace() as working_dir:
+                raise ValueError()
+
+        self.manager.deleter.join()
+        self.assertFalse(os.path.exists(working_dir))
+
+    def test_large_workspace_on_disk(self):
+        with self.manager.workspace(101) as working_dir:
+            self.assertEqual(os.path.dirname(working_dir), self.disk_root)
+
+    def test_no_tmpfs(self):
+        manager = WorkspaceManager(
+            tmpfs_root=None, disk_root=self.disk_root,
+            tmpfs_max_bytes=100, tmpfs_budget_bytes=150,
+            disk_budget_bytes=1000)
+        with manager.workspace(10) as working_dir:
+            self.assertEqual(os.path.dirname(working_dir), self.disk_root)
+
+    def test_budget(self):
+        with self.manager.workspace(100) as first:
+            with self.manager.workspace(100) as second:
+                self.assertEqual(os.path.dirname(first), self.tmpfs_root)
+                self.assertEqual(os.path.dirname(second), self.disk_root)
+
+                with self.assertRaises(WorkspaceBudgetExceeded):
+                    with self.manager.workspace(901):
+                        pass
+
+    def test_pending_deletions_reclaimed(self):
+        with mock.patch.object(self.manager.deleter, "ensure_worker"):
+            with self.manager.workspace(900):
+                pass
+            self.assertEqual(len(os.listdir(self.disk_root)), 1)
+
+            # Only fits after the pending deletion
+            with self.manager.workspace(900) as working_dir:
+                self.assertEqual(os.listdir(self.disk_root),
+                                 [os.path.basename(working_dir)])
+
+    def test_cleanup_stale_workspaces(self):
+        process = subprocess.Popen(["true"])
+        process.wait()
+
+        stale = os.path.join(
+            self.tmpfs_root, "%s%d-stale" % (WORKSPACE_PREFIX, process.pid))
+        trash = os.path.join(self.disk_root, TRASH_PREFIX + "foo")
+        alive = os.path.join(
+            self.tmpfs_root,
+            "%s%s-alive" % (WORKSPACE_PREFIX, get_workspace_owner()))
+        # Of a process of a previous run with the pid of this process
+        reused = os.path.join(
+            self.tmpfs_root, "%s%d.1-reused" % (WORKSPACE_PREFIX, os.getpid()))
+        other = os.path.join(self.disk_root, "other")
+        for path in [stale, trash, alive, reused, other]:
+            os.makedirs(os.path.join(path, "sub"))
+
+        self.assertEqual(self.manager.cleanup_stale_workspaces(), 3)
+        self.manager.deleter.join()
+
+        self.assertEqual(os.listdir(self.tmpfs_root), [os.path.basename(alive)])
+        self.assertEqual(os.listdir(self.disk_root), ["other"])
+
+    def test_free_space_minus_reservations(self):
+        manager = WorkspaceManager(
+            tmpfs_root=None, disk_root=self.disk_root,
+            tmpfs_max_bytes=0, tmpfs_budget_bytes=0,
+            disk_budget_bytes=10 ** 6)
+
+        free = mock.Mock(free=1000)
+        with mock.patch("latex.workspace.shutil.disk_usage",
+                        return_value=free):
+            with manager.workspace(600):
+                # Not filled yet, but reserved
+                with self.assertRaises(WorkspaceBudgetExceeded):
+                    with manager.workspace(600):
+                        pass
+
+                with manager.workspace(400):
+                    pass
+
+        manager.deleter.join()
+
+    def test_cleanup_workspaces_command(self):
+        process = subprocess.Popen(["true"])
+        process.wait()
+
+        stale = os.path.join(
+            self.disk_root, "%s%d-stale" % (WORKSPACE_PREFIX, process.pid))
+        os.makedirs(os.path.join(stale, "sub"))
+
+        stdout = io.StringIO()
+        with mock.patch(
+                "latex.management.commands.cleanup_workspaces"
+                ".get_workspace_manager", return_value=self.manager):
+            call_command("cleanup_workspaces", stdout=stdout)
+
+        self.assertEqual(os.listdir(self.disk_root), [])
+        self.assertIn("Deleted 1 stale workspace(s)", stdout.getvalue())
+
+    def test_tmpfs_off_by_default(self):
+        self.assertIsNone(WorkspaceManager.from_settings().tmpfs_root)
+
+    def test_estimate_zip_workspace_bytes(self):
+        content = get_zip_file_content({"a.tex": "a" * 10, "b/c.tex": "c" * 5})
+        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+            self.assertEqual(estimate_zip_workspace_bytes(zf), 30)
+
+
+class CompileSlotTest(SimpleTestCase):
+    @override_settings(
+        L2P_MAX_CONCURRENT_COMPILES=2, L2P_COMPILE_WAIT_SECONDS=0)
+    def test_limit(self):
+        with compile_slot():
+            with compile_slot():
+                with self.assertRaises(TooManyCompiles):
+                    with compile_slot():
+                        pass
+
+        # released
+        with compile_slot():
+            with compile_slot():
+                pass
+
+    @override_settings(
+        L2P_MAX_CONCURRENT_COMPILES=1, L2P_COMPILE_WAIT_SECONDS=5)
+    def test_wait(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def compile():
+            with compile_slot():
+                started.set()
+                release.wait()
+
+        thread = threading.Thread(target=compile)
+        thread.start()
+        self.addCleanup(thread.join)
+        started.wait()
+
+        threading.Timer(0.1, release.set).start()
+        with compile_slot():
+            self.assertTrue(release.is_set())
+
+    @override_settings(L2P_MAX_CONCURRENT_COMPILES=0)
+    def test_no_limit(self):
+        self.assertIsNone(get_compile_semaphore())
+        with compile_slot():
+            with compile_slot():
+                pass
+
+
+class CompileProjectWorkspaceTest(
+        WorkspaceManagerTestMixin, L2ITestMixinBase, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.project = create_latex_project(self.test_user)
+        self.c.force_login(self.test_user)
+
+        fake_get_manager = mock.patch(
+            "latex.views.get_workspace_manager", return_value=self.manager)
+        fake_get_manager.start()
+        self.addCleanup(fake_get_manager.stop)
+
+    def post_zip_file(self):
+        zip_file = SimpleUploadedFile(
+            "foo.zip", get_zip_file_content({
+                ".latexmkrc": "@default_files = ('main.tex');",
+                "main.tex": "foo"}),
+            content_type="application/zip")
+        return self.c.post(
+            reverse("project-compile", args=(self.project.identifier,)),
+            data={"zip_file": zip_file, "compiler": "xelatex"})
+
+    def test_compile_error(self):
+        working_dirs = []
+
+        def fake_convert(working_dir, compiler):
+            working_dirs.append(working_dir)
+            self.assertTrue(
+                os.path.isfile(os.path.join(working_dir, "main.tex")))
+            raise LatexCompileError("foo")
+
+        with mock.patch(
+                "latex.views.unzipped_folder_to_pdf_converter",
+                side_effect=fake_convert):
+            resp = self.post_zip_file()
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(
+            LatexCollection.objects.get(project=self.project).compile_error,
+            "LatexCompileError: foo")
+
+        self.manager.deleter.join()
+        self.assertEqual(len(working_dirs), 1)
+        self.assertFalse(os.path.exists(working_dirs[0]))
+
+    def test_budget_exceeded(self):
+        self.manager.budgets[self.tmpfs_root] = 0
+        self.manager.budgets[self.disk_root] = 0
+        with mock.patch(
+                "latex.views.unzipped_folder_to_pdf_converter") as mock_convert:
+            resp = self.post_zip_file()
+
+        self.assertEqual(resp.status_code, 503)
+        mock_convert.assert_not_called()
+        self.assertFalse(LatexCollection.objects.exists())
+
+    @override_settings(
+        L2P_MAX_CONCURRENT_COMPILES=1, L2P_COMPILE_WAIT_SECONDS=0)
+    def test_too_many_compiles(self):
+        with compile_slot():
+            with mock.patch(
+                    "latex.views.unzipped_folder_to_pdf_converter"
+            ) as mock_convert:
+                resp = self.post_zip_file()
+
+        self.assertEqual(resp.status_code, 503)
+        mock_convert.assert_not_called()
+        self.assertFalse(LatexCollection.objects.exists())
+        # no workspace was created
+        self.assertEqual(os.listdir(self.tmpfs_root), [])
+
+
+class WorkspaceOwnerTest(SimpleTestCase):
+    def test_get_process_start_time(self):
+        start_time = get_process_start_time(os.getpid())
+        if start_time is None:
+            self.skipTest("/proc is not available")
+        self.assertTrue(start_time.isdigit())
+
+        stat = "1 (a) b) S" + " 0" * 18 + " 12345 0 0"
+        with mock.patch("builtins.open", mock.mock_open(read_data=stat)):
+            self.assertEqual(get_process_start_time(1), "12345")
+
+        with mock.patch("builtins.open", mock.mock_open(read_data="1 (a)")):
+            self.assertIsNone(get_process_start_time(1))
+
+    def test_process_start_time_not_available(self):
+        with mock.patch("builtins.open", side_effect=FileNotFoundError):
+            self.assertIsNone(get_process_start_time(os.getpid()))
+            self.assertEqual(get_workspace_owner(), str(os.getpid()))
+            self.assertTrue(is_workspace_owner_alive(
+                "%d.1" % os.getpid()))
+
+    def test_is_workspace_owner_alive(self):
+        process = subprocess.Popen(["true"])
+        process.wait()
+
+        self.assertTrue(is_workspace_owner_alive(get_workspace_owner()))
+        self.assertTrue(is_workspace_owner_alive(str(os.getpid())))
+        self.assertFalse(is_workspace_owner_alive(str(process.pid)))
+        self.assertFalse(is_workspace_owner_alive("%d.1" % process.pid))
+        self.assertIsNone(is_workspace_owner_alive("foo"))
+        if get_process_start_time(os.getpid()) is not None:
+            self.assertFalse(is_workspace_owner_alive("%d.1" % os.getpid()))
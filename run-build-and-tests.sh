@@ -11,6 +11,7 @@ sudo apt-get -y install --no-install-recommends -qq $(awk '{print $1'} texlive_a
 tex --version
 echo codecov >> "$APPDIR"/requirements.txt
 echo factory_boy >> "$APPDIR"/requirements.txt
+echo moto >> "$APPDIR"/requirements.txt
 pip install --no-cache-dir -r "$APPDIR"/requirements.txt
 
 # if you need to install extra packages, specify in EXTRA_PACKAGE in Travis options.